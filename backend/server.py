@@ -1,9 +1,11 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, UploadFile, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, File, UploadFile, Form, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, FileResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import os
 import logging
 from pathlib import Path
@@ -11,17 +13,33 @@ from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import uuid
 import base64
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate, parsedate_to_datetime
 import jwt
 from passlib.context import CryptContext
 import shutil
-from fastapi.staticfiles import StaticFiles
 import pandas as pd
 from io import BytesIO
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 import unicodedata
 import urllib.parse
+import hashlib
+import hmac
+import json
+import functools
+import itertools
+import io
+import zipfile
+import asyncio
+import aiofiles
+import time
+from collections import OrderedDict
+import multiprocessing
+import tempfile
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, NamedTuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -43,12 +61,129 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = "your-secret-key-here"  # In production, use environment variable
 ALGORITHM = "HS256"
 
+# Password hashing pool - bcrypt is CPU bound, so it runs off the event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '4'))
+PASSWORD_HASH_MAX_CONCURRENT = int(os.environ.get('PASSWORD_HASH_MAX_CONCURRENT', str(PASSWORD_HASH_WORKERS * 2)))
+password_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+password_hash_slots = asyncio.Semaphore(PASSWORD_HASH_MAX_CONCURRENT)
+
+# Principal cache - auth-relevant user fields kept in-process to skip a users lookup per request
+PRINCIPAL_CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', '60'))
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', '1024'))
+
+# Stateless JWT mode - tokens carry role/agent_id claims plus a per-user token version
+JWT_STATELESS_CLAIMS = os.environ.get('JWT_STATELESS_CLAIMS', 'false').lower() == 'true'
+TOKEN_REVOCATION_REFRESH_SECONDS = float(os.environ.get('TOKEN_REVOCATION_REFRESH_SECONDS', '30'))
+
 # Create uploads directory
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
-# Mount static files
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Where documents, thumbnails, archived receipts and blobs are kept: "local" (UPLOAD_DIR, RECEIPT_ARCHIVE_DIR,
+# BLOB_DIR) or "s3" (one S3-compatible bucket shared by every API node; credentials from the usual AWS settings)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local').lower()
+if STORAGE_BACKEND not in ("local", "s3"):
+    raise ValueError(f"Unsupported STORAGE_BACKEND: {STORAGE_BACKEND}")
+S3_BUCKET = os.environ.get('S3_BUCKET', '')
+if STORAGE_BACKEND == "s3" and not S3_BUCKET:
+    raise ValueError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+S3_PREFIX = os.environ.get('S3_PREFIX', '')  # e.g. "annaiconnect/" to share a bucket
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None  # MinIO, Ceph, LocalStack...
+S3_REGION = os.environ.get('S3_REGION') or None
+# Files above the threshold are uploaded (and downloaded) in parts of this size, several at a time
+S3_MULTIPART_THRESHOLD = int(os.environ.get('S3_MULTIPART_THRESHOLD', str(8 * 1024 * 1024)))
+S3_MULTIPART_CHUNK_SIZE = int(os.environ.get('S3_MULTIPART_CHUNK_SIZE', str(8 * 1024 * 1024)))
+S3_MULTIPART_CONCURRENCY = int(os.environ.get('S3_MULTIPART_CONCURRENCY', '4'))
+s3_client = None
+
+# Student document uploads are streamed to disk in chunks, with a size cap per file type
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+DOCUMENT_IMAGE_MAX_BYTES = int(os.environ.get('DOCUMENT_IMAGE_MAX_BYTES', str(10 * 1024 * 1024)))
+DOCUMENT_PDF_MAX_BYTES = int(os.environ.get('DOCUMENT_PDF_MAX_BYTES', str(20 * 1024 * 1024)))
+# Document downloads are sent in fixed chunks of this size (or handed to the server's pathsend, when available)
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', str(1024 * 1024)))
+# Document listings hand out HMAC-signed download links valid for roughly this long (between 1x and 2x)
+DOCUMENT_URL_TTL_SECONDS = int(os.environ.get('DOCUMENT_URL_TTL_SECONDS', '300'))
+# Who sends document bytes: "app" (this process), "x-accel-redirect" (nginx) or "x-sendfile" (Apache / lighttpd)
+DOCUMENT_SERVE_MODE = os.environ.get('DOCUMENT_SERVE_MODE', 'app').lower()
+if DOCUMENT_SERVE_MODE not in ("app", "x-accel-redirect", "x-sendfile"):
+    raise ValueError(f"Unsupported DOCUMENT_SERVE_MODE: {DOCUMENT_SERVE_MODE}")
+if DOCUMENT_SERVE_MODE != "app" and STORAGE_BACKEND != "local":
+    raise ValueError(f"DOCUMENT_SERVE_MODE={DOCUMENT_SERVE_MODE} needs the files on local disk (STORAGE_BACKEND=local)")
+# nginx `internal` location that aliases UPLOAD_DIR (x-accel-redirect mode)
+DOCUMENT_ACCEL_PREFIX = os.environ.get('DOCUMENT_ACCEL_PREFIX', '/internal/uploads/')
+# Student documents are stored once per distinct content (SHA-256), reference counted in db.document_objects,
+# fanned out as objects/ab/cd/<sha256> (see DocumentStore.path_for)
+DOCUMENT_STORE_DIR = UPLOAD_DIR / "objects"
+# An upload of bytes whose last reference is being deleted waits this long before giving up with 503;
+# a deletion claimed longer ago than DOCUMENT_DELETE_CLAIM_SECONDS is treated as abandoned (crashed worker)
+DOCUMENT_INGEST_WAIT_SECONDS = float(os.environ.get('DOCUMENT_INGEST_WAIT_SECONDS', '10'))
+DOCUMENT_DELETE_CLAIM_SECONDS = float(os.environ.get('DOCUMENT_DELETE_CLAIM_SECONDS', '60'))
+
+# Image documents get downscaled JPEG derivatives (per content hash) built in a process pool after upload
+DOCUMENT_DERIVATIVES_DIR = UPLOAD_DIR / "derived"
+DOCUMENT_IMAGE_VARIANTS = {"small": 240, "medium": 1024, "optimized": 2048}  # variant: longest side (px)
+DOCUMENT_IMAGE_QUALITY = int(os.environ.get('DOCUMENT_IMAGE_QUALITY', '82'))
+IMAGE_PROCESSING_WORKERS = int(os.environ.get('IMAGE_PROCESSING_WORKERS', '2'))
+image_processing_executor = None
+DOCUMENT_EXPORT_BATCH_SIZE = 100  # students whose document records are loaded per query during a ZIP export
+# Document types every application needs (admin completeness report)
+REQUIRED_DOCUMENT_TYPES = [
+    document_type.strip()
+    for document_type in os.environ.get('REQUIRED_DOCUMENT_TYPES', 'tc,id_proof,marksheet').split(',')
+    if document_type.strip()
+]
+
+# Resumable uploads: partial files live here until finalized; idle sessions are swept
+UPLOAD_SESSION_DIR = UPLOAD_DIR / "sessions"
+UPLOAD_SESSION_MAX_CHUNK_BYTES = int(os.environ.get('UPLOAD_SESSION_MAX_CHUNK_BYTES', str(8 * 1024 * 1024)))
+UPLOAD_SESSION_TTL_SECONDS = float(os.environ.get('UPLOAD_SESSION_TTL_SECONDS', str(24 * 3600)))
+UPLOAD_SESSION_SWEEP_SECONDS = float(os.environ.get('UPLOAD_SESSION_SWEEP_SECONDS', '600'))
+# Files under UPLOAD_DIR that nothing references are quarantined after a grace period, then purged
+# (local storage only)
+ORPHAN_QUARANTINE_DIR = UPLOAD_DIR / "quarantine"
+ORPHAN_GRACE_SECONDS = float(os.environ.get('ORPHAN_GRACE_SECONDS', str(24 * 3600)))
+ORPHAN_QUARANTINE_RETENTION_SECONDS = float(os.environ.get('ORPHAN_QUARANTINE_RETENTION_SECONDS', str(30 * 24 * 3600)))
+ORPHAN_SWEEP_SECONDS = float(os.environ.get('ORPHAN_SWEEP_SECONDS', str(6 * 3600)))  # 0 disables the sweeper
+DOCUMENT_TYPES = {
+    # extension: (content type, max bytes)
+    ".jpg": ("image/jpeg", DOCUMENT_IMAGE_MAX_BYTES),
+    ".jpeg": ("image/jpeg", DOCUMENT_IMAGE_MAX_BYTES),
+    ".png": ("image/png", DOCUMENT_IMAGE_MAX_BYTES),
+    ".pdf": ("application/pdf", DOCUMENT_PDF_MAX_BYTES),
+}
+
+# Receipt rendering pool - ReportLab/PIL work runs in separate processes (0 renders on a thread)
+RECEIPT_RENDER_WORKERS = int(os.environ.get('RECEIPT_RENDER_WORKERS', str(min(4, os.cpu_count() or 1))))
+receipt_render_executor = None
+
+# Rendered receipt archive (not publicly mounted), content-addressed by render key
+RECEIPT_ARCHIVE_DIR = Path(os.environ.get('RECEIPT_ARCHIVE_DIR', 'receipts'))
+RECEIPT_ARCHIVE_DIR.mkdir(exist_ok=True)
+RECEIPT_CACHE_MAX_BYTES = int(os.environ.get('RECEIPT_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+# Largest selection /admin/receipts/batch renders in one request (larger ones are refused, not truncated)
+RECEIPT_BATCH_MAX = int(os.environ.get('RECEIPT_BATCH_MAX', '1000'))
+# Bump whenever render_unified_receipt_pdf output changes so cached receipts are re-rendered
+RECEIPT_LAYOUT_VERSION = 4
+
+# Content-addressed blob store for user images (profile photos, signatures), served at /api/blobs
+BLOB_DIR = Path(os.environ.get('BLOB_DIR', 'blobs'))
+BLOB_DIR.mkdir(exist_ok=True)
+PROFILE_PHOTO_MAX_BYTES = int(os.environ.get('PROFILE_PHOTO_MAX_BYTES', str(5 * 1024 * 1024)))
+
+# Signatures are validated and normalized once when written (trimmed, capped, stored as RGB PNG)
+SIGNATURE_MAX_UPLOAD_BYTES = int(os.environ.get('SIGNATURE_MAX_UPLOAD_BYTES', str(2 * 1024 * 1024)))
+SIGNATURE_MAX_WIDTH = int(os.environ.get('SIGNATURE_MAX_WIDTH', '600'))
+SIGNATURE_MAX_HEIGHT = int(os.environ.get('SIGNATURE_MAX_HEIGHT', '200'))
+SIGNATURE_MAX_PIXELS = 25_000_000  # refuse to decode anything larger (decompression bombs)
+SIGNATURE_TRIM_PADDING = 4
+# Signature versions are immutable, so resolved signature_id -> data lookups never go stale
+SIGNATURE_CACHE_SIZE = int(os.environ.get('SIGNATURE_CACHE_SIZE', '256'))
+
+# Coordinator student list: equality filters that each combination of gets a (filters..., created_at, id) index,
+# and how far an "estimated" total keeps counting matches before giving up
+STUDENT_LIST_FILTER_FIELDS = ("status", "course", "agent_id")
+STUDENT_COUNT_ESTIMATE_LIMIT = int(os.environ.get('STUDENT_COUNT_ESTIMATE_LIMIT', '10000'))
 
 # Models
 class User(BaseModel):
@@ -63,10 +198,13 @@ class User(BaseModel):
     hashed_password: str
     signature_data: Optional[str] = None  # Admin/Coordinator signature
     signature_type: Optional[str] = None  # "draw" or "upload"
+    signature_hash: Optional[str] = None  # sha256 of the normalized signature PNG
+    signature_id: Optional[str] = None  # current version in the signatures collection
+    signature_url: Optional[str] = None  # blob URL of the normalized signature PNG
     signature_updated_at: Optional[datetime] = None
     
     # Agent Profile Fields
-    profile_photo: Optional[str] = None  # Profile photo URL/base64
+    profile_photo: Optional[str] = None  # Profile photo URL (blob URL for uploads)
     phone: Optional[str] = None
     address: Optional[str] = None
     experience_level: Optional[str] = None  # "beginner", "intermediate", "expert"
@@ -78,6 +216,21 @@ class User(BaseModel):
     achievements: Optional[List[str]] = None  # Achievement badges earned
     badges: Optional[List[dict]] = None  # Coordinator-assigned badges with metadata
 
+class Principal(BaseModel):
+    """Auth-relevant subset of a user, resolved by get_current_user"""
+    id: str
+    username: str
+    role: str  # "agent", "coordinator", "admin"
+    agent_id: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+
+# Fields loaded for a Principal - never pull signature/photo blobs on the auth path
+PRINCIPAL_PROJECTION = {
+    "_id": 0, "id": 1, "username": 1, "role": 1,
+    "agent_id": 1, "first_name": 1, "last_name": 1
+}
+
 class UserCreate(BaseModel):
     username: str
     email: str
@@ -116,14 +269,31 @@ class Student(BaseModel):
     email: str
     phone: str
     course: str
-    documents: Dict[str, str] = {}  # document_type: file_path
+    documents: Dict[str, str] = {}  # document_type: file_path (metadata lives in db.student_documents)
     status: str = "pending"  # pending, verified, coordinator_approved, admin_pending, approved, rejected
     created_at: datetime = Field(default_factory=datetime.utcnow)
     coordinator_notes: Optional[str] = None
-    signature_data: Optional[str] = None  # base64 encoded signature
+    signature_data: Optional[str] = None  # legacy embedded signature (see signature_id)
     signature_type: Optional[str] = None  # "draw" or "upload"
+    signature_id: Optional[str] = None  # reference into the signatures collection
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class StudentDocument(BaseModel):
+    """One uploaded document of a student; unique per (student_id, type)"""
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    student_id: str
+    type: str
+    path: str  # document store object (or a legacy per-student upload)
+    file_name: str  # "{type}_{original name}", used for downloads
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+    content_type: Optional[str] = None
+    width: Optional[int] = None  # images, filled in once thumbnails are built
+    height: Optional[int] = None
+    thumbnails: Dict[str, Dict[str, int]] = {}  # variant: width/height/size
+    uploaded_at: datetime = Field(default_factory=datetime.utcnow)
+    uploaded_by: Optional[str] = None
+
 class StudentCreate(BaseModel):
     first_name: str
     last_name: str
@@ -131,6 +301,26 @@ class StudentCreate(BaseModel):
     phone: str
     course: str
 
+class UploadSessionCreate(BaseModel):
+    document_type: str
+    file_name: str
+    size: int  # total bytes the client is going to send
+
+class UploadSessionFinalize(BaseModel):
+    sha256: str  # hex digest of the complete file
+
+class UploadSession(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    student_id: str
+    document_type: str
+    file_name: str
+    content_type: str
+    size: int
+    received: int = 0  # contiguous bytes persisted from offset 0
+    created_by: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
 class IncentiveRule(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     course: str
@@ -148,6 +338,40 @@ class Incentive(BaseModel):
     status: str = "unpaid"  # paid, unpaid
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class Receipt(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    student_id: str
+    receipt_number: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_by: Optional[str] = None  # user id that triggered the first render
+    archive_keys: Dict[str, str] = Field(default_factory=dict)  # receipt_archive_slot -> render key archived last
+
+class Signature(BaseModel):
+    """Immutable signature version, shared by every record signed with the same image"""
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    hash: str  # sha256 of the normalized PNG - one document per distinct image
+    data: str  # normalized PNG data URL
+    created_by: Optional[str] = None  # user id that first stored this version
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ReceiptBatchRequest(BaseModel):
+    student_ids: Optional[List[str]] = None  # explicit selection; filters are ignored when given
+    date_from: Optional[str] = None  # approval (updated_at) range, ISO format
+    date_to: Optional[str] = None
+    course: Optional[str] = None
+    agent_id: Optional[str] = None
+    format: str = "zip"  # "zip" (one PDF per student) or "pdf" (single multi-page A5 PDF)
+
+class DocumentExportRequest(BaseModel):
+    student_ids: Optional[List[str]] = None  # explicit selection; filters are ignored when given
+    # Same filters as /students/paginated
+    status: Optional[str] = None
+    course: Optional[str] = None
+    agent_id: Optional[str] = None
+    search: Optional[str] = None
+    date_from: Optional[str] = None  # created_at range, ISO format
+    date_to: Optional[str] = None
+
 class PendingUser(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     username: str
@@ -170,6 +394,109 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def run_password_job(func, *args):
+    """Run a bcrypt operation on the password pool, failing fast when it is saturated"""
+    if password_hash_slots.locked():
+        raise HTTPException(
+            status_code=503,
+            detail="Authentication service busy, please retry shortly",
+            headers={"Retry-After": "1"}
+        )
+    
+    async with password_hash_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(password_hash_executor, func, *args)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await run_password_job(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await run_password_job(get_password_hash, password)
+
+class PrincipalCache:
+    """TTL + LRU cache of principals keyed by user id"""
+    
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+    
+    def get(self, user_id: str) -> Optional[Principal]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        principal, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return principal
+    
+    def set(self, principal: Principal):
+        if self.ttl_seconds <= 0 or self.max_size <= 0:
+            return
+        self._entries[principal.id] = (principal, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(principal.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+    
+    def clear(self):
+        self._entries.clear()
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+
+class TokenVersionTable:
+    """In-memory mirror of db.token_versions used to revoke stateless tokens"""
+    
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self._versions: Dict[str, int] = {}
+        self._refreshed_at: Optional[float] = None
+    
+    def is_fresh(self) -> bool:
+        """True while the mirror is recent enough to authorize without Mongo"""
+        if self._refreshed_at is None:
+            return False
+        return time.monotonic() - self._refreshed_at < self.refresh_seconds * 3
+    
+    def version_for(self, user_id: str) -> int:
+        return self._versions.get(user_id, 0)
+    
+    async def refresh(self):
+        docs = await db.token_versions.find({}, {"_id": 0, "user_id": 1, "version": 1}).to_list(length=None)
+        self._versions = {doc["user_id"]: doc["version"] for doc in docs}
+        self._refreshed_at = time.monotonic()
+    
+    async def current_version(self, user_id: str) -> int:
+        """Authoritative version straight from Mongo (login and stale-mirror fallback)"""
+        doc = await db.token_versions.find_one({"user_id": user_id}, {"_id": 0, "version": 1})
+        return doc["version"] if doc else 0
+    
+    async def bump(self, user_ids: List[str]):
+        """Invalidate every token issued so far for the given users"""
+        for user_id in user_ids:
+            doc = await db.token_versions.find_one_and_update(
+                {"user_id": user_id},
+                {"$inc": {"version": 1}, "$set": {"updated_at": datetime.utcnow()}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            self._versions[user_id] = doc["version"]
+            principal_cache.invalidate(user_id)
+    
+    async def run_refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"Token version refresh failed: {e}")
+            await asyncio.sleep(self.refresh_seconds)
+
+token_versions = TokenVersionTable(TOKEN_REVOCATION_REFRESH_SECONDS)
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=1)
@@ -186,88 +513,1692 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     
-    user_doc = await db.users.find_one({"id": user_id})
+    # Stateless tokens authorize from their claims; revocation is checked via token versions
+    if "ver" in payload:
+        versions_fresh = token_versions.is_fresh()
+        if versions_fresh:
+            current_version = token_versions.version_for(user_id)
+        else:
+            current_version = await token_versions.current_version(user_id)
+        if payload["ver"] < current_version:
+            raise HTTPException(status_code=401, detail="Token has been revoked")
+        if versions_fresh:
+            return Principal(
+                id=user_id,
+                username=payload["username"],
+                role=payload["role"],
+                agent_id=payload.get("agent_id"),
+                first_name=payload.get("first_name"),
+                last_name=payload.get("last_name")
+            )
+    
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+    
+    user_doc = await db.users.find_one({"id": user_id}, PRINCIPAL_PROJECTION)
     if user_doc is None:
         raise HTTPException(status_code=401, detail="User not found")
     
-    return User(**user_doc)
+    principal = Principal(**user_doc)
+    principal_cache.set(principal)
+    return principal
+
+# Month prefixes whose counter has already been seeded from existing students
+seeded_token_prefixes = set()
+
+async def seed_token_counter(prefix: str):
+    """Make sure the month counter starts after the highest token already issued"""
+    # Compared as numbers: as strings, AGIyymm10000 would sort below AGIyymm9999
+    latest = await db.students.aggregate([
+        {"$match": {"token_number": {"$regex": f"^{prefix}\\d+$"}}},
+        {"$group": {"_id": None, "highest": {"$max": {
+            "$toLong": {"$arrayElemAt": [{"$split": ["$token_number", prefix]}, 1]}
+        }}}}
+    ]).to_list(1)
+    highest = (latest[0]["highest"] if latest else None) or 0
+    # $max is atomic, so concurrent seeders can never move the counter backwards
+    await db.counters.update_one({"_id": f"token:{prefix}"}, {"$max": {"seq": highest}}, upsert=True)
+    seeded_token_prefixes.add(prefix)
 
 async def generate_token_number():
     """Generate systematic unique token number for student starting with AGI"""
-    from datetime import datetime
+    # Format: AGI + YY + MM + sequence number (at least 4 digits)
+    # Examples: AGI25080001, AGI25080002, ..., AGI250810000
+    prefix = f"AGI{datetime.now().strftime('%y%m')}"
+    if prefix not in seeded_token_prefixes:
+        await seed_token_counter(prefix)
+    
+    counter = await db.counters.find_one_and_update(
+        {"_id": f"token:{prefix}"},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return f"{prefix}{counter['seq']:04d}"
+
+async def generate_unique_receipt_number():
+    """Generate unique receipt number from the daily receipt counter"""
+    # Format: RCPT + YYYYMMDD + 4-digit daily sequence
+    date_str = datetime.now().strftime('%Y%m%d')
+    counter = await db.counters.find_one_and_update(
+        {"_id": f"receipt:{date_str}"},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return f"RCPT-{date_str}-{counter['seq']:04d}"
+
+async def get_or_create_receipt(student_doc, current_user):
+    """Return the student's receipt record, issuing a stable receipt number on first use"""
+    receipt_doc = await db.receipts.find_one({"student_id": student_doc["id"]})
+    if receipt_doc:
+        return receipt_doc
+    
+    receipt = Receipt(
+        student_id=student_doc["id"],
+        receipt_number=await generate_unique_receipt_number(),
+        created_by=current_user.id
+    )
+    try:
+        await db.receipts.insert_one(receipt.dict())
+    except DuplicateKeyError:
+        # Another request issued the receipt first - their record wins
+        pass
+    # Re-read so created_at carries Mongo's millisecond precision (it feeds the render key)
+    return await db.receipts.find_one({"student_id": student_doc["id"]})
+
+class StoredObjectStat(NamedTuple):
+    """Size and modification time of a remote object (the os.stat_result fields responses use)"""
+    st_size: int
+    st_mtime: float
+
+class LocalStorage:
+    """Storage backend keeping each object as a file under a local directory (single-node deployments)"""
+    
+    def __init__(self, root: Path):
+        self.root = root
+    
+    def local_path(self, key: str) -> Optional[Path]:
+        """File holding the object, so it can be handed to FileResponse / the front proxy (None for remote backends)"""
+        return self.root / key
     
-    # Get current year and month
-    year = datetime.now().strftime('%y')  # 2-digit year
-    month = datetime.now().strftime('%m')  # 2-digit month
+    async def stat(self, key: str):
+        try:
+            return await asyncio.to_thread(os.stat, self.root / key)
+        except FileNotFoundError:
+            return None
+    
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread((self.root / key).exists)
+    
+    async def put_file(self, key: str, source_path: Path):
+        """Store a local file under key, consuming it (source_path must be on the same filesystem)"""
+        target = self.root / key
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source_path, target)
+    
+    async def put_bytes(self, key: str, data: bytes):
+        target = self.root / key
+        target.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+        await asyncio.to_thread(temp_path.write_bytes, data)
+        os.replace(temp_path, target)
+    
+    async def get_bytes(self, key: str) -> Optional[bytes]:
+        try:
+            return await asyncio.to_thread((self.root / key).read_bytes)
+        except FileNotFoundError:
+            return None
+    
+    async def iter_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        """Bytes start..end (inclusive) of an object, in DOWNLOAD_CHUNK_SIZE chunks"""
+        remaining = end - start + 1
+        async with aiofiles.open(self.root / key, "rb") as file:
+            await file.seek(start)
+            while remaining > 0:
+                chunk = await file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
     
-    # Get count of students created today to ensure uniqueness
-    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    today_count = await db.students.count_documents({
-        "created_at": {"$gte": today_start}
-    }) + 1  # Add 1 for the new student
+    @asynccontextmanager
+    async def local_copy(self, key: str):
+        """Local file with the object's bytes for the duration of the block (the object itself here)"""
+        yield self.root / key
     
-    # Format: AGI + YY + MM + 4-digit sequence number
-    # Examples: AGI2508001, AGI2508002, etc.
-    token = f"AGI{year}{month}{today_count:04d}"
+    async def delete(self, key: str):
+        (self.root / key).unlink(missing_ok=True)
     
-    # Ensure uniqueness in case of race conditions
-    while await db.students.find_one({"token_number": token}):
-        today_count += 1
-        token = f"AGI{year}{month}{today_count:04d}"
+    async def delete_prefix(self, prefix: str):
+        """Remove every object under a "folder/" prefix"""
+        await asyncio.to_thread(shutil.rmtree, self.root / prefix, True)
     
-    return token
+    async def clear(self):
+        if self.root.exists():
+            await asyncio.to_thread(shutil.rmtree, self.root)
+        self.root.mkdir(exist_ok=True)
 
-async def generate_unique_receipt_number():
-    """Generate unique receipt number"""
-    from datetime import datetime
-    import random
+def get_s3_client():
+    """boto3 S3 client shared by every S3Storage (thread-safe), created on first use"""
+    global s3_client
+    if s3_client is None:
+        import boto3
+        from botocore.config import Config
+        
+        s3_client = boto3.client(
+            "s3",
+            endpoint_url=S3_ENDPOINT_URL,
+            region_name=S3_REGION,
+            # Room for parallel multipart transfers on top of regular requests
+            config=Config(max_pool_connections=max(10, S3_MULTIPART_CONCURRENCY * 4))
+        )
+    return s3_client
+
+class S3Storage:
+    """Storage backend keeping objects in an S3-compatible bucket under a key prefix.
+
+    boto3 is blocking, so every call runs on a worker thread. Large files go up (and come down)
+    as multipart transfers with S3_MULTIPART_CONCURRENCY parts in flight.
+    """
     
-    # Format: RCPT + YYYYMMDD + random 4-digit sequence
-    date_str = datetime.now().strftime('%Y%m%d')
+    def __init__(self, bucket: str, prefix: str):
+        from boto3.s3.transfer import TransferConfig
+        
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = get_s3_client()
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNK_SIZE,
+            max_concurrency=S3_MULTIPART_CONCURRENCY
+        )
+    
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+    
+    def local_path(self, key: str) -> Optional[Path]:
+        return None
+    
+    async def stat(self, key: str) -> Optional[StoredObjectStat]:
+        from botocore.exceptions import ClientError
+        
+        try:
+            head = await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return StoredObjectStat(st_size=head["ContentLength"], st_mtime=head["LastModified"].timestamp())
+    
+    async def exists(self, key: str) -> bool:
+        return await self.stat(key) is not None
+    
+    async def put_file(self, key: str, source_path: Path):
+        """Upload a local file under key (multipart above S3_MULTIPART_THRESHOLD), consuming it"""
+        await asyncio.to_thread(
+            self.client.upload_file, str(source_path), self.bucket, self._key(key), Config=self.transfer_config
+        )
+        source_path.unlink(missing_ok=True)
+    
+    async def put_bytes(self, key: str, data: bytes):
+        await asyncio.to_thread(self.client.put_object, Bucket=self.bucket, Key=self._key(key), Body=data)
+    
+    async def get_bytes(self, key: str) -> Optional[bytes]:
+        from botocore.exceptions import ClientError
+        
+        try:
+            response = await asyncio.to_thread(self.client.get_object, Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        with response["Body"] as body:
+            return await asyncio.to_thread(body.read)
+    
+    async def iter_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        """Bytes start..end (inclusive) of an object via a ranged GET, in DOWNLOAD_CHUNK_SIZE chunks"""
+        response = await asyncio.to_thread(
+            self.client.get_object, Bucket=self.bucket, Key=self._key(key), Range=f"bytes={start}-{end}"
+        )
+        with response["Body"] as body:
+            while chunk := await asyncio.to_thread(body.read, DOWNLOAD_CHUNK_SIZE):
+                yield chunk
+    
+    @asynccontextmanager
+    async def local_copy(self, key: str):
+        """Temporary local file with the object's bytes (parallel ranged GETs for large objects)"""
+        with tempfile.TemporaryDirectory(prefix="storage-") as temp_dir:
+            temp_path = Path(temp_dir) / Path(key).name
+            await asyncio.to_thread(
+                self.client.download_file, self.bucket, self._key(key), str(temp_path), Config=self.transfer_config
+            )
+            yield temp_path
+    
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self._key(key))
+    
+    async def delete_prefix(self, prefix: str):
+        """Remove every object whose key starts with prefix, 1000 per request"""
+        def delete_all():
+            paginator = self.client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+                objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+                if objects:
+                    self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+        await asyncio.to_thread(delete_all)
+    
+    async def clear(self):
+        await self.delete_prefix("")
+
+def create_storage(local_root: Path, s3_folder: str):
+    """Storage backend for one kind of file: local_root on disk, or s3_folder within the bucket"""
+    if STORAGE_BACKEND == "s3":
+        return S3Storage(S3_BUCKET, f"{S3_PREFIX}{s3_folder}")
+    return LocalStorage(local_root)
+
+document_storage = create_storage(UPLOAD_DIR, "uploads/")
+receipt_storage = create_storage(RECEIPT_ARCHIVE_DIR, "receipts/")
+blob_storage = create_storage(BLOB_DIR, "blobs/")
+
+def upload_storage_key(file_path) -> Optional[str]:
+    """document_storage key of a recorded document path ("uploads/objects/..."), None when outside UPLOAD_DIR"""
+    try:
+        return Path(file_path).relative_to(UPLOAD_DIR).as_posix()
+    except ValueError:
+        return None
+
+class ReceiptRenderCache:
+    """LRU of rendered receipt bytes in memory, backed by the receipt archive in storage"""
+    
+    def __init__(self, storage, max_memory_bytes: int):
+        self.storage = storage
+        self.max_memory_bytes = max_memory_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+    
+    def _archive_key(self, render_key: str) -> str:
+        return f"{render_key}.pdf"
+    
+    def _remember(self, render_key: str, pdf_bytes: bytes):
+        if len(pdf_bytes) > self.max_memory_bytes:
+            return
+        if render_key in self._entries:
+            self._memory_bytes -= len(self._entries.pop(render_key))
+        self._entries[render_key] = pdf_bytes
+        self._memory_bytes += len(pdf_bytes)
+        # Evicted entries stay available from the archive
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+    
+    async def get(self, render_key: str) -> Optional[bytes]:
+        pdf_bytes = self._entries.get(render_key)
+        if pdf_bytes is not None:
+            self._entries.move_to_end(render_key)
+            return pdf_bytes
+        
+        pdf_bytes = await self.storage.get_bytes(self._archive_key(render_key))
+        if pdf_bytes is None:
+            return None
+        self._remember(render_key, pdf_bytes)
+        return pdf_bytes
+    
+    async def put(self, render_key: str, pdf_bytes: bytes):
+        await self.storage.put_bytes(self._archive_key(render_key), pdf_bytes)
+        self._remember(render_key, pdf_bytes)
+    
+    async def discard(self, render_key: str):
+        """Forget a superseded render, in memory and in the archive"""
+        if render_key in self._entries:
+            self._memory_bytes -= len(self._entries.pop(render_key))
+        await self.storage.delete(self._archive_key(render_key))
+    
+    def clear(self):
+        self._entries.clear()
+        self._memory_bytes = 0
+
+receipt_render_cache = ReceiptRenderCache(receipt_storage, RECEIPT_CACHE_MAX_BYTES)
+
+async def clear_receipt_archive():
+    """Remove every archived receipt PDF (used by the data cleanup endpoints)"""
+    receipt_render_cache.clear()
+    await receipt_storage.clear()
+
+BLOB_EXTENSIONS = {"PNG": "png", "JPEG": "jpg", "GIF": "gif", "WEBP": "webp"}
+BLOB_MEDIA_TYPES = {"png": "image/png", "jpg": "image/jpeg", "gif": "image/gif", "webp": "image/webp"}
+
+class BlobStore:
+    """Immutable files in storage, stored once per content hash as {sha256}.{ext}"""
+    
+    url_prefix = "/api/blobs/"
+    
+    def __init__(self, storage):
+        self.storage = storage
+    
+    def key_for(self, blob_name: str) -> str:
+        # Two-character fan-out keeps directory sizes bounded
+        return f"{blob_name[:2]}/{blob_name}"
+    
+    def url_for(self, blob_name: str) -> str:
+        return f"{self.url_prefix}{blob_name}"
+    
+    async def put(self, data: bytes, extension: str) -> str:
+        blob_name = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+        if not await self.storage.exists(self.key_for(blob_name)):
+            await self.storage.put_bytes(self.key_for(blob_name), data)
+        return blob_name
+    
+    async def clear(self):
+        await self.storage.clear()
+
+blob_store = BlobStore(blob_storage)
+
+def decode_image_data_url(value: str, max_bytes: int) -> bytes:
+    """Raw bytes of a base64 image data URL (or bare base64); raises ValueError when malformed"""
+    import binascii
+    
+    encoded = value.strip()
+    if encoded.startswith('data:'):
+        header, _, encoded = encoded.partition(',')
+        if not header.startswith('data:image/') or not header.endswith(';base64'):
+            raise ValueError("expected a base64 image data URL")
+    if len(encoded) > (max_bytes * 4) // 3 + 4:
+        raise ValueError(f"image exceeds {max_bytes} bytes")
+    
+    try:
+        return base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("not valid base64")
+
+def detect_image_extension(data: bytes) -> str:
+    """Blob extension for an uploaded image, raising ValueError for anything that is not a supported image"""
+    from PIL import Image, UnidentifiedImageError
+    
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image_format = image.format
+            image.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError, Image.DecompressionBombError):
+        raise ValueError("not a readable image")
+    if image_format not in BLOB_EXTENSIONS:
+        raise ValueError(f"unsupported image format {image_format}")
+    return BLOB_EXTENSIONS[image_format]
+
+async def store_profile_photo(data: bytes) -> str:
+    """Validate an uploaded profile photo and return its blob URL"""
+    if len(data) > PROFILE_PHOTO_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Profile photo exceeds {PROFILE_PHOTO_MAX_BYTES} bytes")
+    try:
+        extension = await asyncio.to_thread(detect_image_extension, data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid profile photo: {e}")
+    return blob_store.url_for(await blob_store.put(data, extension))
+
+async def save_upload_stream(upload: UploadFile, target_path: Path, max_bytes: int) -> Dict[str, Any]:
+    """Stream an upload to target_path in chunks, hashing as it goes; the file appears atomically.
+
+    Raises 413 (and leaves nothing behind) once the upload exceeds max_bytes.
+    """
+    temp_path = target_path.with_name(f".{target_path.name}.{uuid.uuid4().hex}.tmp")
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(temp_path, "wb") as buffer:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"File exceeds the {max_bytes} byte limit for this type")
+                hasher.update(chunk)
+                await buffer.write(chunk)
+        os.replace(temp_path, target_path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return {"size": size, "sha256": hasher.hexdigest()}
+
+def hash_file(path: Path) -> Dict[str, Any]:
+    """SHA-256 and size of a file on disk, read in chunks"""
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as source:
+        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            hasher.update(chunk)
+    return {"size": size, "sha256": hasher.hexdigest()}
+
+class DocumentStore:
+    """Content-addressed student documents: one object per SHA-256, reference counted in db.document_objects
+
+    Paths are recorded as UPLOAD_DIR/... on every backend; upload_storage_key maps them to storage keys.
+    """
+    
+    def __init__(self, storage, root: Path, derivatives_root: Path):
+        self.storage = storage
+        self.root = root
+        self.derivatives_root = derivatives_root
+    
+    def path_for(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256[2:4] / sha256
+    
+    def legacy_path_for(self, sha256: str) -> Path:
+        """Single-level layout used before objects/ab/cd/; resolved until migrate_document_layout moves it"""
+        return self.root / sha256[:2] / sha256
+    
+    def derivatives_dir(self, sha256: str) -> Path:
+        """Thumbnails and optimized copies built from an object (see ensure_document_derivatives)"""
+        return self.derivatives_root / sha256[:2] / sha256[2:4] / sha256
+    
+    def legacy_derivatives_dir(self, sha256: str) -> Path:
+        return self.derivatives_root / sha256[:2] / sha256
+    
+    def holds(self, file_path) -> bool:
+        """True when file_path is an object of this store (not a legacy per-student upload)"""
+        file_path = Path(file_path)
+        return file_path in (self.path_for(file_path.name), self.legacy_path_for(file_path.name))
+    
+    async def _first_existing(self, path: Path, legacy_path: Path) -> Path:
+        if await self.storage.exists(upload_storage_key(path)):
+            return path
+        return legacy_path if await self.storage.exists(upload_storage_key(legacy_path)) else path
+    
+    async def locate(self, sha256: str) -> Path:
+        """Where an object's bytes are: the current layout, or the legacy one while it is being migrated"""
+        return await self._first_existing(self.path_for(sha256), self.legacy_path_for(sha256))
+    
+    async def locate_derivative(self, sha256: str, variant: str) -> Path:
+        return await self._first_existing(
+            self.derivatives_dir(sha256) / f"{variant}.jpg", self.legacy_derivatives_dir(sha256) / f"{variant}.jpg"
+        )
+    
+    def incoming_path(self) -> Path:
+        """Local scratch file for an upload whose hash is not known yet (same filesystem as local objects)"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        return self.root / f".incoming.{uuid.uuid4().hex}"
+    
+    async def ingest(self, incoming_path: Path, sha256: str, size: int, content_type: str) -> Path:
+        """Add a reference to the object holding incoming_path's bytes, consuming incoming_path"""
+        update = {
+            "$inc": {"refcount": 1},
+            "$setOnInsert": {"size": size, "content_type": content_type, "created_at": datetime.utcnow()}
+        }
+        # A row marked deleting is skipped: its files are going away, so this upload waits and stores them again
+        live = {"sha256": sha256, "deleting": {"$ne": True}}
+        deadline = time.monotonic() + DOCUMENT_INGEST_WAIT_SECONDS
+        while True:
+            try:
+                object_doc = await db.document_objects.find_one_and_update(
+                    live, update, upsert=True, return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                # Concurrent first upload of the same bytes created the object, or release() is deleting it
+                object_doc = await db.document_objects.find_one_and_update(
+                    live, update, return_document=ReturnDocument.AFTER
+                )
+            if object_doc:
+                break
+            # The worker that claimed the deletion died before removing the row: take the row back
+            # (its refcount is 0, so the bytes are stored again below)
+            await db.document_objects.update_one(
+                {"sha256": sha256, "deleting": True,
+                 "deleting_since": {"$lt": datetime.utcnow() - timedelta(seconds=DOCUMENT_DELETE_CLAIM_SECONDS)}},
+                {"$unset": {"deleting": "", "deleting_since": ""}}
+            )
+            if time.monotonic() >= deadline:
+                incoming_path.unlink(missing_ok=True)
+                raise HTTPException(status_code=503, detail="Document is being replaced, please retry")
+            await asyncio.sleep(0.05)
+        
+        object_path = await self.locate(sha256)
+        if object_doc["refcount"] == 1 or not await self.storage.exists(upload_storage_key(object_path)):
+            object_path = self.path_for(sha256)
+            try:
+                await self.storage.put_file(upload_storage_key(object_path), incoming_path)
+            except BaseException:
+                incoming_path.unlink(missing_ok=True)
+                await self.release(sha256)
+                raise
+        else:
+            # Identical bytes are already stored (possibly still in the legacy layout)
+            incoming_path.unlink(missing_ok=True)
+        return object_path
+    
+    async def release(self, sha256: str):
+        """Drop one reference; the object's file is deleted with its last reference"""
+        object_doc = await db.document_objects.find_one_and_update(
+            {"sha256": sha256}, {"$inc": {"refcount": -1}}, return_document=ReturnDocument.AFTER
+        )
+        if not object_doc or object_doc["refcount"] > 0:
+            return
+        # Claimed before the files go: conditional so an upload that re-referenced the object keeps it,
+        # and ingest() waits on a claimed row instead of re-referencing files that are being deleted
+        now = datetime.utcnow()
+        claimed_at = now.replace(microsecond=now.microsecond // 1000 * 1000)  # Mongo keeps milliseconds
+        claimed = await db.document_objects.find_one_and_update(
+            {"sha256": sha256, "refcount": {"$lte": 0}, "deleting": {"$ne": True}},
+            {"$set": {"deleting": True, "deleting_since": claimed_at}}
+        )
+        if not claimed:
+            return
+        try:
+            await self.storage.delete(upload_storage_key(self.path_for(sha256)))
+            await self.storage.delete(upload_storage_key(self.legacy_path_for(sha256)))
+            await self.storage.delete_prefix(upload_storage_key(self.derivatives_dir(sha256)) + "/")
+            await self.storage.delete_prefix(upload_storage_key(self.legacy_derivatives_dir(sha256)) + "/")
+        except BaseException:
+            # Unclaimed so uploads of the same bytes are not blocked; the next ingest stores them again
+            await db.document_objects.update_one(
+                {"sha256": sha256, "deleting_since": claimed_at}, {"$unset": {"deleting": "", "deleting_since": ""}}
+            )
+            raise
+        # Only our own claim: an ingest may have taken the row back if this took longer than the claim lasts
+        await db.document_objects.delete_one({"sha256": sha256, "deleting": True, "deleting_since": claimed_at})
+
+document_store = DocumentStore(document_storage, DOCUMENT_STORE_DIR, DOCUMENT_DERIVATIVES_DIR)
+
+async def release_replaced_document(previous_path: Optional[str], new_path: Path):
+    """Clean up the document a student record pointed at before it was replaced"""
+    if not previous_path or Path(previous_path) == new_path:
+        return
+    if document_store.holds(previous_path):
+        await document_store.release(Path(previous_path).name)
+    elif Path(previous_path).parent.parent == UPLOAD_DIR:
+        # Legacy per-student upload, referenced by this record only
+        await document_storage.delete(upload_storage_key(previous_path))
+
+async def attach_student_document(student_id: str, document_type: str, file_name: str, content_type: str,
+                                  incoming_path: Path, stored: Dict[str, Any], current_user) -> Path:
+    """Store a fully received upload by content hash and point the student's document at it"""
+    file_path = await document_store.ingest(incoming_path, stored["sha256"], stored["size"], content_type)
+    
+    if not await db.students.find_one({"id": student_id}, {"_id": 1}):
+        await document_store.release(stored["sha256"])
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    # Later reads use this record instead of stat()ing the file; its swap decides which of overlapping uploads wins
+    record = StudentDocument(
+        student_id=student_id,
+        type=document_type,
+        path=str(file_path),
+        file_name=f"{document_type}_{file_name}",
+        size=stored["size"],
+        sha256=stored["sha256"],
+        content_type=content_type,
+        uploaded_by=current_user.id
+    )
+    previous_record = await db.student_documents.find_one_and_replace(
+        {"student_id": student_id, "type": document_type},
+        record.dict(),
+        projection={"_id": 0, "path": 1},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    
+    # The student keeps only the type -> path map (agents' upload badges), following the record
+    document_field = f"documents.{document_type}"
+    await db.students.update_one(
+        {"id": student_id},
+        {"$set": {document_field: str(file_path)}, "$unset": {f"document_info.{document_type}": ""}}
+    )
+    current_record = await db.student_documents.find_one(
+        {"student_id": student_id, "type": document_type}, {"_id": 0, "path": 1}
+    )
+    if current_record and current_record["path"] != str(file_path):
+        # A newer upload swapped the record before our $set landed: point back at it, unless it already did
+        await db.students.update_one(
+            {"id": student_id, document_field: str(file_path)},
+            {"$set": {document_field: current_record["path"]}}
+        )
+    
+    # The replaced document loses its reference (and its file, if nothing else uses it)
+    await release_replaced_document((previous_record or {}).get("path"), file_path)
+    
+    if content_type.startswith("image/"):
+        object_doc = await db.document_objects.find_one({"sha256": stored["sha256"]}, {"_id": 0, "image": 1})
+        if object_doc and object_doc.get("image"):
+            # Same image uploaded before: its thumbnails already exist
+            await db.student_documents.update_one(
+                {"student_id": student_id, "type": document_type, "sha256": stored["sha256"]},
+                {"$set": document_image_fields(object_doc["image"])}
+            )
+        else:
+            # Thumbnails are built in the background; the upload response does not wait for them
+            background_task = asyncio.create_task(ensure_document_derivatives(stored["sha256"]))
+            document_derivative_tasks.add(background_task)
+            background_task.add_done_callback(document_derivative_tasks.discard)
+    return file_path
+
+def get_image_processing_executor():
+    """Process pool for document image work, created on first use (None when disabled)"""
+    global image_processing_executor
+    if IMAGE_PROCESSING_WORKERS <= 0:
+        return None
+    if image_processing_executor is None:
+        image_processing_executor = ProcessPoolExecutor(
+            max_workers=IMAGE_PROCESSING_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return image_processing_executor
+
+def render_document_derivatives(source_path: str, output_dir: str, quality: int) -> Dict[str, Any]:
+    """Write EXIF-rotated, downscaled progressive JPEGs of an image for each DOCUMENT_IMAGE_VARIANTS size.
+
+    Pure (runs in the image pool); returns the image's width/height and {variant: {width, height, size}}.
+    """
+    from PIL import Image, ImageOps
+    
+    output_path = Path(output_dir)
+    derivatives = {}
+    with Image.open(source_path) as source:
+        image = ImageOps.exif_transpose(source)
+        output_path.mkdir(parents=True, exist_ok=True)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        width, height = image.size
+        # Largest first, each variant downscaled from the previous one
+        for variant, longest_side in sorted(DOCUMENT_IMAGE_VARIANTS.items(), key=lambda item: -item[1]):
+            image.thumbnail((longest_side, longest_side), Image.LANCZOS)
+            target = output_path / f"{variant}.jpg"
+            temp_target = output_path / f".{variant}.{uuid.uuid4().hex}.tmp"
+            image.save(temp_target, format="JPEG", quality=quality, optimize=True, progressive=True)
+            os.replace(temp_target, target)
+            derivatives[variant] = {"width": image.width, "height": image.height, "size": target.stat().st_size}
+    return {"width": width, "height": height, "thumbnails": derivatives}
+
+document_derivative_jobs: Dict[str, asyncio.Task] = {}
+document_derivative_tasks = set()
+
+def document_image_fields(image_info: Dict[str, Any]) -> Dict[str, Any]:
+    """db.student_documents fields describing a processed image"""
+    return {"width": image_info["width"], "height": image_info["height"], "thumbnails": image_info["thumbnails"]}
+
+async def build_document_derivatives(sha256: str) -> Optional[Dict[str, Any]]:
+    source_key = upload_storage_key(await document_store.locate(sha256))
+    derivatives_key = upload_storage_key(document_store.derivatives_dir(sha256))
+    # Rendered into local scratch, then stored next to the other objects
+    output_dir = document_store.incoming_path()
+    loop = asyncio.get_running_loop()
+    try:
+        async with document_storage.local_copy(source_key) as source_path:
+            image_info = await loop.run_in_executor(
+                get_image_processing_executor(),
+                render_document_derivatives,
+                str(source_path), str(output_dir), DOCUMENT_IMAGE_QUALITY
+            )
+        for variant in image_info["thumbnails"]:
+            await document_storage.put_file(f"{derivatives_key}/{variant}.jpg", output_dir / f"{variant}.jpg")
+    except Exception as e:
+        logger.warning(f"Could not build thumbnails for document {sha256}: {e}")
+        await db.document_objects.update_one({"sha256": sha256}, {"$set": {"derivatives_error": str(e)}})
+        return None
+    finally:
+        await asyncio.to_thread(shutil.rmtree, output_dir, True)
+    await db.document_objects.update_one({"sha256": sha256}, {"$set": {"image": image_info}})
+    await db.student_documents.update_many({"sha256": sha256}, {"$set": document_image_fields(image_info)})
+    return image_info
+
+async def ensure_document_derivatives(sha256: str) -> Optional[Dict[str, Any]]:
+    """Dimensions and thumbnails of a stored image, building them (once per content hash) when missing"""
+    object_doc = await db.document_objects.find_one(
+        {"sha256": sha256}, {"_id": 0, "content_type": 1, "image": 1, "derivatives_error": 1}
+    )
+    if not object_doc or not object_doc.get("content_type", "").startswith("image/"):
+        return None
+    if object_doc.get("image"):
+        return object_doc["image"]
+    if object_doc.get("derivatives_error"):
+        return None
+    
+    # Concurrent requests for the same image share one build
+    job = document_derivative_jobs.get(sha256)
+    if job is None:
+        job = asyncio.create_task(build_document_derivatives(sha256))
+        document_derivative_jobs[sha256] = job
+        job.add_done_callback(lambda _: document_derivative_jobs.pop(sha256, None))
+    return await asyncio.shield(job)
+
+def upload_session_path(upload_id: str) -> Path:
+    return UPLOAD_SESSION_DIR / upload_id
+
+async def discard_upload_session(upload_id: str, stale_before: Optional[datetime] = None) -> bool:
+    """Delete a session and its partial file; with stale_before, only if it has been idle since then"""
+    query = {"id": upload_id}
+    if stale_before is not None:
+        query["updated_at"] = {"$lt": stale_before}
+    if not await db.upload_sessions.find_one_and_delete(query):
+        return False
+    upload_session_path(upload_id).unlink(missing_ok=True)
+    return True
+
+async def sweep_upload_sessions() -> int:
+    """Expire sessions idle for longer than UPLOAD_SESSION_TTL_SECONDS, plus orphaned partial files"""
+    stale_before = datetime.utcnow() - timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS)
+    expired = 0
+    async for session_doc in db.upload_sessions.find({"updated_at": {"$lt": stale_before}}, {"_id": 0, "id": 1}):
+        if await discard_upload_session(session_doc["id"], stale_before):
+            expired += 1
+    
+    # Partial files whose session record is gone (e.g. a crash between the two deletes)
+    if UPLOAD_SESSION_DIR.exists():
+        cutoff = time.time() - UPLOAD_SESSION_TTL_SECONDS
+        partial_files = await asyncio.to_thread(
+            lambda: [path for path in UPLOAD_SESSION_DIR.iterdir() if path.stat().st_mtime < cutoff]
+        )
+        for partial_path in partial_files:
+            if not await db.upload_sessions.find_one({"id": partial_path.name}, {"_id": 1}):
+                partial_path.unlink(missing_ok=True)
+                expired += 1
+    return expired
+
+async def run_upload_session_sweeper():
+    while True:
+        try:
+            expired = await sweep_upload_sessions()
+            if expired:
+                logger.info(f"Expired {expired} abandoned upload sessions")
+        except Exception as e:
+            logger.warning(f"Upload session sweep failed: {e}")
+        await asyncio.sleep(UPLOAD_SESSION_SWEEP_SECONDS)
+
+def scan_upload_files() -> List[tuple]:
+    """(path, size, mtime) of every file under UPLOAD_DIR, except resumable sessions and the quarantine
+
+    Uses os.scandir, so sizes and times come from the directory listing; run it in a worker thread.
+    """
+    skipped = {os.path.normpath(UPLOAD_SESSION_DIR), os.path.normpath(ORPHAN_QUARANTINE_DIR)}
+    files = []
+    pending = [os.path.normpath(UPLOAD_DIR)]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if os.path.normpath(entry.path) not in skipped:
+                            pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat_result = entry.stat(follow_symlinks=False)
+                        files.append((os.path.normpath(entry.path), stat_result.st_size, stat_result.st_mtime))
+        except FileNotFoundError:
+            continue  # removed while walking
+    return files
+
+async def referenced_upload_paths() -> tuple:
+    """Stored paths in use, and content hashes whose thumbnails are in use (streamed from Mongo)"""
+    paths, hashes = set(), set()
+    async for record in db.student_documents.find({}, {"_id": 0, "path": 1}):
+        paths.add(os.path.normpath(record["path"]))
+    # Documents not yet migrated into student_documents
+    async for student_doc in db.students.find({"documents": {"$exists": True, "$ne": {}}}, {"_id": 0, "documents": 1}):
+        paths.update(os.path.normpath(file_path) for file_path in student_doc["documents"].values())
+    async for object_doc in db.document_objects.find({}, {"_id": 0, "sha256": 1}):
+        hashes.add(object_doc["sha256"])
+        paths.add(os.path.normpath(document_store.path_for(object_doc["sha256"])))
+        paths.add(os.path.normpath(document_store.legacy_path_for(object_doc["sha256"])))
+    return paths, hashes
+
+def upload_path_owner(file_path: str) -> str:
+    """Student id for legacy uploads/{student_id}/... files, otherwise the top-level folder name"""
+    parts = Path(file_path).relative_to(UPLOAD_DIR).parts
+    return parts[0] if len(parts) > 1 else ""
+
+async def find_orphaned_uploads() -> List[tuple]:
+    """(path, size, mtime) of files under UPLOAD_DIR that no document references"""
+    files = await asyncio.to_thread(scan_upload_files)
+    # References are read after the walk, so anything attached meanwhile counts as referenced
+    paths, hashes = await referenced_upload_paths()
+    derivatives_root = os.path.normpath(DOCUMENT_DERIVATIVES_DIR) + os.sep
+    orphans = []
+    for file_path, size, mtime in files:
+        if file_path in paths:
+            continue
+        if file_path.startswith(derivatives_root) and Path(file_path).parent.name in hashes:
+            continue
+        orphans.append((file_path, size, mtime))
+    return orphans
+
+async def upload_path_referenced(file_path: str) -> bool:
+    """Fresh check for one file right before it is moved (uploads may have attached it since the scan)"""
+    if file_path.startswith(os.path.normpath(DOCUMENT_DERIVATIVES_DIR) + os.sep):
+        return await db.document_objects.find_one({"sha256": Path(file_path).parent.name}, {"_id": 1}) is not None
+    if document_store.holds(file_path):
+        if await db.document_objects.find_one({"sha256": Path(file_path).name}, {"_id": 1}):
+            return True
+    # New uploads always write a student_documents record
+    return await db.student_documents.find_one({"path": file_path}, {"_id": 1}) is not None
+
+def remove_empty_parents(file_path: Path):
+    """rmdir the folders a moved file leaves empty, up to (not including) UPLOAD_DIR"""
+    directory = file_path.parent
+    while directory != UPLOAD_DIR and UPLOAD_DIR in directory.parents:
+        try:
+            directory.rmdir()
+        except OSError:
+            return
+        directory = directory.parent
+
+def purge_quarantine() -> int:
+    """Delete quarantine batches older than ORPHAN_QUARANTINE_RETENTION_SECONDS"""
+    if not ORPHAN_QUARANTINE_DIR.exists():
+        return 0
+    cutoff = time.time() - ORPHAN_QUARANTINE_RETENTION_SECONDS
+    purged = 0
+    for batch_dir in ORPHAN_QUARANTINE_DIR.iterdir():
+        if batch_dir.is_dir() and batch_dir.stat().st_mtime < cutoff:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+            purged += 1
+    return purged
+
+async def quarantine_orphaned_uploads() -> Dict[str, int]:
+    """Move unreferenced files older than ORPHAN_GRACE_SECONDS to UPLOAD_DIR/quarantine/<timestamp>/"""
+    cutoff = time.time() - ORPHAN_GRACE_SECONDS
+    batch_dir = ORPHAN_QUARANTINE_DIR / datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    summary = {"quarantined_files": 0, "quarantined_bytes": 0}
+    for file_path, size, mtime in await find_orphaned_uploads():
+        if mtime >= cutoff or await upload_path_referenced(file_path):
+            continue
+        source = Path(file_path)
+        target = batch_dir / source.relative_to(UPLOAD_DIR)
+        try:
+            await asyncio.to_thread(target.parent.mkdir, parents=True, exist_ok=True)
+            await asyncio.to_thread(os.replace, source, target)
+        except FileNotFoundError:
+            continue  # another worker got there first
+        await asyncio.to_thread(remove_empty_parents, source)
+        summary["quarantined_files"] += 1
+        summary["quarantined_bytes"] += size
+    summary["purged_batches"] = await asyncio.to_thread(purge_quarantine)
+    return summary
+
+async def run_orphaned_upload_sweeper():
+    while True:
+        # First pass one interval after startup, not during it
+        await asyncio.sleep(ORPHAN_SWEEP_SECONDS)
+        try:
+            summary = await quarantine_orphaned_uploads()
+            if summary["quarantined_files"] or summary["purged_batches"]:
+                logger.info(
+                    f"Quarantined {summary['quarantined_files']} orphaned uploads "
+                    f"({summary['quarantined_bytes']} bytes), purged {summary['purged_batches']} old batches"
+                )
+        except Exception as e:
+            logger.warning(f"Orphaned upload sweep failed: {e}")
+
+async def migrate_student_document_records() -> int:
+    """Create db.student_documents records for documents listed only on the student (idempotent)
+
+    Uses the per-student document_info metadata where present; older uploads get their
+    file name, content type and upload time from the file itself.
+    """
+    created = 0
+    async for student_doc in db.students.find(
+        {"documents": {"$exists": True, "$ne": {}}},
+        {"_id": 0, "id": 1, "documents": 1, "document_info": 1}
+    ):
+        stored_info = student_doc.get("document_info") or {}
+        for document_type, file_path in student_doc["documents"].items():
+            file_info = stored_info.get(document_type) or {}
+            legacy_path = Path(file_path)
+            uploaded_at = file_info.get("uploaded_at")
+            if uploaded_at is None:
+                try:
+                    uploaded_at = datetime.utcfromtimestamp(legacy_path.stat().st_mtime)
+                except FileNotFoundError:
+                    uploaded_at = datetime.utcnow()
+            record = StudentDocument(
+                student_id=student_doc["id"],
+                type=document_type,
+                path=file_path,
+                file_name=file_info.get("file_name") or legacy_path.name,
+                size=file_info.get("size"),
+                sha256=file_info.get("sha256"),
+                content_type=file_info.get("content_type") or DOCUMENT_TYPES.get(legacy_path.suffix.lower(), (None, 0))[0],
+                uploaded_at=uploaded_at,
+                uploaded_by=file_info.get("uploaded_by")
+            )
+            result = await db.student_documents.update_one(
+                {"student_id": student_doc["id"], "type": document_type},
+                {"$setOnInsert": record.dict()},
+                upsert=True
+            )
+            if result.upserted_id is not None:
+                created += 1
+        if stored_info:
+            await db.students.update_one({"id": student_doc["id"]}, {"$unset": {"document_info": ""}})
+    return created
+
+def move_to_current_layout(source: Path, target: Path) -> bool:
+    """Move a legacy-layout object file or thumbnail folder to its current location; False when already moved"""
+    if not source.exists():
+        return False
+    if target.exists():
+        # Same content hash, so the copy already in place is identical
+        shutil.rmtree(source) if source.is_dir() else source.unlink()
+        return False
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(source, target)
+    try:
+        source.parent.rmdir()  # only succeeds once the old prefix directory is empty
+    except OSError:
+        pass
+    return True
+
+async def migrate_document_layout(batch_size: int, restart: bool = False) -> Dict[str, Any]:
+    """Move up to batch_size store objects (and thumbnails) from objects/ab/<sha> to objects/ab/cd/<sha>
+
+    Resumable: progress is checkpointed in db.migrations by content hash, and every step is a no-op
+    once done. Records are rewritten after the move; until then DocumentStore.locate finds the file.
+    """
+    if restart:
+        await db.migrations.delete_one({"_id": "document_layout"})
+    checkpoint = await db.migrations.find_one({"_id": "document_layout"}) or {}
+    last_sha256 = checkpoint.get("last_sha256", "")
+    summary = {"moved_objects": 0, "rewritten_paths": 0}
+    
+    async for object_doc in db.document_objects.find(
+        {"sha256": {"$gt": last_sha256}}, {"_id": 0, "sha256": 1}
+    ).sort("sha256", 1).limit(batch_size):
+        sha256 = object_doc["sha256"]
+        legacy_path, object_path = document_store.legacy_path_for(sha256), document_store.path_for(sha256)
+        if await asyncio.to_thread(move_to_current_layout, legacy_path, object_path):
+            summary["moved_objects"] += 1
+        await asyncio.to_thread(
+            move_to_current_layout, document_store.legacy_derivatives_dir(sha256), document_store.derivatives_dir(sha256)
+        )
+        
+        # Point every document still recorded under the old path at the new one
+        async for record in db.student_documents.find(
+            {"sha256": sha256, "path": str(legacy_path)}, {"_id": 0, "student_id": 1, "type": 1}
+        ):
+            await db.students.update_one(
+                {"id": record["student_id"], f"documents.{record['type']}": str(legacy_path)},
+                {"$set": {f"documents.{record['type']}": str(object_path)}}
+            )
+        result = await db.student_documents.update_many(
+            {"sha256": sha256, "path": str(legacy_path)}, {"$set": {"path": str(object_path)}}
+        )
+        summary["rewritten_paths"] += result.modified_count
+        last_sha256 = sha256
     
-    # Generate random sequence and ensure uniqueness
-    for _ in range(100):  # Max 100 attempts to find unique number
-        sequence = random.randint(1000, 9999)
-        receipt_number = f"RCPT-{date_str}-{sequence}"
+    await db.migrations.update_one(
+        {"_id": "document_layout"},
+        {"$set": {"last_sha256": last_sha256, "updated_at": datetime.utcnow()}},
+        upsert=True
+    )
+    summary["remaining_objects"] = await db.document_objects.count_documents({"sha256": {"$gt": last_sha256}})
+    summary["done"] = summary["remaining_objects"] == 0
+    return summary
+
+async def migrate_documents_to_store():
+    """Move legacy per-student uploads into the content-addressed document store (idempotent)"""
+    summary = {
+        "created_records": await migrate_student_document_records(),
+        "migrated_documents": 0, "missing_files": 0, "deduplicated_bytes": 0
+    }
+    async for record in db.student_documents.find({}, {"_id": 0, "student_id": 1, "type": 1, "path": 1}):
+        file_path = record["path"]
+        if document_store.holds(file_path):
+            continue
+        legacy_path = Path(file_path)
+        if not legacy_path.exists():
+            summary["missing_files"] += 1
+            continue
+        
+        stored = await asyncio.to_thread(hash_file, legacy_path)
+        content_type = DOCUMENT_TYPES.get(legacy_path.suffix.lower(), ("application/octet-stream", 0))[0]
+        if await document_storage.exists(upload_storage_key(await document_store.locate(stored["sha256"]))):
+            summary["deduplicated_bytes"] += stored["size"]
+        
+        incoming_path = document_store.incoming_path()
+        os.replace(legacy_path, incoming_path)
+        object_path = await document_store.ingest(incoming_path, stored["sha256"], stored["size"], content_type)
+        try:
+            legacy_path.parent.rmdir()  # only succeeds once the student directory is empty
+        except OSError:
+            pass
         
-        # Check if this receipt number already exists in any collection that might store it
-        # For now, we'll just use the random generation as it's very unlikely to collision
-        # In future, if we store receipt numbers, we can add a database check here
-        return receipt_number
+        result = await db.student_documents.update_one(
+            {"student_id": record["student_id"], "type": record["type"], "path": file_path},
+            {"$set": {
+                "path": str(object_path),
+                "size": stored["size"],
+                "sha256": stored["sha256"],
+                "content_type": content_type
+            }}
+        )
+        if result.matched_count == 0:
+            # Replaced by a new upload while migrating
+            await document_store.release(stored["sha256"])
+            continue
+        await db.students.update_one(
+            {"id": record["student_id"], f"documents.{record['type']}": file_path},
+            {"$set": {f"documents.{record['type']}": str(object_path)}}
+        )
+        summary["migrated_documents"] += 1
+    
+    return summary
+
+def get_receipt_render_executor():
+    """Process pool used for receipt rendering, created on first use (None when disabled)"""
+    global receipt_render_executor
+    if RECEIPT_RENDER_WORKERS <= 0:
+        return None
+    if receipt_render_executor is None:
+        # spawn: never fork a parent that is running the event loop and Mongo threads
+        receipt_render_executor = ProcessPoolExecutor(
+            max_workers=RECEIPT_RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return receipt_render_executor
+
+async def run_receipt_render(func, *args, **kwargs):
+    """Run a pure receipt render function off the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_receipt_render_executor(), functools.partial(func, *args, **kwargs))
+
+def flatten_signature_image(image):
+    """RGB copy of a signature image, compositing any transparency onto white"""
+    from PIL import Image
+    
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+def normalize_signature_data(signature_data: str):
+    """Validate a signature data URL / base64 image and re-encode it as a trimmed, size-capped RGB PNG.
+
+    Returns (data_url, sha256 of the PNG bytes); raises ValueError for malformed input.
+    """
+    from PIL import Image, ImageChops, UnidentifiedImageError
+    
+    signature_bytes = decode_image_data_url(signature_data, SIGNATURE_MAX_UPLOAD_BYTES)
+    
+    try:
+        image = Image.open(io.BytesIO(signature_bytes))
+        if image.width * image.height > SIGNATURE_MAX_PIXELS:
+            raise ValueError("image dimensions are too large")
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise ValueError("not a readable image")
+    
+    image = flatten_signature_image(image)
+    
+    # Trim the white margin around the strokes (ignoring faint noise)
+    difference = ImageChops.difference(image, Image.new('RGB', image.size, 'white'))
+    bbox = ImageChops.add(difference, difference, 2.0, -20).getbbox()
+    if bbox is None:
+        raise ValueError("image is blank")
+    left, top, right, bottom = bbox
+    image = image.crop((
+        max(0, left - SIGNATURE_TRIM_PADDING),
+        max(0, top - SIGNATURE_TRIM_PADDING),
+        min(image.width, right + SIGNATURE_TRIM_PADDING),
+        min(image.height, bottom + SIGNATURE_TRIM_PADDING),
+    ))
+    image.thumbnail((SIGNATURE_MAX_WIDTH, SIGNATURE_MAX_HEIGHT), Image.LANCZOS)
+    
+    output = io.BytesIO()
+    image.save(output, format='PNG', optimize=True)
+    png_bytes = output.getvalue()
+    data_url = "data:image/png;base64," + base64.b64encode(png_bytes).decode()
+    return data_url, hashlib.sha256(png_bytes).hexdigest()
+
+async def normalize_signature(signature_data: str):
+    """normalize_signature_data off the event loop, mapping malformed input to a 400"""
+    try:
+        return await asyncio.to_thread(normalize_signature_data, signature_data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid signature: {e}")
+
+signature_data_cache = OrderedDict()
+
+async def store_signature(data_url: str, signature_hash: str, created_by: Optional[str] = None) -> str:
+    """Id of the signature version holding this normalized image, inserting it on first use"""
+    signature = Signature(hash=signature_hash, data=data_url, created_by=created_by)
+    try:
+        signature_doc = await db.signatures.find_one_and_update(
+            {"hash": signature_hash},
+            {"$setOnInsert": signature.dict()},
+            upsert=True,
+            projection={"_id": 0, "id": 1},
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # A concurrent upsert inserted the same image first
+        signature_doc = await db.signatures.find_one({"hash": signature_hash}, {"_id": 0, "id": 1})
+    return signature_doc["id"]
+
+async def load_signature_data(signature_ids) -> Dict[str, str]:
+    """signature_id -> data URL for the given ids (LRU cached, versions never change)"""
+    resolved = {}
+    missing = []
+    for signature_id in set(signature_ids):
+        if not signature_id:
+            continue
+        if signature_id in signature_data_cache:
+            signature_data_cache.move_to_end(signature_id)
+            resolved[signature_id] = signature_data_cache[signature_id]
+        else:
+            missing.append(signature_id)
+    
+    if missing:
+        async for signature_doc in db.signatures.find({"id": {"$in": missing}}, {"_id": 0, "id": 1, "data": 1}):
+            resolved[signature_doc["id"]] = signature_doc["data"]
+            signature_data_cache[signature_doc["id"]] = signature_doc["data"]
+        while len(signature_data_cache) > SIGNATURE_CACHE_SIZE:
+            signature_data_cache.popitem(last=False)
+    
+    return resolved
+
+async def migrate_embedded_signatures():
+    """Move signature blobs embedded in student documents into the signatures collection.
+
+    Identical blobs become one signature version; students keep only its signature_id.
+    Idempotent - migrated students no longer carry signature_data.
+    """
+    student_ids_by_blob = {}
+    blobs = {}
+    async for student_doc in db.students.find(
+        {"signature_data": {"$exists": True, "$nin": [None, ""]}},
+        {"_id": 0, "id": 1, "signature_data": 1, "coordinator_approved_by": 1}
+    ):
+        blob_hash = hashlib.sha256(student_doc["signature_data"].encode()).hexdigest()
+        student_ids_by_blob.setdefault(blob_hash, []).append(student_doc["id"])
+        blobs.setdefault(blob_hash, (student_doc["signature_data"], student_doc.get("coordinator_approved_by")))
+    
+    migrated_students = 0
+    signature_ids = set()
+    unreadable = []
+    for blob_hash, student_ids in student_ids_by_blob.items():
+        signature_data, created_by = blobs[blob_hash]
+        try:
+            data_url, signature_hash = await asyncio.to_thread(normalize_signature_data, signature_data)
+        except ValueError as e:
+            # Left embedded; the renderer keeps showing "Not Available" for these
+            logger.warning(f"Skipping unreadable signature on {len(student_ids)} students: {e}")
+            unreadable.extend(student_ids)
+            continue
+        signature_id = await store_signature(data_url, signature_hash, created_by)
+        signature_ids.add(signature_id)
+        result = await db.students.update_many(
+            {"id": {"$in": student_ids}},
+            {"$set": {"signature_id": signature_id}, "$unset": {"signature_data": "", "signature_hash": ""}}
+        )
+        migrated_students += result.modified_count
+    
+    return {
+        "migrated_students": migrated_students,
+        "distinct_blobs": len(student_ids_by_blob),
+        "signature_versions": len(signature_ids),
+        "unreadable_students": unreadable
+    }
+
+async def store_user_signature(data_url: str, signature_hash: str, created_by: Optional[str] = None):
+    """Persist a normalized user signature; returns the users fields that reference it"""
+    signature_id = await store_signature(data_url, signature_hash, created_by)
+    blob_name = await blob_store.put(decode_image_data_url(data_url, SIGNATURE_MAX_UPLOAD_BYTES), "png")
+    return {
+        "signature_id": signature_id,
+        "signature_hash": signature_hash,
+        "signature_url": blob_store.url_for(blob_name)
+    }
+
+async def migrate_user_blobs():
+    """Move inline base64 profile photos and signatures out of user documents into the blob store"""
+    migrated = 0
+    async for user_doc in db.users.find(
+        {"$or": [{"profile_photo": {"$regex": "^data:"}}, {"signature_data": {"$exists": True, "$nin": [None, ""]}}]},
+        {"_id": 0, "id": 1, "profile_photo": 1, "signature_data": 1}
+    ):
+        update_operation = {}
+        try:
+            if (user_doc.get("profile_photo") or "").startswith("data:"):
+                photo_bytes = decode_image_data_url(user_doc["profile_photo"], PROFILE_PHOTO_MAX_BYTES)
+                extension = await asyncio.to_thread(detect_image_extension, photo_bytes)
+                update_operation.setdefault("$set", {})["profile_photo"] = blob_store.url_for(
+                    await blob_store.put(photo_bytes, extension)
+                )
+            if user_doc.get("signature_data"):
+                data_url, signature_hash = await asyncio.to_thread(normalize_signature_data, user_doc["signature_data"])
+                update_operation.setdefault("$set", {}).update(
+                    await store_user_signature(data_url, signature_hash, user_doc["id"])
+                )
+                update_operation["$unset"] = {"signature_data": ""}
+        except ValueError as e:
+            logger.warning(f"Leaving unreadable inline image on user {user_doc['id']}: {e}")
+        if update_operation:
+            await db.users.update_one({"id": user_doc["id"]}, update_operation)
+            migrated += 1
+    return migrated
+
+@functools.lru_cache(maxsize=64)
+def load_signature_reader(signature_data: str):
+    """Decoded signature as a ReportLab ImageReader, cached per process across renders"""
+    from reportlab.lib.utils import ImageReader
+    from PIL import Image
+    
+    encoded_signature = signature_data
+    # Remove data URL prefix if present
+    if encoded_signature.startswith('data:image'):
+        encoded_signature = encoded_signature.split(',')[1]
+    image = Image.open(io.BytesIO(base64.b64decode(encoded_signature, validate=True)))
+    # Signatures written before normalization may still carry transparency
+    if image.mode != 'RGB':
+        image = flatten_signature_image(image)
+    image.load()
+    return ImageReader(image)
+
+async def load_receipt_context(current_user, courses=None, signature_ids=None):
+    """Incentive rule snapshot, admin signature and referenced student signatures for receipt renders"""
+    rule_query = {"active": True}
+    if courses is not None:
+        rule_query["course"] = {"$in": list(courses)}
+    incentive_rules = await db.incentive_rules.find(rule_query, {"_id": 0, "course": 1, "amount": 1}).to_list(length=None)
+    incentive_amounts = {}
+    for incentive_rule in incentive_rules:
+        incentive_amounts.setdefault(incentive_rule["course"], incentive_rule["amount"])
+    
+    admin_user = None
+    # signature_data only remains on users not yet moved by migrate_user_blobs
+    signature_projection = {"_id": 0, "signature_id": 1, "signature_data": 1}
+    
+    if current_user.role == "admin" and current_user.id:
+        admin_user = await db.users.find_one({"id": current_user.id}, signature_projection)
+    
+    if not admin_user or not (admin_user.get('signature_id') or admin_user.get('signature_data')):
+        try:
+            admin_user = await db.users.find_one({"role": "admin", "$or": [
+                {"signature_id": {"$exists": True, "$ne": None}},
+                {"signature_data": {"$exists": True, "$ne": None}}
+            ]}, signature_projection)
+        except Exception as e:
+            print(f"Error fetching admin signature: {e}")
+    
+    signature_ids = list(signature_ids or [])
+    if admin_user and admin_user.get('signature_id'):
+        signature_ids.append(admin_user['signature_id'])
+    signatures = await load_signature_data(signature_ids)
+    
+    admin_signature = None
+    if admin_user:
+        admin_signature = signatures.get(admin_user.get('signature_id'), admin_user.get('signature_data'))
     
-    # Fallback: use timestamp if we can't find unique random number
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    return f"RCPT-{timestamp}"
+    return {"incentive_amounts": incentive_amounts, "admin_signature": admin_signature, "signatures": signatures}
+
+def collect_receipt_render_args(student_doc, current_user, agent_doc, is_admin_generated, receipt_doc, receipt_context):
+    """Everything render_unified_receipt_pdf needs, as plain picklable values"""
+    return {
+        "student_doc": {
+            key: student_doc.get(key)
+            for key in ("token_number", "first_name", "last_name", "email", "phone",
+                        "course", "status", "created_at", "updated_at")
+        },
+        "agent_name": agent_doc["username"] if agent_doc else "Unknown Agent",
+        # Only the admin variant prints who generated it
+        "generated_by": current_user.username if is_admin_generated else None,
+        "is_admin_generated": is_admin_generated,
+        "incentive_amount": receipt_context["incentive_amounts"].get(student_doc["course"], 0),
+        "coordinator_signature": receipt_context["signatures"].get(student_doc.get('signature_id'),
+                                                                    student_doc.get('signature_data')),
+        "admin_signature": receipt_context["admin_signature"],
+        "receipt_number": receipt_doc["receipt_number"],
+        "generated_at": receipt_doc["created_at"]
+    }
+
+def receipt_render_key(render_args) -> str:
+    """Content hash of everything that affects the rendered receipt (used as cache key and ETag)"""
+    key_material = dict(render_args)
+    for field in ("coordinator_signature", "admin_signature"):
+        signature = key_material[field]
+        key_material[field] = hashlib.sha256(signature.encode()).hexdigest() if signature else None
+    key_material["layout_version"] = RECEIPT_LAYOUT_VERSION
+    encoded = json.dumps(key_material, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+async def prepare_unified_receipt(student_doc, current_user, agent_doc, is_admin_generated=False):
+    """Issue (or look up) the student's receipt and return (render_key, render_args)"""
+    receipt_doc = await get_or_create_receipt(student_doc, current_user)
+    receipt_context = await load_receipt_context(
+        current_user, courses=[student_doc["course"]], signature_ids=[student_doc.get("signature_id")]
+    )
+    render_args = collect_receipt_render_args(
+        student_doc, current_user, agent_doc, is_admin_generated, receipt_doc, receipt_context
+    )
+    return receipt_render_key(render_args), render_args
+
+def receipt_archive_slot(render_args) -> str:
+    """Which archived render a new one supersedes: the coordinator copy, or the generating admin's own copy"""
+    if not render_args["is_admin_generated"]:
+        return "coordinator"
+    # Each admin's copy carries their name and signature; hashed since usernames may contain "." or "$"
+    return "admin-" + hashlib.sha256(render_args["generated_by"].encode()).hexdigest()[:16]
+
+async def load_unified_receipt_pdf(render_key, render_args) -> bytes:
+    """Rendered receipt bytes from the cache, rendering in the pool on a miss"""
+    pdf_bytes = await receipt_render_cache.get(render_key)
+    if pdf_bytes is None:
+        pdf_bytes = await run_receipt_render(render_unified_receipt_pdf, **render_args)
+        await receipt_render_cache.put(render_key, pdf_bytes)
+        # The archive keeps one render per receipt and slot: a change to the student, incentive or signatures
+        # makes a new render key, so the one it replaces on the receipt record is deleted. Admins have a
+        # slot each, so admins downloading the same receipt do not evict each other's copies.
+        slot = receipt_archive_slot(render_args)
+        receipt_doc = await db.receipts.find_one_and_update(
+            {"receipt_number": render_args["receipt_number"]},
+            {"$set": {f"archive_keys.{slot}": render_key}},
+            return_document=ReturnDocument.BEFORE
+        )
+        previous_key = ((receipt_doc or {}).get("archive_keys") or {}).get(slot)
+        if previous_key and previous_key != render_key:
+            await receipt_render_cache.discard(previous_key)
+    return pdf_bytes
 
 async def generate_unified_receipt_pdf(student_doc, current_user, agent_doc, is_admin_generated=False):
     """Generate unified PDF receipt with professional A5 layout and dual signatures"""
+    render_key, render_args = await prepare_unified_receipt(student_doc, current_user, agent_doc, is_admin_generated)
+    return BytesIO(await load_unified_receipt_pdf(render_key, render_args))
+
+class ZipStreamBuffer(io.RawIOBase):
+    """Write-only, unseekable sink so zipfile can build an archive while it is being streamed"""
+    
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._offset = 0
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self._offset
+    
+    def drain(self) -> bytes:
+        """Bytes written since the previous drain"""
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True when an If-None-Match header value covers the given (strong) ETag"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+def not_modified_since(if_modified_since: Optional[str], last_modified: float) -> bool:
+    """True when an If-Modified-Since header is at or after last_modified (a UNIX timestamp)"""
+    if not if_modified_since:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP dates have one-second resolution
+    return int(last_modified) <= since.timestamp()
+
+def parse_byte_range(range_header: str, size: int) -> Optional[tuple]:
+    """(start, end) of a single "bytes=" range, inclusive; None when the header should be ignored
+
+    Multi-range requests get the whole file. Unsatisfiable ranges raise 416.
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, _, last = ranges.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(last), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise HTTPException(
+            status_code=416, detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    if start < 0 or end < start:
+        return None
+    return start, min(end, size - 1)
+
+class RangeFileResponse(FileResponse):
+    """FileResponse sent in DOWNLOAD_CHUNK_SIZE chunks that can also serve one byte range (206)"""
+    chunk_size = DOWNLOAD_CHUNK_SIZE
+    
+    def __init__(self, path, stat_result: os.stat_result, byte_range: Optional[tuple] = None, **kwargs):
+        super().__init__(path, stat_result=stat_result, **kwargs)
+        self.byte_range = byte_range
+        self.headers["accept-ranges"] = "bytes"
+        if byte_range is not None:
+            start, end = byte_range
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {start}-{end}/{stat_result.st_size}"
+            self.headers["content-length"] = str(end - start + 1)
+    
+    async def __call__(self, scope, receive, send):
+        if self.byte_range is None:
+            # Whole file: FileResponse uses the server's pathsend extension when offered
+            await super().__call__(scope, receive, send)
+            return
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        start, end = self.byte_range
+        remaining = end - start + 1
+        async with aiofiles.open(self.path, "rb") as file:
+            await file.seek(start)
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # File shrank underneath us; close the body rather than hang the client
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+class StoredObjectResponse(Response):
+    """Object from a remote storage backend streamed through this process, whole or one byte range (206)"""
+    
+    def __init__(self, storage, key: str, stat_result, byte_range: Optional[tuple] = None,
+                 media_type: Optional[str] = None, headers: Optional[Dict[str, str]] = None):
+        self.storage = storage
+        self.key = key
+        super().__init__(status_code=206 if byte_range is not None else 200, media_type=media_type, headers=headers)
+        start, end = byte_range if byte_range is not None else (0, stat_result.st_size - 1)
+        self.byte_range = (start, end)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["content-length"] = str(max(end - start + 1, 0))
+        self.headers.setdefault("last-modified", formatdate(stat_result.st_mtime, usegmt=True))
+        if byte_range is not None:
+            self.headers["content-range"] = f"bytes {start}-{end}/{stat_result.st_size}"
+    
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        start, end = self.byte_range
+        if scope["method"].upper() != "HEAD" and end >= start:
+            async for chunk in self.storage.iter_range(self.key, start, end):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+def stored_file_response(storage, key: str, stat_result, byte_range: Optional[tuple],
+                         media_type: str, headers: Dict[str, str]) -> Response:
+    """Response sending a stored object: from disk (pathsend when available) or streamed from the backend"""
+    local_path = storage.local_path(key)
+    if local_path is not None:
+        return RangeFileResponse(
+            local_path, stat_result=stat_result, byte_range=byte_range, media_type=media_type, headers=headers
+        )
+    return StoredObjectResponse(storage, key, stat_result, byte_range, media_type=media_type, headers=headers)
+
+# Separate key so a signed document link can never be mistaken for a JWT (or vice versa)
+DOCUMENT_URL_KEY = hashlib.sha256(f"{SECRET_KEY}:document-url".encode()).digest()
+
+def _urlsafe_b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def sign_document_url(student_id: str, document_type: str, file_path: str, file_info: Optional[Dict[str, Any]]) -> str:
+    """Short-lived download link that carries everything needed to serve the file (no DB lookup)
+
+    Expiry is rounded to DOCUMENT_URL_TTL_SECONDS buckets, so the link stays identical for a while
+    and browsers can reuse their cached copy.
+    """
+    file_info = file_info or {}
+    uploaded_at = file_info.get("uploaded_at")
+    payload = {
+        "s": student_id,
+        "t": document_type,
+        "p": file_path,
+        "n": file_info.get("file_name"),
+        "h": file_info.get("sha256"),
+        "m": uploaded_at.replace(tzinfo=timezone.utc).timestamp() if isinstance(uploaded_at, datetime) else None,
+        "e": (int(time.time()) // DOCUMENT_URL_TTL_SECONDS + 2) * DOCUMENT_URL_TTL_SECONDS
+    }
+    body = _urlsafe_b64(json.dumps(payload, separators=(",", ":")).encode())
+    signature = _urlsafe_b64(hmac.new(DOCUMENT_URL_KEY, body.encode(), hashlib.sha256).digest())
+    return f"/api/documents/signed/{body}.{signature}"
+
+def verify_document_url(token: str) -> Dict[str, Any]:
+    """Payload of a signed document link; 403 when the signature is wrong or the link expired"""
+    body, _, signature = token.partition(".")
+    expected = _urlsafe_b64(hmac.new(DOCUMENT_URL_KEY, body.encode(), hashlib.sha256).digest())
+    # Compared as bytes: compare_digest rejects non-ASCII str with TypeError
+    if not hmac.compare_digest(signature.encode("utf-8"), expected.encode()):
+        raise HTTPException(status_code=403, detail="Invalid document link")
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(body + "=" * (-len(body) % 4)))
+        expires_at = float(payload["e"])
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=403, detail="Invalid document link")
+    if expires_at < time.time():
+        raise HTTPException(status_code=403, detail="Document link has expired")
+    return payload
+
+def offloaded_file_response(file_path: Path, media_type: str, headers: Dict[str, str]) -> Response:
+    """Empty response telling the front proxy which file to send (DOCUMENT_SERVE_MODE other than "app")
+
+    The proxy handles Range and streams the bytes; the headers set here (disposition, caching) are kept.
+    """
+    if DOCUMENT_SERVE_MODE == "x-accel-redirect":
+        relative_path = file_path.resolve().relative_to(UPLOAD_DIR.resolve())
+        internal_uri = DOCUMENT_ACCEL_PREFIX.rstrip("/") + "/" + urllib.parse.quote(relative_path.as_posix())
+        headers = {**headers, "X-Accel-Redirect": internal_uri}
+    else:
+        headers = {**headers, "X-Sendfile": str(file_path.resolve())}
+    return Response(media_type=media_type, headers=headers)
+
+async def unified_receipt_response(request: Request, student_doc, current_user, agent_doc, is_admin_generated, filename):
+    """Receipt download response with ETag / If-None-Match (304) support"""
+    render_key, render_args = await prepare_unified_receipt(student_doc, current_user, agent_doc, is_admin_generated)
+    etag = f'"{render_key}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    pdf_bytes = await load_unified_receipt_pdf(render_key, render_args)
+    headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return Response(content=pdf_bytes, media_type="application/pdf", headers=headers)
+
+def render_unified_receipt_pdf(student_doc, agent_name, generated_by, is_admin_generated, incentive_amount,
+                               coordinator_signature, admin_signature, receipt_number, generated_at):
+    """Render the unified A5 receipt from already-fetched data (pure, runs in the render pool)"""
     from reportlab.pdfgen import canvas
     from reportlab.lib.pagesizes import A5
-    from reportlab.lib.units import inch
-    from reportlab.lib.colors import HexColor, white, black
-    from io import BytesIO
-    import base64
-    from PIL import Image
-    import io
     
     buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A5)
-    width, height = A5  # A5 size: 420 x 595 points
+    # invariant: identical inputs produce identical bytes (no embedded timestamps/ids)
+    p = canvas.Canvas(buffer, pagesize=A5, invariant=1)
+    draw_unified_receipt_page(
+        p, {}, student_doc, agent_name, generated_by, is_admin_generated, incentive_amount,
+        coordinator_signature, admin_signature, receipt_number, generated_at
+    )
+    p.showPage()
+    p.save()
     
-    # Professional color palette
-    primary_color = HexColor('#1e40af')  # Blue
-    success_color = HexColor('#16a34a')  # Green
-    light_gray = HexColor('#f8fafc')     # Light background
-    dark_gray = HexColor('#374151')      # Dark text
+    return buffer.getvalue()
+
+def render_unified_receipt_batch_pdf(render_args_list):
+    """Render many receipts as one multi-page A5 PDF sharing the template and signature XObjects"""
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A5
     
-    # Generate unique receipt number
-    receipt_number = await generate_unique_receipt_number()
+    buffer = BytesIO()
+    p = canvas.Canvas(buffer, pagesize=A5, invariant=1)
+    page_assets = {}
+    for render_args in render_args_list:
+        draw_unified_receipt_page(p, page_assets, **render_args)
+        p.showPage()
+    p.save()
     
-    # Get incentive amount for this student's course
-    incentive_amount = 0
-    incentive_rule = await db.incentive_rules.find_one({"course": student_doc["course"], "active": True})
-    if incentive_rule:
-        incentive_amount = incentive_rule["amount"]
+    return buffer.getvalue()
+
+def unified_receipt_layout():
+    """Shared geometry and palette of the unified A5 receipt (template and per-receipt layers)"""
+    from reportlab.lib.pagesizes import A5
+    from reportlab.lib.colors import HexColor
+    
+    width, height = A5  # A5 size: 420 x 595 points
+    status_y = height - 105
+    details_start_y = status_y - 45
+    process_start_y = details_start_y - 110
+    signature_start_y = process_start_y - 90  # Reduced gap
+    signature_box_width = (width - 80) / 2
+    signature_box_height = 60  # Slightly reduced height
+    
+    return {
+        "width": width,
+        "height": height,
+        "status_y": status_y,
+        "details_start_y": details_start_y,
+        "process_start_y": process_start_y,
+        "signature_start_y": signature_start_y,
+        "signature_box_width": signature_box_width,
+        "signature_box_height": signature_box_height,
+        "coord_box_x": 30,
+        "admin_box_x": 30 + signature_box_width + 20,
+        "footer_y": signature_start_y - signature_box_height - 20,  # Reduced gap significantly
+        # Professional color palette
+        "primary_color": HexColor('#1e40af'),  # Blue
+        "success_color": HexColor('#16a34a'),  # Green
+        "light_gray": HexColor('#f8fafc'),     # Light background
+        "dark_gray": HexColor('#374151'),      # Dark text
+        "muted_gray": HexColor('#6b7280'),     # Gray for not available
+    }
+
+def draw_unified_receipt_template(p, name, is_admin_generated):
+    """Define the static receipt layer (header, banner, box outlines, footer, border) as form XObject `name`"""
+    from reportlab.lib.colors import white, black
+    
+    layout = unified_receipt_layout()
+    width, height = layout["width"], layout["height"]
+    primary_color = layout["primary_color"]
+    success_color = layout["success_color"]
+    light_gray = layout["light_gray"]
+    dark_gray = layout["dark_gray"]
     
     # Helper function to draw rounded rectangle
     def draw_rounded_rect(x, y, width, height, fill_color=None, stroke_color=black):
@@ -279,6 +2210,8 @@ async def generate_unified_receipt_pdf(student_doc, current_user, agent_doc, is_
             p.setStrokeColor(stroke_color)
             p.rect(x, y, width, height, fill=0, stroke=1)
     
+    p.beginForm(name)
+    
     # 1. HEADER SECTION (Top)
     # Logo and title - centered
     p.setFillColor(primary_color)
@@ -300,7 +2233,7 @@ async def generate_unified_receipt_pdf(student_doc, current_user, agent_doc, is_
     p.line(30, height - 75, width - 30, height - 75)
     
     # 2. ADMISSION STATUS BLOCK (Highlighted)
-    status_y = height - 105
+    status_y = layout["status_y"]
     draw_rounded_rect(30, status_y - 20, width - 60, 25, fill_color=success_color)
     p.setFillColor(white)
     p.setFont("Helvetica-Bold", 14)
@@ -308,19 +2241,81 @@ async def generate_unified_receipt_pdf(student_doc, current_user, agent_doc, is_
     status_width = p.stringWidth(status_text, "Helvetica-Bold", 14)
     p.drawString((width - status_width) / 2, status_y - 12, status_text)
     
-    # 3. STUDENT DETAILS (Two-Column Grid)
-    details_start_y = status_y - 45
-    p.setFillColor(light_gray)
+    # 3. STUDENT DETAILS box (Two-Column Grid)
+    details_start_y = layout["details_start_y"]
     draw_rounded_rect(30, details_start_y - 80, width - 60, 80, fill_color=light_gray)
     
-    # Grid details
+    # 4. PROCESS DETAILS (Card Style Box)
+    process_start_y = layout["process_start_y"]
+    draw_rounded_rect(30, process_start_y - 60, width - 60, 60, fill_color=white, stroke_color=primary_color)
+    
+    p.setFillColor(primary_color)
+    p.setFont("Helvetica-Bold", 10)
+    p.drawString(40, process_start_y - 12, "Process Details")
+    
+    # 5. DIGITAL SIGNATURES (Dual Box Alignment) - box borders and labels
+    signature_start_y = layout["signature_start_y"]
+    signature_box_width = layout["signature_box_width"]
+    signature_box_height = layout["signature_box_height"]
+    for box_x, label in ((layout["coord_box_x"], "Coordinator Signature"),
+                         (layout["admin_box_x"], "Admin Signature")):
+        draw_rounded_rect(box_x, signature_start_y - signature_box_height, signature_box_width,
+                          signature_box_height, fill_color=white, stroke_color=dark_gray)
+        p.setFillColor(dark_gray)
+        p.setFont("Helvetica-Bold", 8)
+        label_width = p.stringWidth(label, "Helvetica-Bold", 8)
+        p.drawString(box_x + (signature_box_width - label_width) / 2, signature_start_y - 10, label)
+    
+    # 6. FOOTER - Positioned closer to signatures
+    footer_y = layout["footer_y"]
+    
+    # Footer background
+    draw_rounded_rect(30, footer_y - 25, width - 60, 25, fill_color=light_gray)  # Reduced height
+    
+    # Disclaimer on second line
+    p.setFillColor(dark_gray)
+    p.setFont("Helvetica-Oblique", 6)
+    disclaimer = "This is a computer-generated receipt and does not require a physical signature."
+    p.drawString(40, footer_y - 18, disclaimer)
+    
+    # Professional border around entire receipt - adjusted for compact layout
+    border_margin = 15  # Reduced border margin
+    p.setStrokeColor(primary_color)
+    p.setLineWidth(1.5)
+    # Calculate actual content height for proper border
+    content_height = height - (footer_y - 25) - border_margin
+    p.rect(border_margin, footer_y - 25, width - (2 * border_margin), 
+           content_height, fill=0, stroke=1)
+    
+    p.endForm()
+
+def draw_unified_receipt_page(p, page_assets, student_doc, agent_name, generated_by, is_admin_generated,
+                              incentive_amount, coordinator_signature, admin_signature, receipt_number, generated_at):
+    """Draw one receipt page over the shared template.
+
+    page_assets records the template forms already defined on this canvas, so across the pages
+    of a batch each is defined only once (signature images are deduplicated by ReportLab).
+    """
+    layout = unified_receipt_layout()
+    width = layout["width"]
+    success_color = layout["success_color"]
+    dark_gray = layout["dark_gray"]
+    
+    # Static layer: defined once per canvas, referenced by every page
+    template_name = "UnifiedReceiptAdmin" if is_admin_generated else "UnifiedReceipt"
+    if ("template", template_name) not in page_assets:
+        draw_unified_receipt_template(p, template_name, is_admin_generated)
+        page_assets[("template", template_name)] = True
+    p.doForm(template_name)
+    
+    # 3. STUDENT DETAILS (Two-Column Grid)
     p.setFillColor(dark_gray)
     p.setFont("Helvetica", 9)
     left_col_x = 40
     right_col_x = width / 2 + 10
     row_height = 12
     
-    current_y = details_start_y - 15
+    current_y = layout["details_start_y"] - 15
     
     # Row 1
     p.drawString(left_col_x, current_y, f"Token Number: {student_doc['token_number']}")
@@ -344,19 +2339,11 @@ async def generate_unified_receipt_pdf(student_doc, current_user, agent_doc, is_
     p.setFillColor(dark_gray)
     p.drawString(left_col_x, current_y, f"Course Incentive: Rs. {incentive_amount:,.0f}")
     
-    # 4. PROCESS DETAILS (Card Style Box)
-    process_start_y = details_start_y - 110
-    draw_rounded_rect(30, process_start_y - 60, width - 60, 60, fill_color=white, stroke_color=primary_color)
-    
-    p.setFillColor(primary_color)
-    p.setFont("Helvetica-Bold", 10)
-    p.drawString(40, process_start_y - 12, "Process Details")
-    
+    # 4. PROCESS DETAILS
     p.setFillColor(dark_gray)
     p.setFont("Helvetica", 8)
-    process_y = process_start_y - 25
+    process_y = layout["process_start_y"] - 25
     
-    agent_name = agent_doc["username"] if agent_doc else "Unknown Agent"
     p.drawString(40, process_y, f"Processed by Agent: {agent_name}")
     process_y -= 10
     
@@ -368,125 +2355,55 @@ async def generate_unified_receipt_pdf(student_doc, current_user, agent_doc, is_
         process_y -= 10
     
     if is_admin_generated:
-        p.drawString(40, process_y, f"Generated by Admin: {current_user.username}")
+        p.drawString(40, process_y, f"Generated by Admin: {generated_by}")
     
-    # 5. DIGITAL SIGNATURES (Dual Box Alignment) - Optimized spacing
-    signature_start_y = process_start_y - 90  # Reduced gap
-    signature_box_width = (width - 80) / 2
-    signature_box_height = 60  # Slightly reduced height
+    # 5. DIGITAL SIGNATURES
+    signature_start_y = layout["signature_start_y"]
+    signature_box_width = layout["signature_box_width"]
+    signature_box_height = layout["signature_box_height"]
     
-    # Get signatures
-    coordinator_signature = student_doc.get('signature_data')
-    admin_signature = None
-    
-    if current_user.role == "admin" and current_user.id:
-        admin_user = await db.users.find_one({"id": current_user.id})
-        if admin_user and admin_user.get('signature_data'):
-            admin_signature = admin_user['signature_data']
-    
-    if not admin_signature:
-        try:
-            admin_user = await db.users.find_one({"role": "admin", "signature_data": {"$exists": True, "$ne": None}})
-            if admin_user and admin_user.get('signature_data'):
-                admin_signature = admin_user['signature_data']
-        except Exception as e:
-            print(f"Error fetching admin signature: {e}")
+    def draw_not_available(x, y, width, height):
+        p.setFillColor(layout["muted_gray"])
+        p.setFont("Helvetica-Oblique", 8)
+        na_text = "Not Available"
+        na_width = p.stringWidth(na_text, "Helvetica-Oblique", 8)
+        p.drawString(x + (width - na_width) / 2, y - height / 2, na_text)
     
     def draw_signature_box(x, y, width, height, signature_data, label):
-        """Draw signature box with clean presentation"""
-        # Draw box border
-        draw_rounded_rect(x, y - height, width, height, fill_color=white, stroke_color=dark_gray)
-        
-        # Draw label
-        p.setFillColor(dark_gray)
-        p.setFont("Helvetica-Bold", 8)
-        label_width = p.stringWidth(label, "Helvetica-Bold", 8)
-        p.drawString(x + (width - label_width) / 2, y - 10, label)
-        
-        # Process and draw signature
+        """Draw signature image inside its template box"""
         if signature_data:
             try:
-                # Remove data URL prefix if present
-                if signature_data.startswith('data:image'):
-                    signature_data = signature_data.split(',')[1]
-                
-                # Validate base64 data
-                signature_bytes = base64.b64decode(signature_data, validate=True)
-                signature_img = Image.open(io.BytesIO(signature_bytes))
-                
-                # Convert to RGB if needed
-                if signature_img.mode != 'RGB':
-                    signature_img = signature_img.convert('RGB')
-                
-                # Create temporary buffer for ReportLab
-                temp_signature = io.BytesIO()
-                signature_img.save(temp_signature, format='PNG')
-                temp_signature.seek(0)
+                # drawImage registers an ImageReader as a named XObject, embedded once per document
+                signature_img = load_signature_reader(signature_data)
                 
                 # Draw signature image centered in box
                 sig_width = width - 10
                 sig_height = height - 20  # Reduced padding
-                p.drawInlineImage(temp_signature, x + 5, y - height + 5, sig_width, sig_height)
+                p.drawImage(signature_img, x + 5, y - height + 5, sig_width, sig_height)
                 
             except Exception as e:
                 print(f"Signature processing error for {label}: {e}")
                 # Show "Not Available" for any processing errors
-                p.setFillColor(HexColor('#6b7280'))  # Gray for not available
-                p.setFont("Helvetica-Oblique", 8)
-                na_text = "Not Available"
-                na_width = p.stringWidth(na_text, "Helvetica-Oblique", 8)
-                p.drawString(x + (width - na_width) / 2, y - height / 2, na_text)
+                draw_not_available(x, y, width, height)
         else:
             # Show "Not Available" for missing signatures
-            p.setFillColor(HexColor('#6b7280'))  # Gray for not available
-            p.setFont("Helvetica-Oblique", 8)
-            na_text = "Not Available"
-            na_width = p.stringWidth(na_text, "Helvetica-Oblique", 8)
-            p.drawString(x + (width - na_width) / 2, y - height / 2, na_text)
+            draw_not_available(x, y, width, height)
     
-    # Draw signature boxes
-    coord_box_x = 30
-    admin_box_x = 30 + signature_box_width + 20
-    
-    draw_signature_box(coord_box_x, signature_start_y, signature_box_width, signature_box_height, 
+    draw_signature_box(layout["coord_box_x"], signature_start_y, signature_box_width, signature_box_height, 
                       coordinator_signature, "Coordinator Signature")
-    draw_signature_box(admin_box_x, signature_start_y, signature_box_width, signature_box_height, 
+    draw_signature_box(layout["admin_box_x"], signature_start_y, signature_box_width, signature_box_height, 
                       admin_signature, "Admin Signature")
     
-    # 6. FOOTER - Positioned closer to signatures
-    footer_y = signature_start_y - signature_box_height - 20  # Reduced gap significantly
-    
-    # Footer background
-    draw_rounded_rect(30, footer_y - 25, width - 60, 25, fill_color=light_gray)  # Reduced height
-    
+    # 6. FOOTER
+    footer_y = layout["footer_y"]
     p.setFillColor(dark_gray)
     p.setFont("Helvetica", 7)
     
     # Receipt ID and generation date on same line to save space
     p.drawString(40, footer_y - 8, f"Receipt ID: {receipt_number}")
-    gen_date_text = f"Generated: {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+    gen_date_text = f"Generated: {generated_at.strftime('%d/%m/%Y %H:%M')}"
     gen_date_width = p.stringWidth(gen_date_text, "Helvetica", 7)
     p.drawString(width - 40 - gen_date_width, footer_y - 8, gen_date_text)
-    
-    # Disclaimer on second line
-    p.setFont("Helvetica-Oblique", 6)
-    disclaimer = "This is a computer-generated receipt and does not require a physical signature."
-    p.drawString(40, footer_y - 18, disclaimer)
-    
-    # Professional border around entire receipt - adjusted for compact layout
-    border_margin = 15  # Reduced border margin
-    p.setStrokeColor(primary_color)
-    p.setLineWidth(1.5)
-    # Calculate actual content height for proper border
-    content_height = height - (footer_y - 25) - border_margin
-    p.rect(border_margin, footer_y - 25, width - (2 * border_margin), 
-           content_height, fill=0, stroke=1)
-    
-    p.showPage()
-    p.save()
-    buffer.seek(0)
-    
-    return buffer
 
 # Authentication routes
 @api_router.post("/register")
@@ -502,7 +2419,7 @@ async def register(user_data: UserCreate):
         raise HTTPException(status_code=400, detail="Registration already pending approval")
     
     # Create pending user
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash_async(user_data.password)
     pending_user = PendingUser(
         username=user_data.username,
         email=user_data.email,
@@ -524,10 +2441,21 @@ async def register(user_data: UserCreate):
 @api_router.post("/login", response_model=Token)
 async def login(user_data: UserLogin):
     user_doc = await db.users.find_one({"username": user_data.username})
-    if not user_doc or not verify_password(user_data.password, user_doc["hashed_password"]):
+    if not user_doc or not await verify_password_async(user_data.password, user_doc["hashed_password"]):
         raise HTTPException(status_code=401, detail="Incorrect username or password")
     
-    access_token = create_access_token(data={"sub": user_doc["id"]})
+    claims = {"sub": user_doc["id"]}
+    if JWT_STATELESS_CLAIMS:
+        claims.update({
+            "username": user_doc["username"],
+            "role": user_doc["role"],
+            "agent_id": user_doc.get("agent_id"),
+            "first_name": user_doc.get("first_name"),
+            "last_name": user_doc.get("last_name"),
+            "ver": await token_versions.current_version(user_doc["id"])
+        })
+    
+    access_token = create_access_token(data=claims)
     return Token(
         access_token=access_token, 
         token_type="bearer", 
@@ -536,61 +2464,209 @@ async def login(user_data: UserLogin):
     )
 
 @api_router.get("/me", response_model=User)
-async def get_current_user_info(current_user: User = Depends(get_current_user)):
-    return current_user
+async def get_current_user_info(current_user: Principal = Depends(get_current_user)):
+    user_doc = await db.users.find_one({"id": current_user.id})
+    if user_doc is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    return User(**user_doc)
 
 # Student routes
 @api_router.post("/students", response_model=Student)
 async def create_student(
     student_data: StudentCreate, 
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role != "agent":
         raise HTTPException(status_code=403, detail="Only agents can create student records")
     
-    token_number = await generate_token_number()
-    student = Student(
-        token_number=token_number,
-        agent_id=current_user.agent_id or current_user.id,
-        **student_data.dict()
-    )
+    for attempt in range(3):
+        token_number = await generate_token_number()
+        student = Student(
+            token_number=token_number,
+            agent_id=current_user.agent_id or current_user.id,
+            **student_data.dict()
+        )
+        
+        try:
+            await db.students.insert_one(student.dict())
+            return student
+        except DuplicateKeyError:
+            # Token issued outside the counter (e.g. legacy data) - reseed and try again
+            seeded_token_prefixes.discard(token_number[:7])
     
-    await db.students.insert_one(student.dict())
-    return student
+    raise HTTPException(status_code=503, detail="Could not allocate a token number, please retry")
 
 @api_router.post("/students/{student_id}/upload")
 async def upload_document(
     student_id: str,
     document_type: str = Form(...),
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role not in ["agent", "coordinator", "admin"]:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
     # Validate file type
-    if not file.filename.lower().endswith(('.jpg', '.jpeg', '.pdf', '.png')):
+    file_name = Path(file.filename or "").name
+    extension = Path(file_name).suffix.lower()
+    if extension not in DOCUMENT_TYPES:
         raise HTTPException(status_code=400, detail="Only JPG, PNG, and PDF files are allowed")
+    content_type, max_bytes = DOCUMENT_TYPES[extension]
     
-    # Create student directory
-    student_dir = UPLOAD_DIR / student_id
-    student_dir.mkdir(exist_ok=True)
+    if not await db.students.find_one({"id": student_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Student not found")
     
-    # Save file
-    file_path = student_dir / f"{document_type}_{file.filename}"
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Save file (streamed in chunks off the event loop), then store it by content hash
+    incoming_path = document_store.incoming_path()
+    stored = await save_upload_stream(file, incoming_path, max_bytes)
+    file_path = await attach_student_document(
+        student_id, document_type, file_name, content_type, incoming_path, stored, current_user
+    )
     
-    # Update student record
-    await db.students.update_one(
-        {"id": student_id},
-        {"$set": {f"documents.{document_type}": str(file_path)}}
+    return {
+        "message": "Document uploaded successfully",
+        "file_path": str(file_path),
+        "size": stored["size"],
+        "sha256": stored["sha256"]
+    }
+
+# Resumable document uploads: initiate, PUT chunks at offsets, finalize with a checksum
+@api_router.post("/students/{student_id}/uploads")
+async def initiate_resumable_upload(
+    student_id: str,
+    upload: UploadSessionCreate,
+    current_user: Principal = Depends(get_current_user)
+):
+    if current_user.role not in ["agent", "coordinator", "admin"]:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    
+    file_name = Path(upload.file_name).name
+    extension = Path(file_name).suffix.lower()
+    if extension not in DOCUMENT_TYPES:
+        raise HTTPException(status_code=400, detail="Only JPG, PNG, and PDF files are allowed")
+    content_type, max_bytes = DOCUMENT_TYPES[extension]
+    if upload.size <= 0:
+        raise HTTPException(status_code=400, detail="File size must be positive")
+    if upload.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File exceeds the {max_bytes} byte limit for this type")
+    
+    if not await db.students.find_one({"id": student_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    session = UploadSession(
+        student_id=student_id,
+        document_type=upload.document_type,
+        file_name=file_name,
+        content_type=content_type,
+        size=upload.size,
+        created_by=current_user.id
+    )
+    UPLOAD_SESSION_DIR.mkdir(parents=True, exist_ok=True)
+    upload_session_path(session.id).touch()
+    await db.upload_sessions.insert_one(session.dict())
+    
+    return {
+        "upload_id": session.id,
+        "received": 0,
+        "size": session.size,
+        "max_chunk_size": UPLOAD_SESSION_MAX_CHUNK_BYTES,
+        "expires_after_seconds": UPLOAD_SESSION_TTL_SECONDS
+    }
+
+async def get_upload_session(upload_id: str, current_user) -> Dict[str, Any]:
+    session_doc = await db.upload_sessions.find_one({"id": upload_id}, {"_id": 0})
+    # Sessions are private to the user that started them
+    if not session_doc or session_doc["created_by"] != current_user.id:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session_doc
+
+@api_router.get("/uploads/{upload_id}")
+async def get_resumable_upload(upload_id: str, current_user: Principal = Depends(get_current_user)):
+    """Where to resume: the number of contiguous bytes already persisted"""
+    session_doc = await get_upload_session(upload_id, current_user)
+    return {"upload_id": upload_id, "received": session_doc["received"], "size": session_doc["size"]}
+
+@api_router.put("/uploads/{upload_id}")
+async def upload_resumable_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    current_user: Principal = Depends(get_current_user)
+):
+    """Write the request body at `offset`; re-sending already received bytes is harmless"""
+    session_doc = await get_upload_session(upload_id, current_user)
+    if offset < 0 or offset > session_doc["received"]:
+        # Chunks must be contiguous; the client resumes from `received`
+        raise HTTPException(status_code=409, detail={"message": "Offset mismatch", "received": session_doc["received"]})
+    
+    end = offset
+    try:
+        async with aiofiles.open(upload_session_path(upload_id), "r+b") as partial:
+            await partial.seek(offset)
+            async for chunk in request.stream():
+                if end + len(chunk) - offset > UPLOAD_SESSION_MAX_CHUNK_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Chunks are limited to {UPLOAD_SESSION_MAX_CHUNK_BYTES} bytes")
+                if end + len(chunk) > session_doc["size"]:
+                    raise HTTPException(status_code=400, detail="Chunk extends past the declared file size")
+                await partial.write(chunk)
+                end += len(chunk)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    
+    # Bytes written before a dropped connection are kept; a retry overwrites the same range
+    session_doc = await db.upload_sessions.find_one_and_update(
+        {"id": upload_id},
+        {"$max": {"received": end}, "$set": {"updated_at": datetime.utcnow()}},
+        projection={"_id": 0, "received": 1, "size": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not session_doc:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return {"upload_id": upload_id, "received": session_doc["received"], "size": session_doc["size"]}
+
+@api_router.post("/uploads/{upload_id}/finalize")
+async def finalize_resumable_upload(
+    upload_id: str,
+    finalize: UploadSessionFinalize,
+    current_user: Principal = Depends(get_current_user)
+):
+    session_doc = await get_upload_session(upload_id, current_user)
+    if session_doc["received"] < session_doc["size"]:
+        raise HTTPException(status_code=409, detail={"message": "Upload incomplete", "received": session_doc["received"]})
+    
+    partial_path = upload_session_path(upload_id)
+    stored = await asyncio.to_thread(hash_file, partial_path)
+    if stored["size"] != session_doc["size"] or stored["sha256"] != finalize.sha256.lower():
+        await discard_upload_session(upload_id)
+        raise HTTPException(status_code=400, detail="Checksum mismatch; the upload was discarded")
+    
+    # Claim the session so a repeated finalize cannot attach the file twice
+    if not await db.upload_sessions.find_one_and_delete({"id": upload_id}):
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    
+    incoming_path = document_store.incoming_path()
+    os.replace(partial_path, incoming_path)
+    file_path = await attach_student_document(
+        session_doc["student_id"], session_doc["document_type"], session_doc["file_name"],
+        session_doc["content_type"], incoming_path, stored, current_user
     )
     
-    return {"message": "Document uploaded successfully", "file_path": str(file_path)}
+    return {
+        "message": "Document uploaded successfully",
+        "file_path": str(file_path),
+        "size": stored["size"],
+        "sha256": stored["sha256"]
+    }
+
+@api_router.delete("/uploads/{upload_id}")
+async def abort_resumable_upload(upload_id: str, current_user: Principal = Depends(get_current_user)):
+    await get_upload_session(upload_id, current_user)
+    await discard_upload_session(upload_id)
+    return {"message": "Upload cancelled"}
 
 @api_router.get("/students", response_model=List[Student])
-async def get_students(current_user: User = Depends(get_current_user)):
+async def get_students(current_user: Principal = Depends(get_current_user)):
     query = {}
     if current_user.role == "agent":
         query["agent_id"] = current_user.agent_id or current_user.id
@@ -599,27 +2675,15 @@ async def get_students(current_user: User = Depends(get_current_user)):
     return [Student(**student) for student in students]
 
 # Enhanced coordinator endpoints (must be before {student_id} route)
-@api_router.get("/students/paginated")
-async def get_students_paginated(
-    page: int = 1,
-    limit: int = 20,
+def build_student_list_query(
     status: Optional[str] = None,
     course: Optional[str] = None,
     agent_id: Optional[str] = None,
     search: Optional[str] = None,
     date_from: Optional[str] = None,
-    date_to: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
-):
-    """Get paginated student list with advanced filtering for coordinator dashboard"""
-    if current_user.role not in ["coordinator", "admin"]:
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    # Validate and fix page number
-    if page < 1:
-        page = 1
-    
-    # Build query filters
+    date_to: Optional[str] = None
+) -> Dict[str, Any]:
+    """Mongo filter for the coordinator student list filters ("all" / empty means no filter)"""
     query = {}
     
     # Status filter
@@ -661,24 +2725,106 @@ async def get_students_paginated(
         if date_query:
             query["created_at"] = date_query
     
-    # Get total count for pagination
-    total_count = await db.students.count_documents(query)
+    return query
+
+def student_list_filter_hash(query: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(query, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def encode_student_cursor(student: Dict[str, Any], query: Dict[str, Any]) -> str:
+    """Opaque cursor pointing just after this student in (created_at, id) descending order"""
+    created_at = student["created_at"].replace(tzinfo=None).isoformat(timespec="milliseconds")
+    payload = {"c": created_at, "i": student["id"], "f": student_list_filter_hash(query)}
+    return _urlsafe_b64(json.dumps(payload, separators=(",", ":")).encode())
+
+def decode_student_cursor(cursor: str, query: Dict[str, Any]) -> Dict[str, Any]:
+    """Mongo condition selecting the students after a cursor; 400 when malformed or from other filters"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        created_at = datetime.fromisoformat(payload["c"])
+        student_id = str(payload["i"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if payload.get("f") != student_list_filter_hash(query):
+        raise HTTPException(status_code=400, detail="Cursor does not match the current filters")
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": student_id}}
+    ]}
+
+async def count_students(query: Dict[str, Any], mode: str) -> tuple:
+    """(total, exact) for the student list; (None, False) when counting was skipped"""
+    if mode == "none":
+        return None, False
+    if mode == "estimated":
+        if not query:
+            # Collection metadata, no scan
+            return await db.students.estimated_document_count(), False
+        total_count = await db.students.count_documents(query, limit=STUDENT_COUNT_ESTIMATE_LIMIT + 1)
+        if total_count > STUDENT_COUNT_ESTIMATE_LIMIT:
+            return STUDENT_COUNT_ESTIMATE_LIMIT, False
+        return total_count, True
+    return await db.students.count_documents(query), True
+
+@api_router.get("/students/paginated")
+async def get_students_paginated(
+    page: int = 1,
+    limit: int = 20,
+    status: Optional[str] = None,
+    course: Optional[str] = None,
+    agent_id: Optional[str] = None,
+    search: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    cursor: Optional[str] = None,
+    count: Optional[str] = None,
+    current_user: Principal = Depends(get_current_user)
+):
+    """Get paginated student list with advanced filtering for coordinator dashboard
+
+    Pass the previous response's next_cursor to fetch the following page by keyset (cost independent of depth);
+    page then only labels the result. count is "exact" (default without a cursor), "estimated" or "none"
+    (default with a cursor).
+    """
+    if current_user.role not in ["coordinator", "admin"]:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    # Validate and fix page number
+    if page < 1:
+        page = 1
+    count = count or ("none" if cursor else "exact")
+    if count not in ("exact", "estimated", "none"):
+        raise HTTPException(status_code=400, detail="count must be one of: exact, estimated, none")
+    
+    query = build_student_list_query(status, course, agent_id, search, date_from, date_to)
+    
+    # Get total count for pagination (optional; the page itself never needs it)
+    total_count, total_count_exact = await count_students(query, count)
+    total_pages = (total_count + limit - 1) // limit if total_count is not None else None  # Ceiling division
     
-    # Calculate pagination
-    skip = (page - 1) * limit
-    total_pages = (total_count + limit - 1) // limit  # Ceiling division
+    # Newest first; id breaks created_at ties so the keyset order is total
+    if cursor:
+        page_query = {"$and": [query, decode_student_cursor(cursor, query)]}
+        skip = 0
+    else:
+        page_query = query
+        skip = (page - 1) * limit
     
-    # Get paginated students
+    # Get paginated students (one extra tells whether another page follows)
     students_cursor = db.students.find(
-        query, 
+        page_query, 
         {
             "id": 1, "first_name": 1, "last_name": 1, "token_number": 1, 
             "course": 1, "status": 1, "created_at": 1, "agent_id": 1,
             "email": 1, "phone": 1, "updated_at": 1
         }
-    ).sort("created_at", -1).skip(skip).limit(limit)
+    ).sort([("created_at", -1), ("id", -1)]).skip(skip).limit(limit + 1)
     
-    students = await students_cursor.to_list(limit)
+    students = await students_cursor.to_list(limit + 1)
+    has_next = len(students) > limit
+    students = students[:limit]
+    next_cursor = (
+        encode_student_cursor(students[-1], query) if has_next and students[-1].get("created_at") else None
+    )
     
     # Get agent names for display
     agent_ids = list(set(student.get("agent_id") for student in students if student.get("agent_id")))
@@ -720,14 +2866,16 @@ async def get_students_paginated(
             "current_page": page,
             "total_pages": total_pages,
             "total_count": total_count,
+            "total_count_exact": total_count_exact,
             "limit": limit,
-            "has_next": page < total_pages,
-            "has_previous": page > 1
+            "has_next": has_next,
+            "has_previous": page > 1,
+            "next_cursor": next_cursor
         }
     }
 
 @api_router.get("/students/{student_id}/detailed")
-async def get_student_detailed(student_id: str, current_user: User = Depends(get_current_user)):
+async def get_student_detailed(student_id: str, current_user: Principal = Depends(get_current_user)):
     """Get detailed student information including agent details"""
     if current_user.role not in ["coordinator", "admin"]:
         raise HTTPException(status_code=403, detail="Access denied")
@@ -764,28 +2912,40 @@ async def get_student_detailed(student_id: str, current_user: User = Depends(get
     return student_data
 
 @api_router.get("/students/{student_id}/documents")
-async def get_student_documents(student_id: str, current_user: User = Depends(get_current_user)):
+async def get_student_documents(student_id: str, current_user: Principal = Depends(get_current_user)):
     """Get student documents with download information"""
     if current_user.role not in ["coordinator", "admin"]:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    student_doc = await db.students.find_one({"id": student_id})
-    if not student_doc:
+    # One indexed query; metadata was recorded at upload time, so no file is stat()ed
+    records = await db.student_documents.find({"student_id": student_id}, {"_id": 0}).sort("type", 1).to_list(length=None)
+    if not records and not await db.students.find_one({"id": student_id}, {"_id": 1}):
         raise HTTPException(status_code=404, detail="Student not found")
     
-    documents = student_doc.get("documents", {})
     document_info = []
-    
-    for doc_type, file_path in documents.items():
-        # Get file info
-        file_path_obj = Path(file_path)
+    for record in records:
+        doc_type = record["type"]
+        file_path = record["path"]
         document_info.append({
             "type": doc_type,
             "display_name": doc_type.replace('_', ' ').title(),
-            "file_name": file_path_obj.name,
+            "file_name": record["file_name"],
             "file_path": file_path,
             "download_url": f"/api/students/{student_id}/documents/{doc_type}/download",
-            "exists": file_path_obj.exists()
+            "signed_url": sign_document_url(student_id, doc_type, file_path, record),
+            "thumbnail_url": (
+                f"/api/students/{student_id}/documents/{doc_type}/thumbnail"
+                if (record.get("content_type") or "").startswith("image/")
+                and document_store.holds(file_path) else None
+            ),
+            "exists": True,
+            "size": record.get("size"),
+            "sha256": record.get("sha256"),
+            "content_type": record.get("content_type"),
+            "width": record.get("width"),
+            "height": record.get("height"),
+            "thumbnails": record.get("thumbnails") or {},
+            "uploaded_at": record.get("uploaded_at")
         })
     
     return {
@@ -797,69 +2957,251 @@ async def get_student_documents(student_id: str, current_user: User = Depends(ge
 async def download_student_document(
     student_id: str, 
     document_type: str, 
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    current_user: Principal = Depends(get_current_user)
 ):
-    """Download a specific student document"""
+    """Download a specific student document (supports Range and conditional requests)"""
     if current_user.role not in ["coordinator", "admin"]:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    student_doc = await db.students.find_one({"id": student_id})
-    if not student_doc:
-        raise HTTPException(status_code=404, detail="Student not found")
-    
-    documents = student_doc.get("documents", {})
-    if document_type not in documents:
+    record = await db.student_documents.find_one({"student_id": student_id, "type": document_type}, {"_id": 0})
+    if not record:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    file_path = Path(documents[document_type])
-    if not file_path.exists():
+    uploaded_at = record.get("uploaded_at")
+    return await student_document_response(
+        request,
+        record["path"],
+        original_name=record.get("file_name"),
+        sha256=record.get("sha256"),
+        uploaded_at=uploaded_at.replace(tzinfo=timezone.utc).timestamp() if isinstance(uploaded_at, datetime) else None,
+        # Replacing a document keeps the URL, so clients revalidate (cheap 304s) instead of caching blindly
+        cache_control='private, no-cache'
+    )
+
+@api_router.get("/documents/signed/{token}")
+async def download_signed_document(token: str, request: Request):
+    """Download a student document through a signed link from GET /students/{student_id}/documents
+
+    The link is the authorization: no user or student lookup happens here.
+    """
+    payload = verify_document_url(token)
+    # The link (and so the file behind it) does not change before it expires
+    max_age = max(int(payload["e"] - time.time()), 0)
+    return await student_document_response(
+        request,
+        payload["p"],
+        original_name=payload.get("n"),
+        sha256=payload.get("h"),
+        uploaded_at=payload.get("m"),
+        cache_control=f'private, max-age={max_age}'
+    )
+
+async def stat_stored_document(stored_path: str) -> tuple:
+    """(current path, stat result or None) of a recorded document path"""
+    file_path = Path(stored_path)
+    storage_key = upload_storage_key(file_path)
+    if storage_key is None:
+        return file_path, None
+    stat_result = await document_storage.stat(storage_key)
+    if stat_result is None and document_store.holds(file_path):
+        # Recorded before its object moved to the two-level layout
+        file_path = await document_store.locate(file_path.name)
+        stat_result = await document_storage.stat(upload_storage_key(file_path))
+    return file_path, stat_result
+
+async def student_document_response(
+    request: Request,
+    stored_path: str,
+    original_name: Optional[str],
+    sha256: Optional[str],
+    uploaded_at: Optional[float],
+    cache_control: str
+):
+    """File response for a stored student document, with Range and conditional request support"""
+    file_path, stat_result = await stat_stored_document(stored_path)
+    if stat_result is None:
         raise HTTPException(status_code=404, detail="File not found on disk")
+    storage_key = upload_storage_key(file_path)
+    
+    # Stored objects are named by hash; the original name comes from the upload metadata
+    original_name = original_name or file_path.name
+    suffix = Path(original_name).suffix.lower()
     
     # Determine content type and disposition based on file extension
     content_type = "application/octet-stream"
     disposition = "attachment"  # Default for downloads
     
-    if file_path.suffix.lower() == ".pdf":
+    if suffix == ".pdf":
         content_type = "application/pdf"
         disposition = "attachment"  # PDFs download as files
-    elif file_path.suffix.lower() in [".jpg", ".jpeg"]:
+    elif suffix in [".jpg", ".jpeg"]:
         content_type = "image/jpeg"
         disposition = "inline"  # Images display in browser
-    elif file_path.suffix.lower() == ".png":
+    elif suffix == ".png":
         content_type = "image/png"
         disposition = "inline"  # Images display in browser
     
-    def file_generator():
-        with open(file_path, "rb") as file:
-            yield from file
-    
     # Prepare ASCII-safe filename for Content-Disposition and RFC 5987 UTF-8 version
-    original_name = file_path.name
     # Normalize and strip non-ASCII for the plain filename parameter
     normalized = unicodedata.normalize('NFKD', original_name)
     ascii_name = ''.join(c for c in normalized if ord(c) < 128)
     # Fallback if stripping leads to empty string
     if not ascii_name:
-        ascii_name = f"document{file_path.suffix.lower()}"
+        ascii_name = f"document{suffix}"
     # Remove problematic characters for headers
     ascii_name = ascii_name.replace('\r', '').replace('\n', '').replace('"', '\'')
     # RFC 5987 encoded filename*
     encoded_name = urllib.parse.quote(original_name, safe="")
 
+    # Validators come from the upload metadata (content hash, upload time); older uploads fall back to the file
+    etag = f'"{sha256}"' if sha256 else f'"{int(stat_result.st_mtime)}-{stat_result.st_size}"'
+    last_modified = uploaded_at if uploaded_at is not None else stat_result.st_mtime
+    
     headers = {
         'Content-Disposition': f"{disposition}; filename=\"{ascii_name}\"; filename*=UTF-8''{encoded_name}",
-        'Cache-Control': 'public, max-age=3600',  # Cache images for better performance
+        'ETag': etag,
+        'Last-Modified': formatdate(last_modified, usegmt=True),
+        'Cache-Control': cache_control,
         'Access-Control-Allow-Origin': '*'  # Allow cross-origin requests for images
     }
     
+    if_none_match = request.headers.get("if-none-match")
+    if etag_matches(if_none_match, etag) or (
+        not if_none_match and not_modified_since(request.headers.get("if-modified-since"), last_modified)
+    ):
+        return Response(status_code=304, headers={key: headers[key] for key in ("ETag", "Last-Modified", "Cache-Control")})
+    
+    if DOCUMENT_SERVE_MODE != "app":
+        return offloaded_file_response(file_path, content_type, headers)
+    
+    # PDF viewers fetch pages with Range requests; If-Range falls back to the whole file when it changed
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() in (etag, headers['Last-Modified'])):
+        byte_range = parse_byte_range(range_header, stat_result.st_size)
+    
+    return stored_file_response(document_storage, storage_key, stat_result, byte_range, content_type, headers)
+
+@api_router.get("/students/{student_id}/documents/{document_type}/thumbnail")
+async def get_student_document_thumbnail(
+    student_id: str,
+    document_type: str,
+    request: Request,
+    size: str = "medium",
+    current_user: Principal = Depends(get_current_user)
+):
+    """Downscaled JPEG of an image document (small / medium / optimized) for the document viewer"""
+    if current_user.role not in ["coordinator", "admin"]:
+        raise HTTPException(status_code=403, detail="Access denied")
+    if size not in DOCUMENT_IMAGE_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Size must be one of: {', '.join(DOCUMENT_IMAGE_VARIANTS)}")
+    
+    record = await db.student_documents.find_one(
+        {"student_id": student_id, "type": document_type}, {"_id": 0, "path": 1}
+    )
+    if not record:
+        raise HTTPException(status_code=404, detail="Document not found")
+    file_path = record["path"]
+    if not document_store.holds(file_path):
+        raise HTTPException(status_code=404, detail="No thumbnail available for this document")
+    
+    sha256 = Path(file_path).name
+    etag = f'"{sha256}-{size}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    # Usually built right after upload; older documents are processed on first request
+    if not await ensure_document_derivatives(sha256):
+        raise HTTPException(status_code=404, detail="No thumbnail available for this document")
+    thumbnail_path = await document_store.locate_derivative(sha256, size)
+    if DOCUMENT_SERVE_MODE != "app":
+        return offloaded_file_response(thumbnail_path, "image/jpeg", headers)
+    thumbnail_key = upload_storage_key(thumbnail_path)
+    stat_result = await document_storage.stat(thumbnail_key)
+    if stat_result is None:
+        raise HTTPException(status_code=404, detail="No thumbnail available for this document")
+    return stored_file_response(document_storage, thumbnail_key, stat_result, None, "image/jpeg", headers)
+
+async def stream_document_zip(query: Dict[str, Any]):
+    """Yield a ZIP of the matching students' documents ({token_number}/{document_type}.ext), read from storage in chunks"""
+    sink = ZipStreamBuffer()
+    missing = []
+    
+    async def student_batches():
+        batch = []
+        async for student in db.students.find(query, {"_id": 0, "id": 1, "token_number": 1}).sort("token_number", 1):
+            batch.append(student)
+            if len(batch) == DOCUMENT_EXPORT_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        async for batch in student_batches():
+            # Document records for a batch of students in one query
+            records_by_student = {}
+            async for record in db.student_documents.find(
+                {"student_id": {"$in": [student["id"] for student in batch]}},
+                {"_id": 0, "student_id": 1, "type": 1, "path": 1, "file_name": 1}
+            ).sort("type", 1):
+                records_by_student.setdefault(record["student_id"], []).append(record)
+            
+            for student in batch:
+                folder = str(student.get("token_number") or student["id"]).replace("/", "_")
+                for record in records_by_student.get(student["id"], []):
+                    document_type, stored_path = record["type"], record["path"]
+                    entry_name = f"{folder}/{document_type}{Path(record['file_name']).suffix.lower()}"
+                    file_path, stat_result = await stat_stored_document(stored_path)
+                    if stat_result is None:
+                        missing.append(entry_name)
+                        continue
+                    storage_key = upload_storage_key(file_path)
+                    
+                    # Scans and PDFs are already compressed, so entries are stored as-is
+                    entry_info = zipfile.ZipInfo(entry_name, date_time=time.localtime(stat_result.st_mtime)[:6])
+                    entry_info.file_size = stat_result.st_size  # lets zipfile pick ZIP64 for very large files
+                    with archive.open(entry_info, mode="w") as entry:
+                        async for chunk in document_storage.iter_range(storage_key, 0, stat_result.st_size - 1):
+                            entry.write(chunk)
+                            yield sink.drain()
+                    yield sink.drain()
+        
+        if missing:
+            archive.writestr("missing_documents.txt", "\n".join(missing) + "\n")
+    yield sink.drain()
+
+@api_router.post("/students/documents/export")
+async def export_student_documents(
+    export: DocumentExportRequest,
+    current_user: Principal = Depends(get_current_user)
+):
+    """All documents of a list of students, or of the students matching the list filters, as one streamed ZIP"""
+    if current_user.role not in ["coordinator", "admin"]:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    if export.student_ids:
+        query = {"id": {"$in": export.student_ids}}
+    else:
+        query = build_student_list_query(
+            export.status, export.course, export.agent_id, export.search, export.date_from, export.date_to
+        )
+    query["documents"] = {"$exists": True, "$ne": {}}
+    if not await db.students.find_one(query, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="No documents match the selection")
+    
+    date_str = datetime.now().strftime('%Y%m%d')
     return StreamingResponse(
-        file_generator(), 
-        media_type=content_type,
-        headers=headers
+        stream_document_zip(query),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=documents_{date_str}.zip"}
     )
 
 @api_router.get("/students/filter-options")
-async def get_student_filter_options(current_user: User = Depends(get_current_user)):
+async def get_student_filter_options(current_user: Principal = Depends(get_current_user)):
     """Get available filter options for coordinator dashboard"""
     if current_user.role not in ["coordinator", "admin"]:
         raise HTTPException(status_code=403, detail="Access denied")
@@ -897,7 +3239,7 @@ async def get_student_filter_options(current_user: User = Depends(get_current_us
     }
 
 @api_router.get("/students/{student_id}", response_model=Student)
-async def get_student(student_id: str, current_user: User = Depends(get_current_user)):
+async def get_student(student_id: str, current_user: Principal = Depends(get_current_user)):
     student_doc = await db.students.find_one({"id": student_id})
     if not student_doc:
         raise HTTPException(status_code=404, detail="Student not found")
@@ -917,7 +3259,7 @@ async def update_student_status(
     notes: Optional[str] = Form(None),
     signature_data: Optional[str] = Form(None),
     signature_type: Optional[str] = Form(None),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role not in ["coordinator", "admin"]:
         raise HTTPException(status_code=403, detail="Only coordinators and admins can update status")
@@ -926,7 +3268,9 @@ async def update_student_status(
     if notes:
         update_data["coordinator_notes"] = notes
     if signature_data:
-        update_data["signature_data"] = signature_data
+        # Students reference the shared signature version instead of embedding the image
+        normalized_signature, signature_hash = await normalize_signature(signature_data)
+        update_data["signature_id"] = await store_signature(normalized_signature, signature_hash, current_user.id)
         update_data["signature_type"] = signature_type or "draw"
     
     # Handle coordinator approval - changes status to coordinator_approved (awaiting admin)
@@ -935,9 +3279,13 @@ async def update_student_status(
         update_data["coordinator_approved_at"] = datetime.utcnow()
         update_data["coordinator_approved_by"] = current_user.id
     
+    update_operation = {"$set": update_data}
+    if signature_data:
+        update_operation["$unset"] = {"signature_data": "", "signature_hash": ""}
+    
     result = await db.students.update_one(
         {"id": student_id},
-        {"$set": update_data}
+        update_operation
     )
     
     if result.matched_count == 0:
@@ -950,7 +3298,7 @@ async def update_student_status(
 
 # Incentive routes
 @api_router.get("/incentives")
-async def get_incentives(current_user: User = Depends(get_current_user)):
+async def get_incentives(current_user: Principal = Depends(get_current_user)):
     query = {}
     if current_user.role == "agent":
         query["agent_id"] = current_user.agent_id or current_user.id
@@ -967,7 +3315,7 @@ async def get_incentives(current_user: User = Depends(get_current_user)):
 
 # Admin routes
 @api_router.get("/admin/dashboard")
-async def get_admin_dashboard(current_user: User = Depends(get_current_user)):
+async def get_admin_dashboard(current_user: Principal = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
@@ -1007,7 +3355,7 @@ async def get_admin_dashboard(current_user: User = Depends(get_current_user)):
 async def create_incentive_rule(
     course: str = Form(...),
     amount: float = Form(...),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -1026,7 +3374,7 @@ async def get_incentive_rules():
 async def create_course_rule(
     course: str = Form(...),
     amount: float = Form(...),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -1045,7 +3393,7 @@ async def update_course_rule(
     rule_id: str,
     course: str = Form(...),
     amount: float = Form(...),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -1069,7 +3417,7 @@ async def update_course_rule(
 @api_router.delete("/admin/courses/{rule_id}")
 async def delete_course_rule(
     rule_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -1090,7 +3438,7 @@ async def delete_course_rule(
 async def update_incentive_status(
     incentive_id: str,
     status: str = Form(...),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -1109,7 +3457,7 @@ async def update_incentive_status(
     return {"message": "Incentive status updated successfully"}
 
 @api_router.get("/admin/incentives")
-async def get_all_incentives(current_user: User = Depends(get_current_user)):
+async def get_all_incentives(current_user: Principal = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
@@ -1148,7 +3496,7 @@ async def get_all_incentives(current_user: User = Depends(get_current_user)):
 
 # Pending User Management APIs
 @api_router.get("/admin/pending-users")
-async def get_pending_users(current_user: User = Depends(get_current_user)):
+async def get_pending_users(current_user: Principal = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
@@ -1158,7 +3506,7 @@ async def get_pending_users(current_user: User = Depends(get_current_user)):
 @api_router.post("/admin/pending-users/{user_id}/approve")
 async def approve_pending_user(
     user_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -1182,6 +3530,7 @@ async def approve_pending_user(
     )
     
     await db.users.insert_one(user.dict())
+    principal_cache.invalidate(user.id)
     
     # Update pending user status
     await db.pending_users.update_one(
@@ -1199,7 +3548,7 @@ async def approve_pending_user(
 async def reject_pending_user(
     user_id: str,
     reason: str = Form("No reason provided"),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -1227,44 +3576,53 @@ async def reject_pending_user(
 async def upload_admin_signature(
     signature_data: str = Form(...),
     signature_type: str = Form("upload"),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role not in ["admin", "coordinator"]:
         raise HTTPException(status_code=403, detail="Admin or Coordinator access required")
     
-    # Update user's signature
+    normalized_signature, signature_hash = await normalize_signature(signature_data)
+    signature_fields = await store_user_signature(normalized_signature, signature_hash, current_user.id)
+    
+    # Update user's signature (stored by reference; the image itself lives in the blob store)
     result = await db.users.update_one(
         {"id": current_user.id},
         {"$set": {
-            "signature_data": signature_data,
+            **signature_fields,
             "signature_type": signature_type,
             "signature_updated_at": datetime.utcnow()
-        }}
+        }, "$unset": {"signature_data": ""}}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
+    principal_cache.invalidate(current_user.id)
+    
     return {"message": "Signature updated successfully"}
 
 @api_router.get("/admin/signature")
-async def get_admin_signature(current_user: User = Depends(get_current_user)):
+async def get_admin_signature(current_user: Principal = Depends(get_current_user)):
     if current_user.role not in ["admin", "coordinator"]:
         raise HTTPException(status_code=403, detail="Admin or Coordinator access required")
     
-    user_doc = await db.users.find_one({"id": current_user.id})
-    if not user_doc or not user_doc.get("signature_data"):
+    user_doc = await db.users.find_one(
+        {"id": current_user.id},
+        {"_id": 0, "signature_url": 1, "signature_data": 1, "signature_type": 1, "signature_updated_at": 1}
+    )
+    signature_url = user_doc and (user_doc.get("signature_url") or user_doc.get("signature_data"))
+    if not signature_url:
         raise HTTPException(status_code=404, detail="No signature found")
     
     return {
-        "signature_data": user_doc["signature_data"],
+        "signature_url": signature_url,
         "signature_type": user_doc["signature_type"],
         "updated_at": user_doc.get("signature_updated_at")
     }
 
 # AGENT PROFILE MANAGEMENT APIs
 @api_router.get("/agent/profile")
-async def get_agent_profile(current_user: User = Depends(get_current_user)):
+async def get_agent_profile(current_user: Principal = Depends(get_current_user)):
     """Get agent profile information"""
     if current_user.role != "agent":
         raise HTTPException(status_code=403, detail="Agent access required")
@@ -1378,7 +3736,7 @@ async def get_agent_profile(current_user: User = Depends(get_current_user)):
 @api_router.put("/agent/profile")
 async def update_agent_profile(
     profile_data: AgentProfileUpdate,
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     """Update agent profile information"""
     if current_user.role != "agent":
@@ -1387,7 +3745,15 @@ async def update_agent_profile(
     # Prepare update data (only include non-None values)
     update_data = {}
     if profile_data.profile_photo is not None:
-        update_data["profile_photo"] = profile_data.profile_photo
+        if profile_data.profile_photo.startswith("data:"):
+            # Inline images go to the blob store; the user document keeps only the URL
+            try:
+                photo_bytes = decode_image_data_url(profile_data.profile_photo, PROFILE_PHOTO_MAX_BYTES)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid profile photo: {e}")
+            update_data["profile_photo"] = await store_profile_photo(photo_bytes)
+        else:
+            update_data["profile_photo"] = profile_data.profile_photo
     if profile_data.phone is not None:
         update_data["phone"] = profile_data.phone
     if profile_data.address is not None:
@@ -1415,31 +3781,66 @@ async def update_agent_profile(
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
+    principal_cache.invalidate(current_user.id)
+    
     return {"message": "Profile updated successfully"}
 
 @api_router.post("/agent/profile/photo")
 async def upload_profile_photo(
-    photo_data: str = Form(...),
-    current_user: User = Depends(get_current_user)
+    photo: Optional[UploadFile] = File(None),
+    photo_data: Optional[str] = Form(None),
+    current_user: Principal = Depends(get_current_user)
 ):
-    """Upload agent profile photo"""
+    """Upload agent profile photo (multipart file, or a base64 data URL for older clients)"""
     if current_user.role != "agent":
         raise HTTPException(status_code=403, detail="Agent access required")
     
+    if photo is not None:
+        photo_bytes = await photo.read(PROFILE_PHOTO_MAX_BYTES + 1)
+    elif photo_data:
+        try:
+            photo_bytes = decode_image_data_url(photo_data, PROFILE_PHOTO_MAX_BYTES)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid profile photo: {e}")
+    else:
+        raise HTTPException(status_code=400, detail="No photo provided")
+    
+    photo_url = await store_profile_photo(photo_bytes)
+    
     # Update user's profile photo
     result = await db.users.update_one(
         {"id": current_user.id},
-        {"$set": {"profile_photo": photo_data}}
+        {"$set": {"profile_photo": photo_url}}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return {"message": "Profile photo updated successfully"}
+    principal_cache.invalidate(current_user.id)
+    
+    return {"message": "Profile photo updated successfully", "profile_photo": photo_url}
+
+@api_router.get("/blobs/{blob_name}")
+async def get_blob(blob_name: str, request: Request):
+    """Serve a content-addressed blob; the name is its hash, so responses are cacheable forever"""
+    digest, _, extension = blob_name.partition(".")
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest) or extension not in BLOB_MEDIA_TYPES:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    blob_key = blob_store.key_for(blob_name)
+    stat_result = await blob_storage.stat(blob_key)
+    if stat_result is None:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    return stored_file_response(blob_storage, blob_key, stat_result, None, BLOB_MEDIA_TYPES[extension], headers)
 
 # BADGE MANAGEMENT APIs (for coordinators)
 @api_router.get("/coordinator/agents")
-async def get_agents_for_badge_management(current_user: User = Depends(get_current_user)):
+async def get_agents_for_badge_management(current_user: Principal = Depends(get_current_user)):
     """Get list of agents for badge management by coordinators"""
     if current_user.role not in ["coordinator", "admin"]:
         raise HTTPException(status_code=403, detail="Coordinator or Admin access required")
@@ -1476,7 +3877,7 @@ async def assign_badge_to_agent(
     badge_title: str = Form(...),
     badge_description: str = Form(...),
     badge_color: str = Form("blue"),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     """Assign a badge to an agent (coordinator only)"""
     if current_user.role not in ["coordinator", "admin"]:
@@ -1513,13 +3914,15 @@ async def assign_badge_to_agent(
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Failed to update agent")
     
+    principal_cache.invalidate(agent_id)
+    
     return {"message": f"Badge '{badge_title}' assigned successfully to agent", "badge": new_badge}
 
 @api_router.delete("/coordinator/agents/{agent_id}/badges/{badge_id}")
 async def remove_badge_from_agent(
     agent_id: str,
     badge_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     """Remove a badge from an agent (coordinator only)"""
     if current_user.role not in ["coordinator", "admin"]:
@@ -1546,10 +3949,12 @@ async def remove_badge_from_agent(
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Failed to update agent")
     
+    principal_cache.invalidate(agent_id)
+    
     return {"message": "Badge removed successfully"}
 
 @api_router.get("/badge-templates")
-async def get_badge_templates(current_user: User = Depends(get_current_user)):
+async def get_badge_templates(current_user: Principal = Depends(get_current_user)):
     """Get predefined badge templates for coordinators"""
     if current_user.role not in ["coordinator", "admin"]:
         raise HTTPException(status_code=403, detail="Coordinator or Admin access required")
@@ -1571,7 +3976,7 @@ async def get_badge_templates(current_user: User = Depends(get_current_user)):
 
 # Admin Final Approval Process
 @api_router.get("/admin/pending-approvals")
-async def get_pending_admin_approvals(current_user: User = Depends(get_current_user)):
+async def get_pending_admin_approvals(current_user: Principal = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
@@ -1609,7 +4014,7 @@ async def get_pending_admin_approvals(current_user: User = Depends(get_current_u
 async def admin_approve_student(
     student_id: str,
     notes: Optional[str] = Form(None),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -1637,6 +4042,8 @@ async def admin_approve_student(
         {"id": student_id},
         {"$set": update_data}
     )
+    # Re-read so receipt inputs match what later downloads will see
+    student_doc = await db.students.find_one({"id": student_id})
     
     # Create incentive for the agent
     incentive_rule = await db.incentive_rules.find_one({"course": student_doc["course"], "active": True})
@@ -1649,13 +4056,25 @@ async def admin_approve_student(
         )
         await db.incentives.insert_one(incentive.dict())
     
+    # Issue the receipt number and archive both receipt variants once, at approval time
+    try:
+        agent_doc = await db.users.find_one({"$or": [
+            {"agent_id": student_doc["agent_id"]}, 
+            {"id": student_doc["agent_id"]}
+        ]})
+        await generate_unified_receipt_pdf(student_doc, current_user, agent_doc, is_admin_generated=False)
+        await generate_unified_receipt_pdf(student_doc, current_user, agent_doc, is_admin_generated=True)
+    except Exception as e:
+        # Receipts are re-rendered on first download if archiving fails here
+        logger.error(f"Receipt archiving failed for student {student_id}: {e}")
+    
     return {"message": "Student approved by admin successfully"}
 
 @api_router.put("/admin/reject-student/{student_id}")
 async def admin_reject_student(
     student_id: str,
     notes: str = Form(...),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -1682,7 +4101,7 @@ async def admin_reject_student(
 
 # Backup Management APIs
 @api_router.post("/admin/backup")
-async def create_backup(current_user: User = Depends(get_current_user)):
+async def create_backup(current_user: Principal = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
@@ -1719,7 +4138,7 @@ async def create_backup(current_user: User = Depends(get_current_user)):
         return {"message": "Backup system available but needs configuration", "success": True}
 
 @api_router.get("/admin/backups")
-async def list_backups(current_user: User = Depends(get_current_user)):
+async def list_backups(current_user: Principal = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
@@ -1762,7 +4181,7 @@ async def export_excel(
     agent_id: Optional[str] = None,
     course: Optional[str] = None,
     status: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -1868,7 +4287,8 @@ async def export_excel(
 @api_router.get("/students/{student_id}/receipt")
 async def generate_student_receipt(
     student_id: str,
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    current_user: Principal = Depends(get_current_user)
 ):
     student_doc = await db.students.find_one({"id": student_id})
     if not student_doc:
@@ -1882,23 +4302,24 @@ async def generate_student_receipt(
     if student_doc["status"] != "approved":
         raise HTTPException(status_code=400, detail="Receipts can only be generated for approved students")
     
-    # Get agent details
-    agent_doc = await db.users.find_one({"id": student_doc["agent_id"]})
-    
-    # Generate unified PDF receipt
-    buffer = await generate_unified_receipt_pdf(student_doc, current_user, agent_doc, is_admin_generated=False)
+    # Get agent details (same lookup as approval and the admin receipt, so the archived render matches)
+    agent_doc = await db.users.find_one({"$or": [
+        {"agent_id": student_doc["agent_id"]}, 
+        {"id": student_doc["agent_id"]}
+    ]})
     
-    from fastapi.responses import StreamingResponse
-    return StreamingResponse(
-        BytesIO(buffer.getvalue()),
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=receipt_{student_doc['token_number']}.pdf"}
+    # Serve the unified PDF receipt from the render cache (304 when unchanged)
+    return await unified_receipt_response(
+        request, student_doc, current_user, agent_doc,
+        is_admin_generated=False,
+        filename=f"receipt_{student_doc['token_number']}.pdf"
     )
 
 @api_router.get("/admin/students/{student_id}/receipt")
 async def generate_admin_student_receipt(
     student_id: str,
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    current_user: Principal = Depends(get_current_user)
 ):
     """Admin can generate receipt for any approved student"""
     if current_user.role != "admin":
@@ -1918,19 +4339,129 @@ async def generate_admin_student_receipt(
         {"id": student_doc["agent_id"]}
     ]})
     
-    # Generate unified PDF receipt
-    buffer = await generate_unified_receipt_pdf(student_doc, current_user, agent_doc, is_admin_generated=True)
+    # Serve the unified PDF receipt from the render cache (304 when unchanged)
+    return await unified_receipt_response(
+        request, student_doc, current_user, agent_doc,
+        is_admin_generated=True,
+        filename=f"admin_receipt_{student_doc['token_number']}.pdf"
+    )
+
+async def stream_receipt_zip(render_args_list):
+    """Yield a ZIP of receipt PDFs, adding each receipt as soon as its render finishes"""
+    sink = ZipStreamBuffer()
+    render_slots = asyncio.Semaphore(max(1, RECEIPT_RENDER_WORKERS) * 2)
+    
+    async def render_one(render_args):
+        async with render_slots:
+            render_key = receipt_render_key(render_args)
+            return render_args, await load_unified_receipt_pdf(render_key, render_args)
+    
+    tasks = [asyncio.create_task(render_one(render_args)) for render_args in render_args_list]
+    try:
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+            for finished in asyncio.as_completed(tasks):
+                render_args, pdf_bytes = await finished
+                archive.writestr(f"receipt_{render_args['student_doc']['token_number']}.pdf", pdf_bytes)
+                yield sink.drain()
+        yield sink.drain()
+    finally:
+        # Client went away mid-stream - stop queued renders
+        for task in tasks:
+            task.cancel()
+
+@api_router.post("/admin/receipts/batch")
+async def generate_receipt_batch(
+    batch: ReceiptBatchRequest,
+    current_user: Principal = Depends(get_current_user)
+):
+    """Admin batch receipts for a list of students or a filter, as a ZIP or one merged PDF"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    if batch.format not in ["zip", "pdf"]:
+        raise HTTPException(status_code=400, detail="Format must be 'zip' or 'pdf'")
+    
+    # Receipts exist only for approved students
+    query = {"status": "approved"}
+    if batch.student_ids:
+        query["id"] = {"$in": batch.student_ids}
+    else:
+        if batch.course and batch.course != "all":
+            query["course"] = batch.course
+        if batch.agent_id and batch.agent_id != "all":
+            query["agent_id"] = batch.agent_id
+        date_query = {}
+        try:
+            if batch.date_from:
+                date_query["$gte"] = datetime.fromisoformat(batch.date_from.replace('Z', '+00:00'))
+            if batch.date_to:
+                date_query["$lte"] = datetime.fromisoformat(batch.date_to.replace('Z', '+00:00'))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use ISO format (YYYY-MM-DD)")
+        if date_query:
+            query["updated_at"] = date_query
+    
+    # Counted first so an oversized selection fails loudly instead of yielding a partial batch
+    student_count = await db.students.count_documents(query, limit=RECEIPT_BATCH_MAX + 1)
+    if student_count == 0:
+        raise HTTPException(status_code=404, detail="No approved students match the selection")
+    if student_count > RECEIPT_BATCH_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Selection exceeds {RECEIPT_BATCH_MAX} students; narrow the filters or split the date range"
+        )
+    students = await db.students.find(query).sort("token_number", 1).to_list(length=None)
+    
+    # One rule snapshot and one admin signature for the whole batch
+    receipt_context = await load_receipt_context(
+        current_user,
+        courses={student["course"] for student in students},
+        signature_ids=[student.get("signature_id") for student in students]
+    )
+    
+    # Agents in a single query, matched the same way as the single receipt endpoints
+    agent_keys = list({student["agent_id"] for student in students})
+    agent_docs = await db.users.find(
+        {"$or": [{"agent_id": {"$in": agent_keys}}, {"id": {"$in": agent_keys}}]},
+        {"_id": 0, "id": 1, "agent_id": 1, "username": 1}
+    ).to_list(length=None)
+    agents = {}
+    for agent_doc in agent_docs:
+        agents.setdefault(agent_doc["id"], agent_doc)
+        if agent_doc.get("agent_id"):
+            agents.setdefault(agent_doc["agent_id"], agent_doc)
+    
+    existing_receipts = await db.receipts.find(
+        {"student_id": {"$in": [student["id"] for student in students]}}
+    ).to_list(length=None)
+    receipts = {receipt["student_id"]: receipt for receipt in existing_receipts}
+    
+    render_args_list = []
+    for student in students:
+        receipt_doc = receipts.get(student["id"]) or await get_or_create_receipt(student, current_user)
+        render_args_list.append(collect_receipt_render_args(
+            student, current_user, agents.get(student["agent_id"]),
+            True, receipt_doc, receipt_context
+        ))
+    
+    date_str = datetime.now().strftime('%Y%m%d')
+    if batch.format == "pdf":
+        pdf_bytes = await run_receipt_render(render_unified_receipt_batch_pdf, render_args_list)
+        return Response(
+            content=pdf_bytes,
+            media_type="application/pdf",
+            headers={"Content-Disposition": f"attachment; filename=receipts_{date_str}.pdf"}
+        )
     
-    from fastapi.responses import StreamingResponse
     return StreamingResponse(
-        BytesIO(buffer.getvalue()),
-        media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=admin_receipt_{student_doc['token_number']}.pdf"}
+        stream_receipt_zip(render_args_list),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=receipts_{date_str}.zip"}
     )
 
 # LEADERBOARD SYSTEM APIs
 @api_router.get("/leaderboard/overall")
-async def get_overall_leaderboard(current_user: User = Depends(get_current_user)):
+async def get_overall_leaderboard(current_user: Principal = Depends(get_current_user)):
     """Get overall agent leaderboard with all-time performance"""
     
     # Get all agents
@@ -1984,7 +4515,7 @@ async def get_overall_leaderboard(current_user: User = Depends(get_current_user)
     }
 
 @api_router.get("/leaderboard/weekly")
-async def get_weekly_leaderboard(current_user: User = Depends(get_current_user)):
+async def get_weekly_leaderboard(current_user: Principal = Depends(get_current_user)):
     """Get weekly agent leaderboard (Monday to Sunday)"""
     
     # Calculate current week start (Monday) and end (Sunday)
@@ -1996,7 +4527,7 @@ async def get_weekly_leaderboard(current_user: User = Depends(get_current_user))
     return await get_date_range_leaderboard(week_start, week_end, "weekly")
 
 @api_router.get("/leaderboard/monthly")
-async def get_monthly_leaderboard(current_user: User = Depends(get_current_user)):
+async def get_monthly_leaderboard(current_user: Principal = Depends(get_current_user)):
     """Get monthly agent leaderboard (1st to last day of current month)"""
     
     # Calculate current month start and end
@@ -2017,7 +4548,7 @@ async def get_monthly_leaderboard(current_user: User = Depends(get_current_user)
 async def get_custom_leaderboard(
     start_date: str,
     end_date: str,
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_user)
 ):
     """Get custom date range leaderboard"""
     
@@ -2122,7 +4653,7 @@ async def get_date_range_leaderboard(start_date: datetime, end_date: datetime, l
 
 # Enhanced Admin Dashboard with Fixed Admission Overview
 @api_router.get("/admin/dashboard-enhanced") 
-async def get_enhanced_admin_dashboard(current_user: User = Depends(get_current_user)):
+async def get_enhanced_admin_dashboard(current_user: Principal = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
@@ -2184,7 +4715,7 @@ async def get_enhanced_admin_dashboard(current_user: User = Depends(get_current_
 
 # User Management APIs - NEW
 @api_router.get("/admin/users")
-async def get_all_users(current_user: User = Depends(get_current_user)):
+async def get_all_users(current_user: Principal = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
@@ -2212,9 +4743,23 @@ async def get_all_users(current_user: User = Depends(get_current_user)):
     
     return users_data
 
+@api_router.post("/admin/users/{user_id}/revoke-tokens")
+async def revoke_user_tokens(user_id: str, current_user: Principal = Depends(get_current_user)):
+    """Invalidate all tokens previously issued to a user (role change or deactivation)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    user_doc = await db.users.find_one({"id": user_id}, {"_id": 0, "id": 1})
+    if not user_doc:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    await token_versions.bump([user_id])
+    
+    return {"message": "User tokens revoked successfully"}
+
 # CRITICAL: Fix Incentive Generation Workflow
 @api_router.post("/admin/fix-incentives")
-async def fix_missing_incentives(current_user: User = Depends(get_current_user)):
+async def fix_missing_incentives(current_user: Principal = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
@@ -2275,8 +4820,163 @@ async def fix_missing_incentives(current_user: User = Depends(get_current_user))
         "new_incentives": fixed_count
     }
 
+@api_router.post("/admin/migrate-signatures")
+async def migrate_signatures(current_user: Principal = Depends(get_current_user)):
+    """Deduplicate signatures embedded in student records into the signatures collection"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    summary = await migrate_embedded_signatures()
+    return {
+        "message": f"Migrated {summary['migrated_students']} student signatures into {summary['signature_versions']} signature versions",
+        **summary
+    }
+
+@api_router.post("/admin/migrate-documents")
+async def migrate_documents(current_user: Principal = Depends(get_current_user)):
+    """Move legacy per-student uploads into the deduplicated document store"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    summary = await migrate_documents_to_store()
+    return {
+        "message": f"Migrated {summary['migrated_documents']} documents into the document store",
+        **summary
+    }
+
+@api_router.post("/admin/migrate-document-layout")
+async def migrate_document_layout_batch(
+    batch_size: int = 500,
+    restart: bool = False,
+    current_user: Principal = Depends(get_current_user)
+):
+    """Move the next batch of stored documents to the two-level objects/ab/cd/ layout (call until done)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if STORAGE_BACKEND != "local":
+        raise HTTPException(status_code=400, detail="Run the layout migration before switching to STORAGE_BACKEND=s3")
+    if batch_size < 1 or batch_size > 5000:
+        raise HTTPException(status_code=400, detail="batch_size must be between 1 and 5000")
+    
+    summary = await migrate_document_layout(batch_size, restart)
+    return {
+        "message": f"Moved {summary['moved_objects']} documents, {summary['remaining_objects']} left to check",
+        **summary
+    }
+
+@api_router.get("/admin/uploads/orphans")
+async def get_orphaned_uploads(current_user: Principal = Depends(get_current_user)):
+    """Report unreferenced files under the upload directory and the bytes they hold, per student"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if STORAGE_BACKEND != "local":
+        raise HTTPException(status_code=400, detail="Orphaned upload sweeping needs STORAGE_BACKEND=local")
+    
+    cutoff = time.time() - ORPHAN_GRACE_SECONDS
+    owners = {}
+    for file_path, size, mtime in await find_orphaned_uploads():
+        owner = owners.setdefault(upload_path_owner(file_path), {"files": 0, "bytes": 0, "reclaimable_bytes": 0})
+        owner["files"] += 1
+        owner["bytes"] += size
+        if mtime < cutoff:
+            owner["reclaimable_bytes"] += size
+    
+    # Legacy folders are named after the student; flag the ones whose student is gone
+    existing_students = {
+        student_doc["id"] async for student_doc in db.students.find({"id": {"$in": list(owners)}}, {"_id": 0, "id": 1})
+    }
+    store_folders = {DOCUMENT_STORE_DIR.name, DOCUMENT_DERIVATIVES_DIR.name}
+    by_owner = [
+        {
+            "owner": owner_name,
+            "student_exists": (owner_name in existing_students) if owner_name and owner_name not in store_folders else None,
+            **totals
+        }
+        for owner_name, totals in sorted(owners.items(), key=lambda item: -item[1]["bytes"])
+    ]
+    quarantine_files = await asyncio.to_thread(
+        lambda: [path.stat().st_size for path in ORPHAN_QUARANTINE_DIR.rglob("*") if path.is_file()]
+        if ORPHAN_QUARANTINE_DIR.exists() else []
+    )
+    return {
+        "orphaned_files": sum(totals["files"] for totals in owners.values()),
+        "orphaned_bytes": sum(totals["bytes"] for totals in owners.values()),
+        "reclaimable_bytes": sum(totals["reclaimable_bytes"] for totals in owners.values()),
+        "grace_seconds": ORPHAN_GRACE_SECONDS,
+        "by_owner": by_owner,
+        "quarantine": {"files": len(quarantine_files), "bytes": sum(quarantine_files)}
+    }
+
+@api_router.post("/admin/uploads/orphans/quarantine")
+async def quarantine_orphaned_uploads_now(current_user: Principal = Depends(get_current_user)):
+    """Run the orphaned upload sweep immediately"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if STORAGE_BACKEND != "local":
+        raise HTTPException(status_code=400, detail="Orphaned upload sweeping needs STORAGE_BACKEND=local")
+    
+    summary = await quarantine_orphaned_uploads()
+    return {
+        "message": f"Quarantined {summary['quarantined_files']} orphaned files",
+        **summary
+    }
+
+@api_router.get("/admin/documents/completeness")
+async def get_document_completeness(
+    required: Optional[str] = None,
+    status: Optional[str] = None,
+    course: Optional[str] = None,
+    agent_id: Optional[str] = None,
+    search: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = 100,
+    current_user: Principal = Depends(get_current_user)
+):
+    """Which students are missing required documents (same filters as /students/paginated)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    required_types = [
+        document_type.strip() for document_type in required.split(",") if document_type.strip()
+    ] if required else REQUIRED_DOCUMENT_TYPES
+    query = build_student_list_query(status, course, agent_id, search, date_from, date_to)
+    students = await db.students.find(
+        query, {"_id": 0, "id": 1, "token_number": 1, "first_name": 1, "last_name": 1}
+    ).sort("token_number", 1).to_list(length=None)
+    
+    # Served by the (type, student_id) index; unfiltered reports skip the student id list
+    record_query = {"type": {"$in": required_types}}
+    if query:
+        record_query["student_id"] = {"$in": [student["id"] for student in students]}
+    present = {}
+    by_type = {document_type: 0 for document_type in required_types}
+    async for record in db.student_documents.find(record_query, {"_id": 0, "student_id": 1, "type": 1}):
+        present.setdefault(record["student_id"], set()).add(record["type"])
+        by_type[record["type"]] += 1
+    
+    incomplete_students = []
+    for student in students:
+        missing = [document_type for document_type in required_types if document_type not in present.get(student["id"], ())]
+        if missing:
+            incomplete_students.append({
+                "id": student["id"],
+                "token_number": student.get("token_number"),
+                "name": f"{student.get('first_name', '')} {student.get('last_name', '')}".strip(),
+                "missing": missing
+            })
+    
+    return {
+        "required_types": required_types,
+        "total_students": len(students),
+        "complete": len(students) - len(incomplete_students),
+        "incomplete": len(incomplete_students),
+        "by_type": by_type,
+        "incomplete_students": incomplete_students[:max(limit, 0)]
+    }
+
 @api_router.get("/agents")
-async def get_all_agents(current_user: User = Depends(get_current_user)):
+async def get_all_agents(current_user: Principal = Depends(get_current_user)):
     if current_user.role not in ["admin", "coordinator"]:
         raise HTTPException(status_code=403, detail="Admin or Coordinator access required")
     
@@ -2303,7 +5003,7 @@ async def get_all_agents(current_user: User = Depends(get_current_user)):
     return agents_data
 
 @api_router.get("/coordinators") 
-async def get_all_coordinators(current_user: User = Depends(get_current_user)):
+async def get_all_coordinators(current_user: Principal = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
@@ -2330,7 +5030,7 @@ async def get_all_coordinators(current_user: User = Depends(get_current_user)):
     return coordinators_data
 
 @api_router.get("/admins")
-async def get_all_admins(current_user: User = Depends(get_current_user)):
+async def get_all_admins(current_user: Principal = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
     
@@ -2358,7 +5058,7 @@ async def get_all_admins(current_user: User = Depends(get_current_user)):
 
 # Database Cleanup and Production Setup API
 @api_router.post("/admin/cleanup-database")
-async def cleanup_database(current_user: User = Depends(get_current_user)):
+async def cleanup_database(current_user: Principal = Depends(get_current_user)):
     """Clean all test data from database for production deployment"""
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -2367,21 +5067,24 @@ async def cleanup_database(current_user: User = Depends(get_current_user)):
         # Clear all collections
         collections_to_clear = [
             "users", "pending_users", "students", "incentives", 
-            "incentive_rules", "leaderboard_cache"
+            "incentive_rules", "leaderboard_cache", "receipts", "signatures",
+            "document_objects", "upload_sessions", "student_documents"
         ]
         
+        # Revoke outstanding stateless tokens before the users disappear
+        await token_versions.bump(await db.users.distinct("id"))
+        
         results = {}
         for collection_name in collections_to_clear:
             collection = getattr(db, collection_name)
             result = await collection.delete_many({})
             results[collection_name] = result.deleted_count
+        principal_cache.clear()
         
-        # Clear upload directory
-        import shutil
-        upload_dir = Path("uploads")
-        if upload_dir.exists():
-            shutil.rmtree(upload_dir)
-            upload_dir.mkdir(exist_ok=True)
+        # Clear uploaded documents
+        await document_storage.clear()
+        await clear_receipt_archive()
+        await blob_store.clear()
         
         return {
             "message": "Database successfully cleaned for production",
@@ -2392,7 +5095,7 @@ async def cleanup_database(current_user: User = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=f"Cleanup failed: {str(e)}")
 
 @api_router.post("/admin/setup-production-data")
-async def setup_production_data(current_user: User = Depends(get_current_user)):
+async def setup_production_data(current_user: Principal = Depends(get_current_user)):
     """Setup production-ready users and courses"""
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -2455,10 +5158,11 @@ async def setup_production_data(current_user: User = Depends(get_current_user)):
                 agent_id=user_data.get("agent_id"),
                 first_name=user_data["first_name"],
                 last_name=user_data["last_name"],
-                hashed_password=get_password_hash(user_data["password"]),
+                hashed_password=await get_password_hash_async(user_data["password"]),
                 joining_date=datetime.utcnow() if user_data["role"] == "agent" else None
             )
             await db.users.insert_one(user.dict())
+            principal_cache.invalidate(user.id)
             created_users.append(f"{user_data['role']}: {user_data['username']}")
         
         # Production courses data
@@ -2488,7 +5192,7 @@ async def setup_production_data(current_user: User = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=f"Production setup failed: {str(e)}")
 
 @api_router.post("/admin/deploy-production")
-async def deploy_production(current_user: User = Depends(get_current_user)):
+async def deploy_production(current_user: Principal = Depends(get_current_user)):
     """Complete production deployment: cleanup all test data and setup production users/courses in one operation"""
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -2497,21 +5201,24 @@ async def deploy_production(current_user: User = Depends(get_current_user)):
         # STEP 1: Clear all collections
         collections_to_clear = [
             "users", "pending_users", "students", "incentives", 
-            "incentive_rules", "leaderboard_cache"
+            "incentive_rules", "leaderboard_cache", "receipts", "signatures",
+            "document_objects", "upload_sessions", "student_documents"
         ]
         
+        # Revoke outstanding stateless tokens before the users disappear
+        await token_versions.bump(await db.users.distinct("id"))
+        
         cleanup_results = {}
         for collection_name in collections_to_clear:
             collection = getattr(db, collection_name)
             result = await collection.delete_many({})
             cleanup_results[collection_name] = result.deleted_count
+        principal_cache.clear()
         
-        # Clear upload directory
-        import shutil
-        upload_dir = Path("uploads")
-        if upload_dir.exists():
-            shutil.rmtree(upload_dir)
-            upload_dir.mkdir(exist_ok=True)
+        # Clear uploaded documents
+        await document_storage.clear()
+        await clear_receipt_archive()
+        await blob_store.clear()
         
         # STEP 2: Create production users
         production_users = [
@@ -2569,10 +5276,11 @@ async def deploy_production(current_user: User = Depends(get_current_user)):
                 agent_id=user_data.get("agent_id"),
                 first_name=user_data["first_name"],
                 last_name=user_data["last_name"],
-                hashed_password=get_password_hash(user_data["password"]),
+                hashed_password=await get_password_hash_async(user_data["password"]),
                 joining_date=datetime.utcnow() if user_data["role"] == "agent" else None
             )
             await db.users.insert_one(user.dict())
+            principal_cache.invalidate(user.id)
             created_users.append(f"{user_data['role']}: {user_data['username']}")
         
         # STEP 3: Create production courses
@@ -2613,7 +5321,7 @@ async def deploy_production(current_user: User = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=f"Production deployment failed: {str(e)}")
 
 @api_router.post("/admin/clear-student-data")
-async def clear_student_data(current_user: User = Depends(get_current_user)):
+async def clear_student_data(current_user: Principal = Depends(get_current_user)):
     """Clear all student data for fresh dashboard while preserving courses and users"""
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -2623,7 +5331,11 @@ async def clear_student_data(current_user: User = Depends(get_current_user)):
         student_collections_to_clear = [
             "students",           # All student records
             "incentives",         # Agent incentives related to students
-            "leaderboard_cache"   # Cached leaderboard data based on student admissions
+            "leaderboard_cache",  # Cached leaderboard data based on student admissions
+            "receipts",           # Issued receipt numbers and archive paths
+            "document_objects",   # Reference counts of stored documents (files cleared below)
+            "upload_sessions",    # In-progress resumable uploads
+            "student_documents"   # Per-document metadata
         ]
         
         cleared_data = {}
@@ -2633,14 +5345,8 @@ async def clear_student_data(current_user: User = Depends(get_current_user)):
             cleared_data[collection_name] = result.deleted_count
         
         # Clear student-related upload files (receipts, documents, signatures)
-        upload_dir = Path("uploads")
-        if upload_dir.exists():
-            # Keep the upload directory but clear its contents
-            for file_path in upload_dir.iterdir():
-                if file_path.is_file():
-                    file_path.unlink()
-                elif file_path.is_dir():
-                    shutil.rmtree(file_path)
+        await document_storage.clear()
+        await clear_receipt_archive()
         
         return {
             "message": "Student data successfully cleared for fresh launch",
@@ -2674,6 +5380,71 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    await db.token_versions.create_index("user_id", unique=True)
+    try:
+        await db.students.create_index("token_number", unique=True)
+    except Exception as e:
+        logger.warning(f"Could not create unique token_number index (duplicate tokens?): {e}")
+    # Keyset pagination of the coordinator list: every combination of equality filters, then the sort keys
+    for filter_count in range(len(STUDENT_LIST_FILTER_FIELDS) + 1):
+        for filter_fields in itertools.combinations(STUDENT_LIST_FILTER_FIELDS, filter_count):
+            await db.students.create_index([(field, 1) for field in filter_fields] + [("created_at", -1), ("id", -1)])
+    await db.receipts.create_index("student_id", unique=True)
+    await db.receipts.create_index("receipt_number", unique=True)
+    await db.signatures.create_index("hash", unique=True)
+    await db.signatures.create_index("id", unique=True)
+    await db.document_objects.create_index("sha256", unique=True)
+    await db.upload_sessions.create_index("id", unique=True)
+    await db.upload_sessions.create_index("updated_at")
+    await db.student_documents.create_index([("student_id", 1), ("type", 1)], unique=True)
+    await db.student_documents.create_index([("type", 1), ("student_id", 1)])
+    await db.student_documents.create_index("sha256")
+    await db.student_documents.create_index("path")
+
+@app.on_event("startup")
+async def move_inline_user_blobs():
+    # Idempotent: only users still holding base64 photos/signatures are touched
+    migrated = await migrate_user_blobs()
+    if migrated:
+        logger.info(f"Moved inline images of {migrated} users to the blob store")
+
+@app.on_event("startup")
+async def create_student_document_records():
+    # Runs until one pass has completed (an interrupted first start is finished on the next one, even though
+    # student_documents is no longer empty); later gaps are filled by POST /api/admin/migrate-documents
+    if await db.migrations.find_one({"_id": "student_document_records", "done": True}, {"_id": 1}):
+        return
+    created = await migrate_student_document_records()
+    if created:
+        logger.info(f"Created {created} student document records")
+    await db.migrations.update_one(
+        {"_id": "student_document_records"},
+        {"$set": {"done": True, "updated_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+@app.on_event("startup")
+async def start_token_version_refresh():
+    if JWT_STATELESS_CLAIMS:
+        await token_versions.refresh()
+        app.state.token_version_task = asyncio.create_task(token_versions.run_refresh_loop())
+
+@app.on_event("startup")
+async def start_upload_session_sweeper():
+    app.state.upload_session_sweeper = asyncio.create_task(run_upload_session_sweeper())
+
+@app.on_event("startup")
+async def start_orphaned_upload_sweeper():
+    if ORPHAN_SWEEP_SECONDS > 0 and STORAGE_BACKEND == "local":
+        app.state.orphaned_upload_sweeper = asyncio.create_task(run_orphaned_upload_sweeper())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+    password_hash_executor.shutdown(wait=False)
+    if receipt_render_executor is not None:
+        receipt_render_executor.shutdown(wait=False)
+    if image_processing_executor is not None:
+        image_processing_executor.shutdown(wait=False)
\ No newline at end of file
@@ -22,6 +22,9 @@ import SignatureCanvas from 'react-signature-canvas';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Blob URLs from the backend are host-relative (/api/blobs/...); external and data URLs pass through
+const assetUrl = (url) => (url && url.startsWith('/api/') ? `${BACKEND_URL}${url}` : url);
+
 // Auth Context (REMOVED THEME CONTEXT)
 const AuthContext = React.createContext();
 
@@ -759,20 +762,16 @@ const AgentDashboard = () => {
   };
 
   const uploadProfilePhoto = async (file) => {
-    const reader = new FileReader();
-    reader.onload = async (e) => {
-      try {
-        const formData = new FormData();
-        formData.append('photo_data', e.target.result);
-        await axios.post(`${API}/agent/profile/photo`, formData);
-        fetchProfile(); // Refresh profile data
-        alert('Profile photo updated successfully!');
-      } catch (error) {
-        console.error('Error uploading photo:', error);
-        alert('Error uploading photo');
-      }
-    };
-    reader.readAsDataURL(file);
+    try {
+      const formData = new FormData();
+      formData.append('photo', file);
+      await axios.post(`${API}/agent/profile/photo`, formData);
+      fetchProfile(); // Refresh profile data
+      alert('Profile photo updated successfully!');
+    } catch (error) {
+      console.error('Error uploading photo:', error);
+      alert('Error uploading photo');
+    }
   };
 
   const getStatusBadge = (status) => {
@@ -1088,7 +1087,7 @@ const AgentDashboard = () => {
                   <div className="w-24 h-24 rounded-full bg-gray-200 flex items-center justify-center overflow-hidden">
                     {profileData.profile.profile_photo ? (
                       <img 
-                        src={profileData.profile.profile_photo} 
+                        src={assetUrl(profileData.profile.profile_photo)} 
                         alt="Profile" 
                         className="w-full h-full object-cover"
                       />
@@ -1521,6 +1520,7 @@ const CoordinatorDashboard = () => {
   const [totalPages, setTotalPages] = useState(1);
   const [totalCount, setTotalCount] = useState(0);
   const [pageLimit] = useState(20);
+  const pageCursors = useRef({}); // page number -> keyset cursor returned with the page before it
 
   // Filter state
   const [filters, setFilters] = useState({
@@ -1573,6 +1573,38 @@ const CoordinatorDashboard = () => {
     }
   };
 
+  const exportDocuments = async () => {
+    try {
+      // Same filters as the student list; the server streams the ZIP while reading files
+      const body = {};
+      Object.entries(filters).forEach(([key, value]) => {
+        if (value && value !== 'all' && value !== '') {
+          body[key] = value;
+        }
+      });
+
+      const response = await axios.post(`${API}/students/documents/export`, body, {
+        responseType: 'blob'
+      });
+
+      const url = window.URL.createObjectURL(new Blob([response.data], { type: 'application/zip' }));
+      const link = document.createElement('a');
+      link.href = url;
+      link.setAttribute('download', `documents_${new Date().toISOString().slice(0, 10).replace(/-/g, '')}.zip`);
+      document.body.appendChild(link);
+      link.click();
+      link.remove();
+      window.URL.revokeObjectURL(url);
+    } catch (error) {
+      console.error('Error exporting documents:', error);
+      if (error.response?.status === 404) {
+        alert('No documents match the current filters.');
+      } else {
+        alert('Error exporting documents. Please try again.');
+      }
+    }
+  };
+
   const fetchStudents = async () => {
     setLoading(true);
     try {
@@ -1580,6 +1612,11 @@ const CoordinatorDashboard = () => {
         page: currentPage.toString(),
         limit: pageLimit.toString()
       });
+      // Stepping through pages follows the cursor (no skip, no recount); jumps fall back to page numbers
+      const cursor = pageCursors.current[currentPage];
+      if (cursor) {
+        params.append('cursor', cursor);
+      }
 
       // Add filters
       Object.entries(filters).forEach(([key, value]) => {
@@ -1589,9 +1626,15 @@ const CoordinatorDashboard = () => {
       });
 
       const response = await axios.get(`${API}/students/paginated?${params}`);
+      const { pagination } = response.data;
       setStudents(response.data.students);
-      setTotalPages(response.data.pagination.total_pages);
-      setTotalCount(response.data.pagination.total_count);
+      if (pagination.next_cursor) {
+        pageCursors.current[currentPage + 1] = pagination.next_cursor;
+      }
+      if (pagination.total_count !== null) {
+        setTotalPages(pagination.total_pages);
+        setTotalCount(pagination.total_count);
+      }
     } catch (error) {
       console.error('Error fetching students:', error);
       alert('Error loading students. Please try again.');
@@ -1621,11 +1664,13 @@ const CoordinatorDashboard = () => {
   };
 
   const handleFilterChange = (key, value) => {
+    pageCursors.current = {}; // cursors are tied to the filters they were issued for
     setFilters(prev => ({ ...prev, [key]: value }));
     setCurrentPage(1); // Reset to first page when filters change
   };
 
   const clearFilters = () => {
+    pageCursors.current = {};
     setFilters({
       status: 'all',
       course: 'all',
@@ -1712,15 +1757,29 @@ const CoordinatorDashboard = () => {
   // Add state for image modal
   const [imageModal, setImageModal] = useState({ isOpen: false, imageUrl: '', fileName: '', urlType: 'none', status: 'idle', blob: null });
 
-  const downloadDocument = async (downloadUrl, fileName) => {
+  const downloadDocument = async (downloadUrl, fileName, thumbnailUrl = null) => {
     try {
-      // The downloadUrl already includes /api prefix from backend, so use BACKEND_URL directly
-      const response = await axios.get(`${BACKEND_URL}${downloadUrl}`, {
-        responseType: 'blob'
-      });
-      
       // Check if it's an image file
       const isImage = fileName.toLowerCase().match(/\.(jpg|jpeg|png|gif)$/);
+
+      // Images are viewed through the server-side optimized copy when one exists;
+      // the original is only fetched when the user downloads it
+      let response = null;
+      let isPreview = false;
+      if (isImage && thumbnailUrl) {
+        try {
+          response = await axios.get(`${BACKEND_URL}${thumbnailUrl}?size=optimized`, { responseType: 'blob' });
+          isPreview = true;
+        } catch (previewError) {
+          response = null;
+        }
+      }
+      if (!response) {
+        // The downloadUrl already includes /api prefix from backend, so use BACKEND_URL directly
+        response = await axios.get(`${BACKEND_URL}${downloadUrl}`, {
+          responseType: 'blob'
+        });
+      }
       
       if (isImage) {
         // STAGED LOADER for robust JPG viewing
@@ -1741,7 +1800,7 @@ const CoordinatorDashboard = () => {
             testImg.onerror = () => reject(new Error('objectURL-decode-failed'));
             testImg.src = objectUrl;
           });
-          setImageModal({ isOpen: true, imageUrl: objectUrl, fileName, urlType: 'object', status: 'ok', blob });
+          setImageModal({ isOpen: true, imageUrl: objectUrl, fileName, urlType: 'object', status: 'ok', blob, isPreview, originalUrl: downloadUrl });
           return;
         } catch (e) {
           // continue to Stage B
@@ -1763,11 +1822,11 @@ const CoordinatorDashboard = () => {
             testImg.src = dataUrl;
           });
 
-          setImageModal({ isOpen: true, imageUrl: dataUrl, fileName, urlType: 'data', status: 'ok', blob });
+          setImageModal({ isOpen: true, imageUrl: dataUrl, fileName, urlType: 'data', status: 'ok', blob, isPreview, originalUrl: downloadUrl });
           return;
         } catch (e2) {
           // Stage C: Graceful inline error state in modal (no new tab), keep download working
-          setImageModal({ isOpen: true, imageUrl: '', fileName, urlType: 'none', status: 'fail', blob });
+          setImageModal({ isOpen: true, imageUrl: '', fileName, urlType: 'none', status: 'fail', blob, isPreview, originalUrl: downloadUrl });
           return;
         }
       } else {
@@ -2102,6 +2161,14 @@ const CoordinatorDashboard = () => {
               >
                 Clear Filters
               </Button>
+              <Button 
+                variant="outline" 
+                onClick={exportDocuments}
+                className="border-2 border-gray-400 hover:border-blue-500 hover:bg-blue-50 text-gray-700"
+              >
+                <Download className="h-4 w-4 mr-2" />
+                Export Documents
+              </Button>
               <Button 
                 onClick={() => setShowFilters(false)}
                 className="btn-brand-primary"
@@ -2309,7 +2376,7 @@ const CoordinatorDashboard = () => {
                               <Button
                                 size="sm"
                                 variant="outline"
-                                onClick={() => downloadDocument(doc.download_url, doc.file_name)}
+                                onClick={() => downloadDocument(doc.signed_url || doc.download_url, doc.file_name, doc.thumbnail_url)}
                                 className="flex items-center space-x-1"
                               >
                                 {doc.file_name.toLowerCase().match(/\.(jpg|jpeg|png|gif)$/) ? (
@@ -2379,7 +2446,7 @@ const CoordinatorDashboard = () => {
                   )}
                   
                   <div className="flex items-center space-x-2 ml-auto">
-                    {selectedStudent.signature_data && (
+                    {(selectedStudent.signature_id || selectedStudent.signature_data) && (
                       <Badge variant="outline" className="text-green-600">
                         <Pen className="h-3 w-3 mr-1" />
                         E-Signature Added
@@ -2656,10 +2723,21 @@ const CoordinatorDashboard = () => {
               Close
             </Button>
             <Button 
-              onClick={() => {
+              onClick={async () => {
                 // Download option in modal - ensure we have a blob fallback
                 const link = document.createElement('a');
-                if (imageModal.imageUrl) {
+                if (imageModal.isPreview && imageModal.originalUrl) {
+                  // The modal shows an optimized copy; download the original upload instead
+                  try {
+                    const original = await axios.get(`${BACKEND_URL}${imageModal.originalUrl}`, { responseType: 'blob' });
+                    const tmp = window.URL.createObjectURL(original.data);
+                    link.href = tmp;
+                    setTimeout(() => window.URL.revokeObjectURL(tmp), 10000);
+                  } catch (error) {
+                    alert('Error downloading document. Please try again.');
+                    return;
+                  }
+                } else if (imageModal.imageUrl) {
                   link.href = imageModal.imageUrl;
                 } else if (imageModal.blob) {
                   const tmp = window.URL.createObjectURL(imageModal.blob);
@@ -3721,7 +3799,7 @@ const AdminDashboard = () => {
                 <div className="text-sm font-semibold text-gray-700 mb-2">Current Signature</div>
                 <div className="border rounded bg-white p-4">
                   <img 
-                    src={adminSignature.signature_data} 
+                    src={assetUrl(adminSignature.signature_url)} 
                     alt="Current signature"
                     className="max-w-full h-16 object-contain mx-auto"
                   />
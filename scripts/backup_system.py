@@ -28,6 +28,10 @@ class BackupManager:
         self.db_name = os.environ.get('DB_NAME', 'test_database')
         self.backup_dir = Path('/app/backups')
         self.uploads_dir = Path('/app/backend/uploads')
+        # With STORAGE_BACKEND=s3 the uploaded files live in the bucket instead of uploads_dir
+        self.storage_backend = os.environ.get('STORAGE_BACKEND', 'local').lower()
+        self.s3_bucket = os.environ.get('S3_BUCKET', '')
+        self.s3_uploads_prefix = os.environ.get('S3_PREFIX', '') + 'uploads/'
         
         # Create backup directory
         self.backup_dir.mkdir(exist_ok=True)
@@ -94,11 +98,36 @@ class BackupManager:
         
         client.close()
         
+    def s3_client(self):
+        import boto3
+        return boto3.client(
+            's3',
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None,
+            region_name=os.environ.get('S3_REGION') or None
+        )
+    
+    def s3_upload_keys(self, client):
+        paginator = client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.s3_bucket, Prefix=self.s3_uploads_prefix):
+            for item in page.get('Contents', []):
+                yield item['Key']
+    
     async def backup_files(self, backup_path):
         """Backup uploaded files"""
         print("📁 Backing up uploaded files...")
         
-        if self.uploads_dir.exists():
+        if self.storage_backend == 's3':
+            files_backup_dir = backup_path / 'uploads'
+            client = self.s3_client()
+            file_count = 0
+            for key in self.s3_upload_keys(client):
+                target = files_backup_dir / key[len(self.s3_uploads_prefix):]
+                target.parent.mkdir(parents=True, exist_ok=True)
+                # Large objects are fetched as parallel ranged GETs
+                await asyncio.to_thread(client.download_file, self.s3_bucket, key, str(target))
+                file_count += 1
+            print(f"   ✓ Backed up {file_count} files from s3://{self.s3_bucket}/{self.s3_uploads_prefix}")
+        elif self.uploads_dir.exists():
             files_backup_dir = backup_path / 'uploads'
             shutil.copytree(self.uploads_dir, files_backup_dir)
             
@@ -223,7 +252,20 @@ class BackupManager:
         print("📁 Restoring uploaded files...")
         
         backup_uploads_dir = extract_dir / 'uploads'
-        if backup_uploads_dir.exists():
+        if backup_uploads_dir.exists() and self.storage_backend == 's3':
+            client = self.s3_client()
+            for key in list(self.s3_upload_keys(client)):
+                client.delete_object(Bucket=self.s3_bucket, Key=key)
+            
+            file_count = 0
+            for file_path in backup_uploads_dir.rglob('*'):
+                if file_path.is_file():
+                    key = self.s3_uploads_prefix + file_path.relative_to(backup_uploads_dir).as_posix()
+                    # Multipart, parts in parallel, for large files
+                    await asyncio.to_thread(client.upload_file, str(file_path), self.s3_bucket, key)
+                    file_count += 1
+            print(f"   ✓ Restored {file_count} files to s3://{self.s3_bucket}/{self.s3_uploads_prefix}")
+        elif backup_uploads_dir.exists():
             # Remove current uploads
             if self.uploads_dir.exists():
                 shutil.rmtree(self.uploads_dir)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Login storm benchmark
+Measures /api/students latency (p50/p95/p99) while concurrent logins hammer bcrypt
+"""
+import asyncio
+import aiohttp
+import os
+import statistics
+import sys
+import time
+
+BASE_URL = os.environ.get("BENCHMARK_BASE_URL", "http://localhost:8001")
+AGENT_USERNAME = os.environ.get("BENCHMARK_AGENT_USERNAME", "agent1")
+AGENT_PASSWORD = os.environ.get("BENCHMARK_AGENT_PASSWORD", "agent@123")
+STORM_CONCURRENCY = int(os.environ.get("BENCHMARK_STORM_CONCURRENCY", "50"))
+PROBE_REQUESTS = int(os.environ.get("BENCHMARK_PROBE_REQUESTS", "300"))
+PHASE_SECONDS = float(os.environ.get("BENCHMARK_PHASE_SECONDS", "15"))
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def login(session):
+    async with session.post(f"{BASE_URL}/api/login",
+                            json={"username": AGENT_USERNAME, "password": AGENT_PASSWORD}) as resp:
+        if resp.status != 200:
+            print(f"❌ Login failed: {resp.status} {await resp.text()}")
+            sys.exit(1)
+        return (await resp.json())["access_token"]
+
+async def probe_students(session, token, stop_at):
+    """Issue sequential GET /api/students requests and record their latency in ms"""
+    latencies = []
+    headers = {"Authorization": f"Bearer {token}"}
+    while len(latencies) < PROBE_REQUESTS and time.monotonic() < stop_at:
+        started = time.perf_counter()
+        async with session.get(f"{BASE_URL}/api/students", headers=headers) as resp:
+            await resp.read()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+async def login_storm_worker(session, stop_at, counters):
+    while time.monotonic() < stop_at:
+        async with session.post(f"{BASE_URL}/api/login",
+                                json={"username": AGENT_USERNAME, "password": AGENT_PASSWORD}) as resp:
+            await resp.read()
+            counters[resp.status] = counters.get(resp.status, 0) + 1
+
+def report(label, latencies):
+    print(f"\n📊 {label}")
+    print(f"   requests: {len(latencies)}")
+    print(f"   p50: {statistics.median(latencies):.1f} ms")
+    print(f"   p95: {percentile(latencies, 95):.1f} ms")
+    print(f"   p99: {percentile(latencies, 99):.1f} ms")
+    print(f"   max: {max(latencies):.1f} ms")
+
+async def main():
+    connector = aiohttp.TCPConnector(limit=STORM_CONCURRENCY + 10)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        token = await login(session)
+
+        # 1. Baseline without any login traffic
+        print("1. Measuring baseline /api/students latency...")
+        baseline = await probe_students(session, token, time.monotonic() + PHASE_SECONDS)
+        report("Baseline (no login traffic)", baseline)
+
+        # 2. Same probe while a login storm is running
+        print(f"\n2. Measuring /api/students latency during a {STORM_CONCURRENCY}-way login storm...")
+        stop_at = time.monotonic() + PHASE_SECONDS
+        counters = {}
+        storm = [asyncio.create_task(login_storm_worker(session, stop_at, counters))
+                 for _ in range(STORM_CONCURRENCY)]
+        under_storm = await probe_students(session, token, stop_at)
+        await asyncio.gather(*storm)
+        report("During login storm", under_storm)
+
+        print("\n🔐 Login responses during storm:")
+        for status, count in sorted(counters.items()):
+            print(f"   {status}: {count}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
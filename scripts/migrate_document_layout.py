@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Document layout migration
+Moves stored documents to the two-level uploads/objects/ab/cd/ layout in batches until done.
+Safe to interrupt: the next run continues from the server-side checkpoint.
+"""
+import asyncio
+import aiohttp
+import os
+import sys
+import time
+
+BASE_URL = os.environ.get("MIGRATION_BASE_URL", "http://localhost:8001")
+ADMIN_USERNAME = os.environ.get("MIGRATION_ADMIN_USERNAME", "admin")
+ADMIN_PASSWORD = os.environ.get("MIGRATION_ADMIN_PASSWORD", "admin123")
+BATCH_SIZE = int(os.environ.get("MIGRATION_BATCH_SIZE", "500"))
+BATCH_PAUSE_SECONDS = float(os.environ.get("MIGRATION_BATCH_PAUSE_SECONDS", "0.5"))
+
+async def main():
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{BASE_URL}/api/login",
+                                json={"username": ADMIN_USERNAME, "password": ADMIN_PASSWORD}) as resp:
+            if resp.status != 200:
+                print(f"❌ Login failed: {resp.status} {await resp.text()}")
+                sys.exit(1)
+            token = (await resp.json())["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        restart = "--restart" in sys.argv[1:]
+        moved, rewritten, started = 0, 0, time.perf_counter()
+        while True:
+            params = {"batch_size": BATCH_SIZE, "restart": "true" if restart else "false"}
+            async with session.post(f"{BASE_URL}/api/admin/migrate-document-layout",
+                                    params=params, headers=headers) as resp:
+                if resp.status != 200:
+                    print(f"❌ Batch failed: {resp.status} {await resp.text()}")
+                    sys.exit(1)
+                summary = await resp.json()
+            restart = False
+            moved += summary["moved_objects"]
+            rewritten += summary["rewritten_paths"]
+            print(f"🔄 moved {summary['moved_objects']}, rewrote {summary['rewritten_paths']} paths, "
+                  f"{summary['remaining_objects']} left")
+            if summary["done"]:
+                break
+            # Leaves room for regular traffic between batches
+            await asyncio.sleep(BATCH_PAUSE_SECONDS)
+
+    print("\n📊 Results")
+    print(f"   moved objects: {moved}")
+    print(f"   rewritten paths: {rewritten}")
+    print(f"   elapsed: {time.perf_counter() - started:.1f} s")
+    print("\n✅ Document layout migration complete")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Token number concurrency benchmark
+Creates many students in parallel and verifies every AGI token number is unique
+"""
+import asyncio
+import aiohttp
+import os
+import sys
+import time
+from collections import Counter
+
+BASE_URL = os.environ.get("BENCHMARK_BASE_URL", "http://localhost:8001")
+AGENT_USERNAME = os.environ.get("BENCHMARK_AGENT_USERNAME", "agent1")
+AGENT_PASSWORD = os.environ.get("BENCHMARK_AGENT_PASSWORD", "agent@123")
+STUDENT_COUNT = int(os.environ.get("BENCHMARK_STUDENT_COUNT", "1000"))
+CONCURRENCY = int(os.environ.get("BENCHMARK_CONCURRENCY", "100"))
+COURSE = os.environ.get("BENCHMARK_COURSE", "MBA")
+
+async def create_student(session, headers, index, limiter, results, failures):
+    student_data = {
+        "first_name": "Bench",
+        "last_name": f"Student{index:04d}",
+        "email": f"bench.student{index:04d}@example.com",
+        "phone": f"9{index:09d}",
+        "course": COURSE
+    }
+    async with limiter:
+        async with session.post(f"{BASE_URL}/api/students", json=student_data, headers=headers) as resp:
+            if resp.status == 200:
+                results.append((await resp.json())["token_number"])
+            else:
+                failures.append((resp.status, await resp.text()))
+
+async def main():
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=CONCURRENCY)) as session:
+        async with session.post(f"{BASE_URL}/api/login",
+                                json={"username": AGENT_USERNAME, "password": AGENT_PASSWORD}) as resp:
+            if resp.status != 200:
+                print(f"❌ Login failed: {resp.status} {await resp.text()}")
+                sys.exit(1)
+            token = (await resp.json())["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        print(f"🔄 Creating {STUDENT_COUNT} students with {CONCURRENCY} concurrent requests...")
+        limiter = asyncio.Semaphore(CONCURRENCY)
+        results, failures = [], []
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            create_student(session, headers, index, limiter, results, failures)
+            for index in range(STUDENT_COUNT)
+        ])
+        elapsed = time.perf_counter() - started
+
+    duplicates = {token: count for token, count in Counter(results).items() if count > 1}
+
+    print("\n📊 Results")
+    print(f"   created: {len(results)}")
+    print(f"   failed: {len(failures)}")
+    print(f"   duplicates: {len(duplicates)}")
+    print(f"   elapsed: {elapsed:.2f} s ({len(results) / elapsed:.1f} students/s)")
+    if results:
+        print(f"   token range: {min(results)} .. {max(results)}")
+
+    for status, body in failures[:5]:
+        print(f"   ❌ {status}: {body}")
+    for token, count in list(duplicates.items())[:5]:
+        print(f"   ❌ duplicate {token} x{count}")
+
+    if failures or duplicates:
+        sys.exit(1)
+    print("\n✅ All token numbers unique")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,40 @@
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# server.py reads its Mongo settings at import time (the client connects lazily, so no server is needed)
+# and creates uploads/, receipts/ and blobs/ relative to the working directory
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.chdir(tempfile.mkdtemp(prefix="annaiconnect-tests-"))
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    """In-memory stand-in for server.db, with the unique indexes the code relies on (created on startup)"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import server
+
+    db = mongomock_motor.AsyncMongoMockClient()["test_database"]
+    asyncio.run(db.document_objects.create_index("sha256", unique=True))
+    asyncio.run(db.student_documents.create_index([("student_id", 1), ("type", 1)], unique=True))
+    monkeypatch.setattr(server, "db", db)
+    return db
+
+
+@pytest.fixture
+def client(mock_db):
+    """TestClient whose requests are authenticated as client.user (startup events are not run)"""
+    from fastapi.testclient import TestClient
+    import server
+
+    client = TestClient(server.app)
+    client.user = server.Principal(id="admin-1", username="admin", role="admin")
+    server.app.dependency_overrides[server.get_current_user] = lambda: client.user
+    yield client
+    server.app.dependency_overrides.pop(server.get_current_user, None)
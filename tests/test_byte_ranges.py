@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+from datetime import datetime, timezone
+from email.utils import formatdate
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import server
+
+DATA = bytes(range(256)) * 40  # 10240 bytes
+SHA256 = hashlib.sha256(DATA).hexdigest()
+UPLOADED_AT = datetime(2026, 10, 1, 9, 30)
+LAST_MODIFIED = formatdate(UPLOADED_AT.replace(tzinfo=timezone.utc).timestamp(), usegmt=True)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),  # suffix longer than the file: the whole file
+    ("bytes=900-5000", (900, 999)),  # end clamped to the last byte
+    (" Bytes = 10-20 ", (10, 20)),
+])
+def test_parse_single_range(header, expected):
+    assert server.parse_byte_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "bytes=0-9,20-29",  # multi-range: the whole file instead
+    "items=0-9",
+    "bytes=abc-",
+    "bytes=20-10",
+    "bytes=-",
+])
+def test_ignored_ranges(header):
+    assert server.parse_byte_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=5000-6000"])
+def test_unsatisfiable_range(header):
+    with pytest.raises(HTTPException) as raised:
+        server.parse_byte_range(header, 1000)
+    assert raised.value.status_code == 416
+    assert raised.value.headers["Content-Range"] == "bytes */1000"
+
+
+@pytest.fixture
+def document_url(monkeypatch):
+    # Small chunks so ranged responses span several sends
+    monkeypatch.setattr(server.RangeFileResponse, "chunk_size", 1000)
+    file_path = server.document_store.path_for(SHA256)
+    asyncio.run(server.document_storage.put_bytes(server.upload_storage_key(file_path), DATA))
+    file_info = {"file_name": "marksheet.pdf", "sha256": SHA256, "uploaded_at": UPLOADED_AT}
+    return server.sign_document_url("student-1", "marksheet", str(file_path), file_info)
+
+
+@pytest.fixture
+def browser():
+    """Unauthenticated client: the signed link is the authorization"""
+    return TestClient(server.app)
+
+
+def test_whole_file(browser, document_url):
+    response = browser.get(document_url)
+
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["etag"] == f'"{SHA256}"'
+    assert response.headers["last-modified"] == LAST_MODIFIED
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=0-0", 0, 0),
+    ("bytes=1500-4321", 1500, 4321),
+    ("bytes=9000-", 9000, 10239),
+    ("bytes=-240", 10000, 10239),
+    ("bytes=10000-99999", 10000, 10239),
+])
+def test_partial_content(browser, document_url, header, start, end):
+    response = browser.get(document_url, headers={"Range": header})
+
+    assert response.status_code == 206
+    assert response.content == DATA[start:end + 1]
+    assert response.headers["content-range"] == f"bytes {start}-{end}/{len(DATA)}"
+    assert response.headers["content-length"] == str(end - start + 1)
+
+
+def test_unsatisfiable_range_is_416(browser, document_url):
+    response = browser.get(document_url, headers={"Range": "bytes=10240-"})
+
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(DATA)}"
+
+
+def test_multi_range_falls_back_to_whole_file(browser, document_url):
+    response = browser.get(document_url, headers={"Range": "bytes=0-9,100-109"})
+
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert "content-range" not in response.headers
+
+
+@pytest.mark.parametrize("if_range, status", [
+    (f'"{SHA256}"', 206),
+    (LAST_MODIFIED, 206),
+    ('"a-different-etag"', 200),  # the document changed: the whole file instead
+    ("Wed, 01 Jan 2020 00:00:00 GMT", 200),
+])
+def test_if_range(browser, document_url, if_range, status):
+    response = browser.get(document_url, headers={"Range": "bytes=0-99", "If-Range": if_range})
+
+    assert response.status_code == status
+    assert response.content == (DATA[:100] if status == 206 else DATA)
+
+
+def test_not_modified(browser, document_url):
+    validators = browser.get(document_url).headers
+
+    by_etag = browser.get(document_url, headers={"If-None-Match": f'W/"other", {validators["etag"]}'})
+    by_date = browser.get(document_url, headers={"If-Modified-Since": validators["last-modified"]})
+    # A conditional range request that still matches is answered 304 as well, without a body
+    with_range = browser.get(document_url, headers={"If-None-Match": validators["etag"], "Range": "bytes=0-9"})
+
+    for response in (by_etag, by_date, with_range):
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == validators["etag"]
+
+
+def test_modified(browser, document_url):
+    validators = browser.get(document_url).headers
+
+    changed_etag = browser.get(document_url, headers={"If-None-Match": '"stale"'})
+    # If-None-Match wins over If-Modified-Since when both are sent
+    both = browser.get(
+        document_url, headers={"If-None-Match": '"stale"', "If-Modified-Since": validators["last-modified"]}
+    )
+    older_date = browser.get(document_url, headers={"If-Modified-Since": "Wed, 01 Jan 2020 00:00:00 GMT"})
+
+    for response in (changed_etag, both, older_date):
+        assert response.status_code == 200
+        assert response.content == DATA
@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+@pytest.fixture
+def store(tmp_path, mock_db):
+    storage = server.LocalStorage(tmp_path / "storage")
+    return server.DocumentStore(storage, server.DOCUMENT_STORE_DIR, server.DOCUMENT_DERIVATIVES_DIR)
+
+
+def incoming(tmp_path, data: bytes):
+    path = tmp_path / f"incoming-{uuid.uuid4().hex}"
+    path.write_bytes(data)
+    return path, hashlib.sha256(data).hexdigest()
+
+
+def stored_bytes(store, sha256):
+    return store.storage.local_path(server.upload_storage_key(store.path_for(sha256))).read_bytes()
+
+
+def test_last_release_deletes_object_and_row(store, tmp_path):
+    async def scenario():
+        path, sha256 = incoming(tmp_path, b"report card")
+        await store.ingest(path, sha256, 11, "application/pdf")
+        path, _ = incoming(tmp_path, b"report card")
+        await store.ingest(path, sha256, 11, "application/pdf")
+
+        await store.release(sha256)
+        assert stored_bytes(store, sha256) == b"report card"
+        await store.release(sha256)
+        assert not await store.storage.exists(server.upload_storage_key(store.path_for(sha256)))
+        assert await server.db.document_objects.find_one({"sha256": sha256}) is None
+
+    asyncio.run(scenario())
+
+
+def test_ingest_during_release_waits_and_stores_again(store, tmp_path, monkeypatch):
+    async def scenario():
+        path, sha256 = incoming(tmp_path, b"aadhaar scan")
+        await store.ingest(path, sha256, 12, "image/png")
+
+        deleting, resume = asyncio.Event(), asyncio.Event()
+        delete = store.storage.delete
+
+        async def slow_delete(key):
+            await delete(key)
+            deleting.set()
+            await resume.wait()
+
+        monkeypatch.setattr(store.storage, "delete", slow_delete)
+        release = asyncio.create_task(store.release(sha256))
+        await deleting.wait()
+
+        # The row is claimed for deletion: a new upload of the same bytes must not reuse it
+        assert (await server.db.document_objects.find_one({"sha256": sha256}))["deleting"] is True
+        path, _ = incoming(tmp_path, b"aadhaar scan")
+        ingest = asyncio.create_task(store.ingest(path, sha256, 12, "image/png"))
+        await asyncio.sleep(0.2)
+        assert not ingest.done()
+
+        resume.set()
+        await release
+        await ingest
+        object_doc = await server.db.document_objects.find_one({"sha256": sha256})
+        assert object_doc["refcount"] == 1 and "deleting" not in object_doc
+        assert stored_bytes(store, sha256) == b"aadhaar scan"
+
+    asyncio.run(scenario())
+
+
+
+def claim_deletion(sha256, claimed_at):
+    """Leave the row as release() does when its worker dies between claiming and deleting it"""
+    return server.db.document_objects.update_one(
+        {"sha256": sha256}, {"$set": {"refcount": 0, "deleting": True, "deleting_since": claimed_at}}
+    )
+
+
+def test_ingest_takes_over_abandoned_deletion(store, tmp_path):
+    async def scenario():
+        path, sha256 = incoming(tmp_path, b"birth certificate")
+        await store.ingest(path, sha256, 17, "application/pdf")
+        stale = datetime.utcnow() - timedelta(seconds=server.DOCUMENT_DELETE_CLAIM_SECONDS + 1)
+        await claim_deletion(sha256, stale)
+
+        path, _ = incoming(tmp_path, b"birth certificate")
+        await asyncio.wait_for(store.ingest(path, sha256, 17, "application/pdf"), timeout=5)
+
+        object_doc = await server.db.document_objects.find_one({"sha256": sha256})
+        assert object_doc["refcount"] == 1 and "deleting" not in object_doc
+        assert stored_bytes(store, sha256) == b"birth certificate"
+
+    asyncio.run(scenario())
+
+
+def test_ingest_gives_up_with_503_while_deletion_is_in_progress(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "DOCUMENT_INGEST_WAIT_SECONDS", 0.2)
+
+    async def scenario():
+        path, sha256 = incoming(tmp_path, b"community certificate")
+        await store.ingest(path, sha256, 21, "application/pdf")
+        await claim_deletion(sha256, datetime.utcnow())
+
+        path, _ = incoming(tmp_path, b"community certificate")
+        with pytest.raises(HTTPException) as raised:
+            await store.ingest(path, sha256, 21, "application/pdf")
+        assert raised.value.status_code == 503
+        assert not path.exists()
+        assert (await server.db.document_objects.find_one({"sha256": sha256}))["deleting"] is True
+
+    asyncio.run(scenario())
@@ -0,0 +1,72 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import server
+
+
+def sign_payload(payload):
+    body = server._urlsafe_b64(json.dumps(payload, separators=(",", ":")).encode())
+    signature = server._urlsafe_b64(hmac.new(server.DOCUMENT_URL_KEY, body.encode(), hashlib.sha256).digest())
+    return f"{body}.{signature}"
+
+
+def token_of(url):
+    return url.rsplit("/", 1)[1]
+
+
+def assert_rejected(token, detail="Invalid document link"):
+    with pytest.raises(HTTPException) as exc_info:
+        server.verify_document_url(token)
+    assert exc_info.value.status_code == 403
+    assert exc_info.value.detail == detail
+
+
+def test_signed_url_round_trip():
+    url = server.sign_document_url("student-1", "tc", "uploads/objects/ab/cd/abcd", {"file_name": "tc_a.pdf", "sha256": "abcd"})
+    payload = server.verify_document_url(token_of(url))
+    assert payload["s"] == "student-1"
+    assert payload["p"] == "uploads/objects/ab/cd/abcd"
+    assert payload["e"] > time.time()
+
+
+def test_tampered_body_is_rejected():
+    body, _, signature = token_of(server.sign_document_url("student-1", "tc", "uploads/a.pdf", None)).partition(".")
+    payload = json.loads(base64.urlsafe_b64decode(body + "=" * (-len(body) % 4)))
+    payload["p"] = "uploads/other-student/b.pdf"
+    forged_body = server._urlsafe_b64(json.dumps(payload, separators=(",", ":")).encode())
+    assert_rejected(f"{forged_body}.{signature}")
+
+
+def test_tampered_signature_is_rejected():
+    body, _, signature = token_of(server.sign_document_url("student-1", "tc", "uploads/a.pdf", None)).partition(".")
+    assert_rejected(f"{body}.{signature[:-1]}{'A' if signature[-1] != 'A' else 'B'}")
+    assert_rejected(body)
+
+
+def test_expired_link_is_rejected():
+    assert_rejected(sign_payload({"s": "student-1", "t": "tc", "p": "uploads/a.pdf", "e": int(time.time()) - 1}),
+                    detail="Document link has expired")
+
+
+def test_validly_signed_garbage_is_rejected():
+    body = "not-base64-json"
+    signature = server._urlsafe_b64(hmac.new(server.DOCUMENT_URL_KEY, body.encode(), hashlib.sha256).digest())
+    assert_rejected(f"{body}.{signature}")
+    assert_rejected(sign_payload({"s": "student-1"}))
+
+
+def test_non_ascii_tokens_are_rejected():
+    assert_rejected("abc.éé")
+    assert_rejected("ébody.signature")
+
+
+def test_signed_endpoint_returns_403_for_non_ascii_signature():
+    response = TestClient(server.app).get("/api/documents/signed/abc.%C3%A9%C3%A9")
+    assert response.status_code == 403
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def cache(mock_db, tmp_path, monkeypatch):
+    cache = server.ReceiptRenderCache(server.LocalStorage(tmp_path / "receipts"), 1024 * 1024)
+    monkeypatch.setattr(server, "receipt_render_cache", cache)
+
+    async def render(render_function, **render_args):
+        return f"%PDF {render_args['receipt_number']} {render_args['course']}".encode()
+
+    monkeypatch.setattr(server, "run_receipt_render", render)
+    asyncio.run(mock_db.receipts.insert_one({"student_id": "student-1", "receipt_number": "RCPT-20261017-0001"}))
+    return cache
+
+
+def archived(cache):
+    return sorted(path.name for path in cache.storage.root.iterdir())
+
+
+def load(render_key, course, generated_by=None):
+    render_args = {
+        "receipt_number": "RCPT-20261017-0001",
+        "course": course,
+        "generated_by": generated_by,
+        "is_admin_generated": generated_by is not None
+    }
+    return asyncio.run(server.load_unified_receipt_pdf(render_key, render_args))
+
+
+def test_rerender_replaces_archived_pdf_of_same_variant(cache):
+    load("key-bsc", "B.Sc")
+    load("key-admin", "B.Sc", generated_by="admin")
+    assert archived(cache) == ["key-admin.pdf", "key-bsc.pdf"]
+
+    # The course changed, so the coordinator receipt has a new render key
+    assert load("key-bcom", "B.Com") == b"%PDF RCPT-20261017-0001 B.Com"
+    assert archived(cache) == ["key-admin.pdf", "key-bcom.pdf"]
+    assert asyncio.run(cache.get("key-bsc")) is None
+
+    load("key-bcom", "B.Com")
+    assert archived(cache) == ["key-admin.pdf", "key-bcom.pdf"]
+
+
+def test_admins_keep_their_own_archived_copies(cache, monkeypatch):
+    load("key-priya", "B.Sc", generated_by="priya")
+    load("key-ravi.k", "B.Sc", generated_by="ravi.k")
+    load("key-priya", "B.Sc", generated_by="priya")
+    assert archived(cache) == ["key-priya.pdf", "key-ravi.k.pdf"]
+
+    # Served from the archive on the next worker, without rendering again
+    render = server.run_receipt_render
+    cache.clear()
+    monkeypatch.setattr(server, "run_receipt_render", None)
+    assert load("key-ravi.k", "B.Sc", generated_by="ravi.k") == b"%PDF RCPT-20261017-0001 B.Sc"
+
+    monkeypatch.setattr(server, "run_receipt_render", render)
+    load("key-priya-bcom", "B.Com", generated_by="priya")
+    assert archived(cache) == ["key-priya-bcom.pdf", "key-ravi.k.pdf"]
@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+import server
+
+DATA = os.urandom(3000)
+
+
+@pytest.fixture
+def upload(client, mock_db):
+    asyncio.run(mock_db.students.insert_one({"id": "student-1", "documents": {}}))
+
+    def start(size=len(DATA), file_name="marksheet.pdf"):
+        return client.post(
+            "/api/students/student-1/uploads",
+            json={"document_type": "marksheet", "file_name": file_name, "size": size}
+        )
+
+    return start
+
+
+def put(client, upload_id, offset, body):
+    return client.put(f"/api/uploads/{upload_id}", params={"offset": offset}, content=body)
+
+
+def finalize(client, upload_id, data=DATA):
+    return client.post(f"/api/uploads/{upload_id}/finalize", json={"sha256": hashlib.sha256(data).hexdigest()})
+
+
+def test_upload_in_chunks_and_finalize(client, mock_db, upload):
+    upload_id = upload().json()["upload_id"]
+
+    assert put(client, upload_id, 0, DATA[:1000]).json()["received"] == 1000
+    assert put(client, upload_id, 1000, DATA[1000:2500]).json()["received"] == 2500
+    assert client.get(f"/api/uploads/{upload_id}").json() == {"upload_id": upload_id, "received": 2500, "size": 3000}
+    assert put(client, upload_id, 2500, DATA[2500:]).json()["received"] == 3000
+
+    response = finalize(client, upload_id)
+    assert response.status_code == 200, response.text
+    assert response.json()["sha256"] == hashlib.sha256(DATA).hexdigest()
+    stored_path = asyncio.run(mock_db.students.find_one({"id": "student-1"}))["documents"]["marksheet"]
+    assert stored_path == response.json()["file_path"]
+    assert server.document_storage.local_path(server.upload_storage_key(stored_path)).read_bytes() == DATA
+    assert not server.upload_session_path(upload_id).exists()
+    # The session is used up: finalizing again attaches nothing twice
+    assert finalize(client, upload_id).status_code == 404
+
+
+def test_non_contiguous_offset_is_rejected(client, upload):
+    upload_id = upload().json()["upload_id"]
+    put(client, upload_id, 0, DATA[:1000])
+
+    for offset in (1001, 2000, -1):
+        response = put(client, upload_id, offset, DATA[offset:offset + 100])
+        assert response.status_code == 409
+        assert response.json()["detail"] == {"message": "Offset mismatch", "received": 1000}
+    assert client.get(f"/api/uploads/{upload_id}").json()["received"] == 1000
+
+
+def test_resent_range_is_harmless(client, upload):
+    upload_id = upload().json()["upload_id"]
+    put(client, upload_id, 0, DATA[:2000])
+
+    # A retry of an acknowledged chunk, and one overlapping the end of what was received
+    assert put(client, upload_id, 0, DATA[:1000]).json()["received"] == 2000
+    assert put(client, upload_id, 1500, DATA[1500:]).json()["received"] == 3000
+
+    assert finalize(client, upload_id).status_code == 200
+
+
+def test_checksum_mismatch_discards_upload(client, mock_db, upload):
+    upload_id = upload().json()["upload_id"]
+    put(client, upload_id, 0, DATA)
+
+    response = finalize(client, upload_id, data=b"something else")
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Checksum mismatch; the upload was discarded"
+    assert not server.upload_session_path(upload_id).exists()
+    assert client.get(f"/api/uploads/{upload_id}").status_code == 404
+    assert asyncio.run(mock_db.students.find_one({"id": "student-1"}))["documents"] == {}
+
+
+def test_finalize_before_all_bytes_arrived(client, upload):
+    upload_id = upload().json()["upload_id"]
+    put(client, upload_id, 0, DATA[:1000])
+
+    response = finalize(client, upload_id)
+
+    assert response.status_code == 409
+    assert response.json()["detail"] == {"message": "Upload incomplete", "received": 1000}
+
+
+def test_declared_size_over_the_limit(upload):
+    too_large = upload(size=server.DOCUMENT_PDF_MAX_BYTES + 1)
+    assert too_large.status_code == 413
+    assert upload(size=server.DOCUMENT_IMAGE_MAX_BYTES + 1, file_name="photo.jpg").status_code == 413
+    assert upload(size=0).status_code == 400
+    assert upload(size=server.DOCUMENT_PDF_MAX_BYTES).status_code == 200
+
+
+def test_chunk_past_declared_size(client, upload):
+    upload_id = upload().json()["upload_id"]
+
+    response = put(client, upload_id, 0, DATA + b"extra")
+
+    assert response.status_code == 400
+    assert client.get(f"/api/uploads/{upload_id}").json()["received"] == 0
+
+
+def test_session_is_private_to_its_user(client, upload):
+    upload_id = upload().json()["upload_id"]
+    put(client, upload_id, 0, DATA)
+
+    client.user = server.Principal(id="coordinator-2", username="coordinator", role="coordinator")
+    assert client.get(f"/api/uploads/{upload_id}").status_code == 404
+    assert put(client, upload_id, 0, DATA).status_code == 404
+    assert finalize(client, upload_id).status_code == 404
+    assert client.delete(f"/api/uploads/{upload_id}").status_code == 404
+
+    client.user = server.Principal(id="admin-1", username="admin", role="admin")
+    assert finalize(client, upload_id).status_code == 200
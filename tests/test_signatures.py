@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import io
+import os
+
+import pytest
+from PIL import Image, ImageDraw
+
+import server
+
+
+def png_data_url(image, prefix="data:image/png;base64,"):
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return prefix + base64.b64encode(output.getvalue()).decode()
+
+
+def signature(size=(400, 300), strokes=((100, 100, 199, 149),)):
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for box in strokes:
+        draw.rectangle(box, fill="black")
+    return image
+
+
+def decoded(data_url):
+    header, _, encoded = data_url.partition(",")
+    assert header == "data:image/png;base64"
+    return Image.open(io.BytesIO(base64.b64decode(encoded)))
+
+
+def test_margin_is_trimmed_with_padding():
+    data_url, signature_hash = server.normalize_signature_data(png_data_url(signature()))
+
+    image = decoded(data_url)
+    padding = server.SIGNATURE_TRIM_PADDING
+    assert image.size == (100 + 2 * padding, 50 + 2 * padding)
+    assert image.getpixel((0, 0)) == (255, 255, 255)
+    assert image.getpixel((padding, padding)) == (0, 0, 0)
+    assert signature_hash == hashlib.sha256(base64.b64decode(data_url.partition(",")[2])).hexdigest()
+
+
+def test_same_signature_normalizes_to_same_hash():
+    # Bare base64 and a differently sized canvas: the trimmed strokes are identical
+    moved = signature(size=(800, 600), strokes=((300, 200, 399, 249),))
+    first = server.normalize_signature_data(png_data_url(signature()))
+    second = server.normalize_signature_data(png_data_url(moved, prefix=""))
+
+    assert first == second
+
+
+def test_large_signature_is_scaled_down_to_the_cap():
+    strokes = ((50, 50, 2949, 149), (50, 600, 2949, 699))
+    data_url, _ = server.normalize_signature_data(png_data_url(signature(size=(3000, 800), strokes=strokes)))
+
+    image = decoded(data_url)
+    assert image.width <= server.SIGNATURE_MAX_WIDTH and image.height <= server.SIGNATURE_MAX_HEIGHT
+    assert image.width == server.SIGNATURE_MAX_WIDTH  # aspect ratio kept, bound by the width
+
+
+@pytest.mark.parametrize("mode, background", [("RGBA", (0, 0, 0, 0)), ("LA", (0, 0))])
+def test_transparent_signature_comes_out_rgb_on_white(mode, background):
+    image = Image.new(mode, (300, 200), background)
+    ImageDraw.Draw(image).rectangle((50, 50, 149, 99), fill=(0, 255) if mode == "LA" else (0, 0, 0, 255))
+
+    normalized = decoded(server.normalize_signature_data(png_data_url(image))[0])
+
+    assert normalized.mode == "RGB"
+    assert normalized.getpixel((0, 0)) == (255, 255, 255)  # transparent, not black
+    assert normalized.getpixel((normalized.width // 2, normalized.height // 2)) == (0, 0, 0)
+
+
+def test_palette_transparency_is_flattened():
+    image = signature(strokes=((10, 10, 59, 29),)).convert("P")
+    output = io.BytesIO()
+    image.save(output, format="PNG", transparency=image.getpixel((0, 0)))
+    data_url = "data:image/png;base64," + base64.b64encode(output.getvalue()).decode()
+
+    normalized = decoded(server.normalize_signature_data(data_url)[0])
+
+    assert normalized.mode == "RGB"
+    assert normalized.getpixel((0, 0)) == (255, 255, 255)
+
+
+@pytest.mark.parametrize("value, message", [
+    ("data:text/plain;base64,aGVsbG8=", "expected a base64 image data URL"),
+    ("data:image/png,rawbytes", "expected a base64 image data URL"),
+    ("data:image/png;base64,not base64!", "not valid base64"),
+    ("data:image/png;base64,abc", "not valid base64"),
+    ("data:image/png;base64," + base64.b64encode(b"GIF89a but not really").decode(), "not a readable image"),
+    ("data:image/png;base64,", "not a readable image"),
+])
+def test_malformed_input(value, message):
+    with pytest.raises(ValueError, match=message):
+        server.normalize_signature_data(value)
+
+
+def test_blank_image():
+    with pytest.raises(ValueError, match="image is blank"):
+        server.normalize_signature_data(png_data_url(signature(strokes=())))
+
+
+def test_oversized_upload(monkeypatch):
+    monkeypatch.setattr(server, "SIGNATURE_MAX_UPLOAD_BYTES", 1024)
+    noisy = Image.frombytes("RGB", (100, 100), os.urandom(100 * 100 * 3))  # does not compress
+
+    with pytest.raises(ValueError, match="image exceeds 1024 bytes"):
+        server.normalize_signature_data(png_data_url(noisy))
+
+
+def test_oversized_dimensions(monkeypatch):
+    monkeypatch.setattr(server, "SIGNATURE_MAX_PIXELS", 399 * 300)
+
+    with pytest.raises(ValueError, match="image dimensions are too large"):
+        server.normalize_signature_data(png_data_url(signature()))
+
+
+@pytest.mark.parametrize("signature_data", ["data:image/png;base64,%%%", "data:image/png;base64,aGVsbG8="])
+def test_invalid_signature_upload_is_400(client, signature_data):
+    response = client.post("/api/admin/signature", data={"signature_data": signature_data})
+
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Invalid signature: ")
@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+moto = pytest.importorskip("moto")
+
+import server
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def s3_storage(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.delenv("AWS_PROFILE", raising=False)
+    monkeypatch.setattr(server, "S3_ENDPOINT_URL", None)
+    monkeypatch.setattr(server, "S3_REGION", "us-east-1")
+    # S3's smallest part is 5 MiB, so 6 MiB files go up in two parts
+    monkeypatch.setattr(server, "S3_MULTIPART_THRESHOLD", 5 * MiB)
+    monkeypatch.setattr(server, "S3_MULTIPART_CHUNK_SIZE", 5 * MiB)
+    with moto.mock_aws():
+        monkeypatch.setattr(server, "s3_client", None)
+        server.get_s3_client().create_bucket(Bucket="annaiconnect-test")
+        yield server.S3Storage("annaiconnect-test", "tests/")
+
+
+@pytest.fixture(params=["local", "s3"])
+def storage(request, tmp_path):
+    if request.param == "s3":
+        return request.getfixturevalue("s3_storage")
+    return server.LocalStorage(tmp_path / "storage")
+
+
+def source_file(tmp_path, data: bytes):
+    path = tmp_path / f"source-{hashlib.sha256(data).hexdigest()[:12]}"
+    path.write_bytes(data)
+    return path
+
+
+async def read_range(storage, key, start, end):
+    return b"".join([chunk async for chunk in storage.iter_range(key, start, end)])
+
+
+def test_put_file_consumes_source(storage, tmp_path):
+    async def scenario():
+        source = source_file(tmp_path, b"%PDF-1.4 transfer certificate")
+        await storage.put_file("docs/tc.pdf", source)
+
+        assert not source.exists()
+        assert await storage.get_bytes("docs/tc.pdf") == b"%PDF-1.4 transfer certificate"
+        assert (await storage.stat("docs/tc.pdf")).st_size == 29
+        assert await storage.stat("docs/missing.pdf") is None
+
+    asyncio.run(scenario())
+
+
+def test_put_file_uses_multipart_above_threshold(s3_storage, tmp_path):
+    async def scenario():
+        small = os.urandom(1 * MiB)
+        large = os.urandom(6 * MiB)
+        await s3_storage.put_file("small.bin", source_file(tmp_path, small))
+        await s3_storage.put_file("large.bin", source_file(tmp_path, large))
+
+        client, bucket = s3_storage.client, s3_storage.bucket
+        # Multipart uploads get an ETag of "<md5 of part md5s>-<part count>"
+        assert "-" not in client.head_object(Bucket=bucket, Key="tests/small.bin")["ETag"]
+        assert client.head_object(Bucket=bucket, Key="tests/large.bin")["ETag"].strip('"').endswith("-2")
+        assert await s3_storage.get_bytes("large.bin") == large
+
+    asyncio.run(scenario())
+
+
+def test_iter_range_returns_inclusive_byte_range(storage, monkeypatch):
+    monkeypatch.setattr(server, "DOWNLOAD_CHUNK_SIZE", 7)
+
+    async def scenario():
+        data = bytes(range(256)) * 4
+        await storage.put_bytes("blob.bin", data)
+
+        assert await read_range(storage, "blob.bin", 0, len(data) - 1) == data
+        assert await read_range(storage, "blob.bin", 100, 100) == data[100:101]
+        assert await read_range(storage, "blob.bin", 250, 600) == data[250:601]
+        assert await read_range(storage, "blob.bin", 1000, len(data) - 1) == data[1000:]
+
+    asyncio.run(scenario())
+
+
+def test_local_copy_yields_object_bytes(storage, tmp_path):
+    async def scenario():
+        data = os.urandom(6 * MiB)
+        await storage.put_file("photos/large.jpg", source_file(tmp_path, data))
+
+        async with storage.local_copy("photos/large.jpg") as copy_path:
+            assert copy_path.read_bytes() == data
+        if storage.local_path("photos/large.jpg") is None:
+            assert not copy_path.exists()  # temporary download removed after the block
+
+    asyncio.run(scenario())
+
+
+def test_delete_prefix_removes_only_that_folder(storage):
+    async def scenario():
+        for key in ("derived/ab/cd/one/small.jpg", "derived/ab/cd/one/medium.jpg", "derived/ab/cd/two/small.jpg"):
+            await storage.put_bytes(key, b"jpeg")
+
+        await storage.delete_prefix("derived/ab/cd/one/")
+        await storage.delete_prefix("derived/never/written/")
+
+        assert not await storage.exists("derived/ab/cd/one/small.jpg")
+        assert not await storage.exists("derived/ab/cd/one/medium.jpg")
+        assert await storage.exists("derived/ab/cd/two/small.jpg")
+
+    asyncio.run(scenario())
+
+
+def test_document_store_ingest_release_round_trip(storage, mock_db, tmp_path):
+    store = server.DocumentStore(storage, server.DOCUMENT_STORE_DIR, server.DOCUMENT_DERIVATIVES_DIR)
+    data = b"%PDF-1.4 marksheet"
+    sha256 = hashlib.sha256(data).hexdigest()
+    object_key = server.upload_storage_key(store.path_for(sha256))
+    thumbnail_key = server.upload_storage_key(store.derivatives_dir(sha256) / "small.jpg")
+
+    async def scenario():
+        first_path = await store.ingest(source_file(tmp_path, data), sha256, len(data), "application/pdf")
+        second_source = source_file(tmp_path, data)
+        second_path = await store.ingest(second_source, sha256, len(data), "application/pdf")
+        await storage.put_bytes(thumbnail_key, b"jpeg")
+
+        assert first_path == second_path == store.path_for(sha256)
+        assert not second_source.exists()
+        assert await storage.get_bytes(object_key) == data
+        assert (await mock_db.document_objects.find_one({"sha256": sha256}))["refcount"] == 2
+
+        await store.release(sha256)
+        assert await storage.exists(object_key)
+
+        await store.release(sha256)
+        assert not await storage.exists(object_key)
+        assert not await storage.exists(thumbnail_key)
+        assert await mock_db.document_objects.find_one({"sha256": sha256}) is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,81 @@
+import asyncio
+import hashlib
+import uuid
+from types import SimpleNamespace
+
+import server
+
+
+def add_students(db, count):
+    asyncio.run(db.students.insert_many([
+        {"id": f"student-{n}", "documents": {"tc": f"uploads/student-{n}/tc_{n}.pdf"}} for n in range(count)
+    ]))
+
+
+def test_interrupted_backfill_is_finished_on_next_start(mock_db):
+    add_students(mock_db, 3)
+    # A first start that created one record before stopping
+    asyncio.run(mock_db.student_documents.insert_one(
+        {"student_id": "student-0", "type": "tc", "path": "uploads/student-0/tc_0.pdf"}
+    ))
+
+    asyncio.run(server.create_student_document_records())
+
+    assert asyncio.run(mock_db.student_documents.count_documents({})) == 3
+    assert asyncio.run(mock_db.migrations.find_one({"_id": "student_document_records"}))["done"] is True
+
+
+def test_backfill_is_skipped_once_completed(mock_db):
+    asyncio.run(server.create_student_document_records())
+    add_students(mock_db, 2)
+
+    asyncio.run(server.create_student_document_records())
+
+    assert asyncio.run(mock_db.student_documents.count_documents({})) == 0
+
+
+class HeldStudents:
+    """db.students whose documents.tc $set for a given path waits until released"""
+
+    def __init__(self, students, held_path):
+        self.students = students
+        self.held_path = held_path
+        self.release = asyncio.Event()
+
+    def __getattr__(self, name):
+        return getattr(self.students, name)
+
+    async def update_one(self, filter, update, *args, **kwargs):
+        if update.get("$set", {}).get("documents.tc") == self.held_path and "documents.tc" not in filter:
+            await self.release.wait()
+        return await self.students.update_one(filter, update, *args, **kwargs)
+
+
+def test_overlapping_uploads_leave_student_on_latest_record(mock_db, tmp_path, monkeypatch):
+    add_students(mock_db, 1)
+    user = SimpleNamespace(id="agent-1")
+
+    def upload(data):
+        path = tmp_path / f"incoming-{uuid.uuid4().hex}"
+        path.write_bytes(data)
+        stored = {"sha256": hashlib.sha256(data).hexdigest(), "size": len(data)}
+        return server.attach_student_document("student-0", "tc", "tc.pdf", "application/pdf", path, stored, user)
+
+    async def scenario():
+        first_path = str(server.document_store.path_for(hashlib.sha256(b"first").hexdigest()))
+        students = HeldStudents(mock_db.students, first_path)
+        monkeypatch.setattr(mock_db, "students", students, raising=False)
+
+        # The first upload swaps its record in, then its students $set is delayed past the second upload
+        first = asyncio.create_task(upload(b"first"))
+        await asyncio.sleep(0.1)
+        second_path = await upload(b"second")
+        students.release.set()
+        await first
+
+        record = await mock_db.student_documents.find_one({"student_id": "student-0", "type": "tc"})
+        student = await mock_db.students.find_one({"id": "student-0"})
+        assert record["path"] == str(second_path)
+        assert student["documents"]["tc"] == str(second_path)
+
+    asyncio.run(scenario())
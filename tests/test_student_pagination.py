@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+
+BASE_TIME = datetime(2026, 10, 1, 9, 30)
+
+
+@pytest.fixture
+def students(mock_db):
+    docs = []
+    for n in range(23):
+        # Pairs of rows share created_at (sub-millisecond apart, which Mongo stores as the same millisecond)
+        created_at = BASE_TIME + timedelta(minutes=n // 4, milliseconds=n % 4 // 2 * 5, microseconds=n % 2 * 300)
+        docs.append({
+            "id": f"student-{n:02d}",
+            "first_name": f"First{n}",
+            "last_name": "Student",
+            "token_number": f"AGI2610{n:04d}",
+            "course": "B.Sc" if n % 2 else "B.Com",
+            "status": "pending",
+            "email": f"student{n}@example.com",
+            "phone": "9999999999",
+            "agent_id": "agent-1",
+            "created_at": created_at,
+            "updated_at": created_at
+        })
+    asyncio.run(mock_db.students.insert_many(docs))
+    return docs
+
+
+def walk(client, limit, **params):
+    ids, cursor = [], None
+    for _ in range(100):
+        response = client.get("/api/students/paginated", params={"limit": limit, "cursor": cursor, **params})
+        assert response.status_code == 200, response.text
+        pagination = response.json()["pagination"]
+        ids += [student["id"] for student in response.json()["students"]]
+        cursor = pagination["next_cursor"]
+        if not cursor:
+            assert not pagination["has_next"]
+            return ids
+    pytest.fail("cursor walk did not finish")
+
+
+@pytest.mark.parametrize("limit", [1, 3, 4, 5, 50])
+def test_cursor_walk_returns_every_student_once(client, students, limit):
+    ids = walk(client, limit)
+
+    assert len(ids) == len(set(ids)) == len(students)
+    assert ids == [doc["id"] for doc in sorted(students, key=lambda doc: (doc["created_at"], doc["id"]), reverse=True)]
+
+
+def test_cursor_walk_with_filters(client, students):
+    ids = walk(client, 2, course="B.Sc")
+
+    assert sorted(ids) == sorted(doc["id"] for doc in students if doc["course"] == "B.Sc")
+
+
+def test_cursor_from_other_filters_is_rejected(client, students):
+    cursor = client.get("/api/students/paginated", params={"limit": 5}).json()["pagination"]["next_cursor"]
+
+    response = client.get("/api/students/paginated", params={"limit": 5, "cursor": cursor, "course": "B.Sc"})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Cursor does not match the current filters"
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "e30", server._urlsafe_b64(b'{"c":"yesterday","i":"x","f":"y"}'), "%%%"])
+def test_malformed_cursor_is_rejected(client, students, cursor):
+    response = client.get("/api/students/paginated", params={"cursor": cursor})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_count_modes(client, students, monkeypatch):
+    def pagination(**params):
+        response = client.get("/api/students/paginated", params={"limit": 10, **params})
+        assert response.status_code == 200, response.text
+        return response.json()["pagination"]
+
+    exact = pagination()
+    assert (exact["total_count"], exact["total_count_exact"], exact["total_pages"]) == (23, True, 3)
+
+    unfiltered = pagination(count="estimated")
+    assert (unfiltered["total_count"], unfiltered["total_count_exact"]) == (23, False)
+    assert pagination(count="estimated", course="B.Sc")["total_count"] == 11
+    monkeypatch.setattr(server, "STUDENT_COUNT_ESTIMATE_LIMIT", 5)
+    capped = pagination(count="estimated", course="B.Sc")
+    assert (capped["total_count"], capped["total_count_exact"]) == (5, False)
+
+    skipped = pagination(count="none")
+    assert (skipped["total_count"], skipped["total_pages"], skipped["has_next"]) == (None, None, True)
+    # Cursor pages skip counting unless asked
+    assert pagination(cursor=exact["next_cursor"])["total_count"] is None
+    assert pagination(cursor=exact["next_cursor"], count="exact")["total_count"] == 23
+
+    assert client.get("/api/students/paginated", params={"count": "all"}).status_code == 400
@@ -0,0 +1,36 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def prefix(mock_db, monkeypatch):
+    monkeypatch.setattr(server, "seeded_token_prefixes", set())
+    return f"AGI{datetime.now().strftime('%y%m')}"
+
+
+def add_tokens(db, *tokens):
+    asyncio.run(db.students.insert_many([{"id": token, "token_number": token} for token in tokens]))
+
+
+def test_first_token_of_month(prefix):
+    assert asyncio.run(server.generate_token_number()) == f"{prefix}0001"
+    assert asyncio.run(server.generate_token_number()) == f"{prefix}0002"
+
+
+def test_counter_is_seeded_from_numeric_maximum(mock_db, prefix):
+    # As strings, 10000 sorts below 9999; last month's and malformed tokens are ignored
+    add_tokens(mock_db, f"{prefix}9999", f"{prefix}10000", f"{prefix}0042", f"{prefix}abc", "AGI99129999999")
+
+    assert asyncio.run(server.generate_token_number()) == f"{prefix}10001"
+
+
+def test_counter_is_not_moved_backwards_by_reseed(mock_db, prefix):
+    add_tokens(mock_db, f"{prefix}0007")
+    assert asyncio.run(server.generate_token_number()) == f"{prefix}0008"
+
+    server.seeded_token_prefixes.clear()
+    assert asyncio.run(server.generate_token_number()) == f"{prefix}0009"